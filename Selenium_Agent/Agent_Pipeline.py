@@ -38,64 +38,28 @@ def run_scraper():
 
 
 
-def process_df(df):
-    players_joined = df['Player_Joined'][0]
-    print('number of players joined:', players_joined)
-    #need to convert the string number into int
-    players_joined = int(str(players_joined).replace(',', ''))
-    ad_to_column = {}
-    ads = ['Ad1', 'Ad2', 'Ad3', 'Ad4', 'Ad5', 'Ad6', 'Ad7', 'Ad8', 'Ad9']
-    for c in df.columns:
-        ad = c[2:5]
-        if ad in ads and ad in ad_to_column:
-            tag = c[6:]
-            ad_to_column[ad].append((tag, df[c][0]))
-        elif ad in ads and not ad in ad_to_column:
-            tag = c[6:]
-            ad_to_column[ad] = [(tag, df[c][0])]
-    df = pd.DataFrame.from_dict({k: dict(v) for k, v in ad_to_column.items()}, orient='index')
-    df = df.applymap(lambda x: pd.to_numeric(str(x).replace(',', ''), errors='coerce'))
-
-    # Define groups based on column names
-    close_cols = [col for col in df.columns if 'Close' in col]
-    medium_cols = [col for col in df.columns if 'Med' in col]
-    far_cols = [col for col in df.columns if 'Far' in col]
-
-    # Create accumulative columns
-    df['Close Accumulative'] = df[close_cols].sum(axis=1)/players_joined
-    df['Medium Accumulative'] = df[medium_cols].sum(axis=1)/players_joined
-    df['Far Accumulative'] = df[far_cols].sum(axis=1)/players_joined
-    df['Overall Accumulative'] = df.sum(axis=1)/players_joined
-
-    df = df.reindex(sorted(df.columns), axis=1)
-    df = df.sort_index()
-    return df
+AD_NAMES = ['Ad1', 'Ad2', 'Ad3', 'Ad4', 'Ad5', 'Ad6', 'Ad7', 'Ad8', 'Ad9']
 
 import os
-import zipfile
 import pandas as pd
+from export_ingest import DownloadWatcher, open_export_csv
+from game_id_processing import process_ad_table
 
-run_scraper()
 # Define the downloads directory
 downloads_dir = os.path.expanduser("~/Downloads")
+# Watching from before the export is clicked means only the zip it produces can be picked up
+with DownloadWatcher(downloads_dir) as watcher:
+    run_scraper()
+    zip_path = watcher.wait()
 
-zip_files = [f for f in os.listdir(downloads_dir) if f.endswith(".zip")]
-latest_zip = max(zip_files, key=lambda f: os.path.getctime(os.path.join(downloads_dir, f)))
-
-zip_path = os.path.join(downloads_dir, latest_zip)
-
-with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-    zip_ref.extractall(downloads_dir)
-    extracted_files = zip_ref.namelist()
-
-csv_files = [f for f in extracted_files if f.endswith(".csv")]
-if csv_files:
-    latest_csv = os.path.join(downloads_dir, csv_files[0])
-    
-    # Read the CSV file into a DataFrame
-    df = pd.read_csv(latest_csv)
+try:
+    # Read straight out of the zip; process_ad_table only looks at the first row of the ad and Player_Joined columns
+    with open_export_csv(zip_path) as stream:
+        df = pd.read_csv(stream, nrows=1, dtype=str,
+                         usecols=lambda col: col[2:5] in AD_NAMES or col == 'Player_Joined')
+except FileNotFoundError:
+    print("No CSV files found in the exported zip.")
+else:
     print(df)
-    new_df = process_df(df)
+    new_df = process_ad_table(df, 'Player_Joined', AD_NAMES)
     new_df.to_csv('processed.csv')
-else:
-    print("No CSV files found in the extracted contents.")
\ No newline at end of file
@@ -14,8 +14,7 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 import pandas as pd
 import os
-from game_id_processing import compress_algos, process_df
-import zipfile
+from export_ingest import DownloadWatcher, process_export_zip
 command = [
     '/Applications/Google Chrome.app/Contents/MacOS/Google Chrome',
     '--remote-debugging-port=9222',
@@ -134,32 +133,19 @@ def run_scraper():
     driver.quit()
 
         
-run_scraper()
 downloads_dir = os.path.expanduser("~/Downloads")
-
-zip_files = [f for f in os.listdir(downloads_dir) if f.endswith(".zip")]
-latest_zip = max(zip_files, key=lambda f: os.path.getctime(os.path.join(downloads_dir, f)))
-
-zip_path = os.path.join(downloads_dir, latest_zip)
-with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-    zip_ref.extractall(downloads_dir)
-    extracted_files = zip_ref.namelist()
-csv_files = [f for f in extracted_files if f.endswith(".csv")]
-if csv_files:
-    latest_csv = os.path.join(downloads_dir, csv_files[0])
-    df = pd.read_csv(latest_csv)
-
-    # Add a new column for the number of players for each 3.x versio
-    decompressed_dfs = compress_algos(df)
-    for code, df in decompressed_dfs.items():
-        new_df = process_df(df)
+# Watching from before the export is clicked means only the zip it produces can be picked up
+with DownloadWatcher(downloads_dir) as watcher:
+    run_scraper()
+    zip_path = watcher.wait()
+
+# The CSV is parsed straight out of the zip in chunks, reading only the HgAd columns
+try:
+    processed_dfs = process_export_zip(zip_path)
+except FileNotFoundError:
+    print("No CSV files found in the exported zip.")
+else:
+    for code, new_df in processed_dfs.items():
         new_df.to_csv(code + "_test.csv")
         print(f"Decompressed DataFrame for {code}:")
         print(new_df) 
-else:
-    print("No CSV files found in the extracted contents.")
-
-
-
-
-
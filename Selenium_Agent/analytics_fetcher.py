@@ -0,0 +1,275 @@
+#Pulls analytics exports for many (project, fromTs, toTs) windows at once over pooled HTTP connections, instead of clicking through the dashboard in Chrome
+import argparse
+import asyncio
+import io
+import logging
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Mapping, Optional, Tuple
+
+import aiohttp
+import pandas as pd
+
+from export_ingest import process_export_zip
+from game_id_processing import EXPORT_CHUNK_ROWS, process_export_csv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import timer, increment
+
+logger = logging.getLogger(__name__)
+
+# The analytics-device endpoint API-Retrieval.py calls; a window is fetched from <url>/<project>?fromTs=..&toTs=..
+ANALYTICS_URL = os.environ.get('ANALYTICS_URL', 'https://create.fortnite.com/api/analytics/v1/analytics-device')
+# Connections open at once, and requests started per second at most (0 for no limit)
+FETCH_CONCURRENCY = int(os.environ.get('FETCH_CONCURRENCY', '8'))
+FETCH_RATE = float(os.environ.get('FETCH_RATE', '10'))
+# Further attempts after a failed one, and seconds a single attempt may take
+FETCH_RETRIES = int(os.environ.get('FETCH_RETRIES', '4'))
+FETCH_TIMEOUT = float(os.environ.get('FETCH_TIMEOUT', '30'))
+# Backoff doubles from BACKOFF_SECONDS per attempt up to MAX_BACKOFF_SECONDS, also the cap on Retry-After
+BACKOFF_SECONDS = 0.5
+MAX_BACKOFF_SECONDS = 60.0
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+# (project, fromTs, toTs), timestamps in epoch milliseconds
+Window = Tuple[str, int, int]
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, url: str):
+        super().__init__(f"HTTP {status} for {url}")
+        self.status = status
+
+
+class RateLimiter:
+    """
+    Token bucket: on average `rate` acquisitions a second, in bursts of at most `burst`
+
+    pause() holds back every acquisition for a while, so one window's 429 slows
+    down all the windows sharing the limiter rather than just its own retry.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """No acquisitions for the next `seconds`, on top of any pause already running"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self) -> None:
+        # Waiters queue on the lock, so tokens go out in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    # Resume with a single token rather than a burst of the requests held back
+                    self.tokens = 1.0
+                    self.updated = time.monotonic()
+                    continue
+                if self.rate <= 0:
+                    return
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                # A pause that starts meanwhile is picked up on the next pass
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def retry_after(headers: Mapping[str, str]) -> float:
+    """Seconds the server asked to wait (Retry-After as seconds or an HTTP date), 0 if it didn't say"""
+    value = headers.get('Retry-After')
+    if not value:
+        return 0.0
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def window_url(window: Window, base_url: str = ANALYTICS_URL) -> str:
+    project, from_ts, to_ts = window
+    return f"{base_url.rstrip('/')}/{project}?fromTs={from_ts}&toTs={to_ts}"
+
+
+async def fetch_window(session: aiohttp.ClientSession, limiter: RateLimiter, window: Window,
+                       headers: Optional[Dict[str, str]] = None, base_url: str = ANALYTICS_URL,
+                       retries: int = FETCH_RETRIES) -> bytes:
+    """
+    Body of one window's export, retried with jittered exponential backoff
+
+    Connection failures, timeouts, broken bodies and the statuses in
+    RETRY_STATUSES are retried, waiting at least as long as Retry-After says.
+    A 429, or any response with Retry-After, pauses the shared limiter too.
+
+    Raises:
+        HTTPError: On any other status, or a retryable one on the last attempt
+        aiohttp.ClientError: If the last attempt failed to connect or read, asyncio.TimeoutError if it timed out
+    """
+    url = window_url(window, base_url)
+    for attempt in range(retries + 1):
+        await limiter.acquire()
+        delay = min(MAX_BACKOFF_SECONDS, BACKOFF_SECONDS * 2 ** attempt) * random.uniform(0.5, 1.0)
+        try:
+            async with session.get(url, headers=headers) as response:
+                status = response.status
+                wait = min(retry_after(response.headers), MAX_BACKOFF_SECONDS)
+                # aiohttp undoes gzip/deflate content encoding itself
+                body = await response.read() if status == 200 else b''
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt == retries:
+                raise
+            logger.warning("Attempt %d for %s failed: %s", attempt + 1, url, f"{type(e).__name__}: {str(e)}")
+        else:
+            if status == 200:
+                return body
+            if status not in RETRY_STATUSES or attempt == retries:
+                raise HTTPError(status, url)
+            if status == 429 or wait:
+                limiter.pause(max(wait, delay))
+                increment('fetch.throttled')
+            delay = max(delay, wait)
+            logger.warning("Attempt %d for %s got HTTP %d", attempt + 1, url, status)
+        increment('fetch.retry')
+        await asyncio.sleep(delay)
+
+
+async def fetch_windows(windows: List[Window], headers: Optional[Dict[str, str]] = None,
+                        base_url: str = ANALYTICS_URL, concurrency: int = FETCH_CONCURRENCY,
+                        rate: float = FETCH_RATE, retries: int = FETCH_RETRIES,
+                        timeout: float = FETCH_TIMEOUT) -> Dict[Window, object]:
+    """
+    Fetch every window concurrently over one aiohttp session and rate limit
+
+    The session's connector keeps at most `concurrency` keep-alive connections
+    open and reuses them across windows.
+
+    Returns:
+        dict: window -> response body, or the exception its last attempt ended
+            with, so one failing window doesn't cost the others
+    """
+    windows = list(dict.fromkeys(windows))
+    limiter = RateLimiter(rate)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        bodies = await asyncio.gather(*(fetch_window(session, limiter, window, headers, base_url, retries)
+                                        for window in windows), return_exceptions=True)
+    return dict(zip(windows, bodies))
+
+
+def export_tables(body: bytes, chunksize: int = EXPORT_CHUNK_ROWS) -> Dict[str, pd.DataFrame]:
+    """
+    process_export_csv for a downloaded export, the CSV itself or the zip the dashboard's export button produces
+
+    Raises:
+        FileNotFoundError: If a zip holds no CSV
+        ValueError: If the body is JSON rather than an export
+    """
+    if body[:4] == b'PK\x03\x04':
+        return process_export_zip(io.BytesIO(body), chunksize)
+    if body.lstrip()[:1] in (b'{', b'['):
+        raise ValueError("Expected an export CSV or zip, got a JSON response")
+    return process_export_csv(io.BytesIO(body), chunksize)
+
+
+def fetch_exports(windows: List[Window], headers: Optional[Dict[str, str]] = None, base_url: str = ANALYTICS_URL,
+                  concurrency: int = FETCH_CONCURRENCY, rate: float = FETCH_RATE, retries: int = FETCH_RETRIES,
+                  timeout: float = FETCH_TIMEOUT, chunksize: int = EXPORT_CHUNK_ROWS
+                  ) -> Tuple[Dict[Window, Dict[str, pd.DataFrame]], Dict[Window, str]]:
+    """
+    Download every window and turn each export into its per-version tables
+
+    Runs its own event loop, so call it from synchronous code.
+
+    Returns:
+        tuple: (window -> version code -> table as written to <code>_test.csv,
+            window -> error message for the windows that failed)
+    """
+    with timer('fetch.download'):
+        bodies = asyncio.run(fetch_windows(windows, headers, base_url, concurrency, rate, retries, timeout))
+    tables, errors = {}, {}
+    with timer('fetch.process'):
+        for window, body in bodies.items():
+            try:
+                if isinstance(body, BaseException):
+                    raise body
+                tables[window] = export_tables(body, chunksize)
+            except Exception as e:
+                errors[window] = f"{type(e).__name__}: {str(e)}"
+    for window, error in errors.items():
+        increment('fetch.error')
+        logger.error("Window %s failed: %s", window, error)
+    return tables, errors
+
+
+def day_windows(projects: List[str], start: datetime, days: int) -> List[Window]:
+    """One window per project and UTC day from start, each covering the whole day"""
+    start = datetime(start.year, start.month, start.day, tzinfo=timezone.utc)
+    windows = []
+    for project in projects:
+        for day in range(days):
+            from_ts = int((start + timedelta(days=day)).timestamp() * 1000)
+            windows.append((project, from_ts, from_ts + 24 * 3600 * 1000 - 1))
+    return windows
+
+
+def default_headers() -> Dict[str, str]:
+    """Request headers with the dashboard session from ANALYTICS_COOKIE and ANALYTICS_CSRF_TOKEN"""
+    headers = {
+        "accept": "*/*",
+        "accept-encoding": "gzip, deflate",
+        "content-type": "application/json",
+        "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36",
+    }
+    if os.environ.get('ANALYTICS_COOKIE'):
+        headers["cookie"] = os.environ['ANALYTICS_COOKIE']
+    if os.environ.get('ANALYTICS_CSRF_TOKEN'):
+        headers["x-csrf-token"] = os.environ['ANALYTICS_CSRF_TOKEN']
+    return headers
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download and process analytics exports for many islands and days")
+    parser.add_argument("projects", nargs="+", help="Island codes, e.g. 8234-1352-6956")
+    parser.add_argument("--start", default=None, help="First UTC day as YYYY-MM-DD (default: yesterday)")
+    parser.add_argument("--days", type=int, default=1)
+    parser.add_argument("-o", "--output", default="exports", help="Tables go to <output>/<project>/<day>/<code>_test.csv")
+    parser.add_argument("--url", default=ANALYTICS_URL)
+    parser.add_argument("--concurrency", type=int, default=FETCH_CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=FETCH_RATE, help="Requests per second at most")
+    parser.add_argument("--retries", type=int, default=FETCH_RETRIES)
+    args = parser.parse_args()
+
+    start = (datetime.strptime(args.start, "%Y-%m-%d") if args.start
+             else datetime.now(timezone.utc) - timedelta(days=1))
+    windows = day_windows(args.projects, start, args.days)
+    started = time.perf_counter()
+    tables, errors = fetch_exports(windows, default_headers(), args.url, args.concurrency, args.rate, args.retries)
+    for (project, from_ts, _), processed_dfs in tables.items():
+        day = datetime.fromtimestamp(from_ts / 1000, timezone.utc).strftime("%Y-%m-%d")
+        out_dir = os.path.join(args.output, project, day)
+        os.makedirs(out_dir, exist_ok=True)
+        for code, new_df in processed_dfs.items():
+            new_df.to_csv(os.path.join(out_dir, code + "_test.csv"))
+    print(f"{len(tables)}/{len(windows)} windows fetched in {time.perf_counter() - started:.1f}s; tables in {args.output}")
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper())
+    main()
@@ -1,13 +1,20 @@
 import pandas as pd
 import os
+import sys
+
+# The impressions cube lives at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from impressions_cube import ImpressionsCube
 
 version = 8
 
 # Create latest_data directory if it doesn't exist
 os.makedirs('latest_data', exist_ok=True)
+# Day files are appended to the columnar cube once; the frames are rebuilt from its memory maps
+cube = ImpressionsCube.from_directory('latest_data')
 df_list = []
 for i in range(version):
-    df_list.append(pd.read_csv(f"latest_data/Hg3.{i+1}_test.csv"))
+    df_list.append(cube.day_frame_by_name(f"Hg3.{i+1}_test.csv"))
 print(len(df_list))
 char_to_tag = {'A': [1,1,1], 'B':[1,2,2], 'C':[1,1,3],'D': [2,2,1],'E':[2,2,2],'F':[2,1,2],'G':[3,2,3],'H':[3,1,2],'I':[3,1,3],'J':[2,1,1], 'K':[1,1,2]}
 day_to_sequence = {1:'ABCDEFGH', 2: 'BCDEFGHI', 3: 'CDEFGHIA', 4: 'DEFGHIJK', 5: 'EFGHIJKA', 6: 'FGHIJKAB', 7: 'GHIJKABC', 8: 'HIJKABCD'}
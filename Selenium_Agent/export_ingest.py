@@ -0,0 +1,177 @@
+#Picks up an analytics export zip as soon as it is downloaded and processes its CSV straight out of the archive
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import time
+import zipfile
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from game_id_processing import EXPORT_CHUNK_ROWS, process_export_csv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import timer
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_TIMEOUT = float(os.environ.get('DOWNLOAD_TIMEOUT', '120'))
+# How often the directory is re-listed without change notifications, or while a zip is still being written
+POLL_SECONDS = 0.5
+
+# inotify(7) event bits
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class DownloadWatcher:
+    """
+    Waits for a new zip to land in a directory, such as Chrome's Downloads.
+
+    Created before the export is triggered, it notes the names already in the
+    directory once and then sleeps on change notifications (inotify on Linux,
+    kqueue on macOS/BSD, a names-only poll elsewhere) instead of rescanning and
+    stat-ing every file. Only a zip that appears after the watch started and
+    reads as a complete archive is returned, so older exports or other files
+    landing in the directory can't be picked up. Chrome downloads into a
+    .crdownload file and renames it when done, so the .zip name normally
+    appears complete.
+    """
+
+    def __init__(self, directory: str, suffix: str = '.zip'):
+        self.directory = directory
+        self.suffix = suffix
+        self.seen = set(os.listdir(directory))
+        self.pending = set()
+        self._inotify_fd = None
+        self._kqueue = None
+        self._dir_fd = None
+        if sys.platform.startswith('linux'):
+            self._open_inotify()
+        elif hasattr(select, 'kqueue'):
+            self._open_kqueue()
+
+    def _open_inotify(self) -> None:
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            return
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            logger.warning("inotify unavailable (errno %d), polling %s", ctypes.get_errno(), self.directory)
+            return
+        if libc.inotify_add_watch(fd, os.fsencode(self.directory), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            logger.warning("Cannot watch %s (errno %d), polling instead", self.directory, ctypes.get_errno())
+            os.close(fd)
+            return
+        self._inotify_fd = fd
+
+    def _open_kqueue(self) -> None:
+        # O_EVTONLY keeps the watch from holding the volume busy on macOS
+        self._dir_fd = os.open(self.directory, getattr(os, 'O_EVTONLY', os.O_RDONLY))
+        self._kqueue = select.kqueue()
+        event = select.kevent(self._dir_fd, filter=select.KQ_FILTER_VNODE,
+                              flags=select.KQ_EV_ADD | select.KQ_EV_CLEAR, fflags=select.KQ_NOTE_WRITE)
+        self._kqueue.control([event], 0)
+
+    def _changes(self, timeout: float) -> List[str]:
+        """Names that may have appeared within timeout seconds"""
+        if self._inotify_fd is not None:
+            ready, _, _ = select.select([self._inotify_fd], [], [], timeout)
+            if not ready:
+                return []
+            data = os.read(self._inotify_fd, 64 * 1024)
+            names, offset = [], 0
+            while offset < len(data):
+                _, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                names.append(os.fsdecode(data[offset:offset + length].rstrip(b'\0')))
+                offset += length
+            return names
+        if self._kqueue is not None:
+            # kqueue only says the directory changed, not which entry
+            return os.listdir(self.directory) if self._kqueue.control(None, 1, timeout) else []
+        time.sleep(min(timeout, POLL_SECONDS))
+        return os.listdir(self.directory)
+
+    def wait(self, timeout: float = DOWNLOAD_TIMEOUT) -> str:
+        """
+        Block until a new complete zip is in the directory
+
+        Returns:
+            str: Path of the zip; later calls return further new zips
+        Raises:
+            TimeoutError: If none arrives within timeout seconds
+        """
+        deadline = time.monotonic() + timeout
+        with timer('export.wait_download'):
+            while True:
+                remaining = deadline - time.monotonic()
+                # A zip that is still being written gets re-checked on a short poll
+                wait_for = min(remaining, POLL_SECONDS) if self.pending else remaining
+                for name in self._changes(max(wait_for, 0)):
+                    if name.endswith(self.suffix) and name not in self.seen:
+                        self.pending.add(name)
+                for name in sorted(self.pending):
+                    path = os.path.join(self.directory, name)
+                    if zipfile.is_zipfile(path):
+                        self.pending.discard(name)
+                        self.seen.add(name)
+                        return path
+                    if not os.path.exists(path):
+                        self.pending.discard(name)
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"No new {self.suffix} file in {self.directory} after {timeout:g}s")
+
+    def close(self) -> None:
+        if self._inotify_fd is not None:
+            os.close(self._inotify_fd)
+            self._inotify_fd = None
+        if self._kqueue is not None:
+            self._kqueue.close()
+            os.close(self._dir_fd)
+            self._kqueue = None
+
+    def __enter__(self) -> 'DownloadWatcher':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def find_csv_member(archive: zipfile.ZipFile) -> Optional[zipfile.ZipInfo]:
+    """The first CSV in the archive, as the agents took csv_files[0] after extracting"""
+    return next((info for info in archive.infolist() if info.filename.endswith('.csv')), None)
+
+
+@contextmanager
+def open_export_csv(zip_path: str):
+    """
+    The export's CSV as a binary stream read straight out of the zip, without extracting it
+
+    Raises:
+        FileNotFoundError: If the archive holds no CSV
+    """
+    with zipfile.ZipFile(zip_path) as archive:
+        member = find_csv_member(archive)
+        if member is None:
+            raise FileNotFoundError(f"No CSV file in {zip_path}")
+        with archive.open(member) as stream:
+            yield stream
+
+
+def process_export_zip(zip_path: str, chunksize: int = EXPORT_CHUNK_ROWS) -> Dict[str, pd.DataFrame]:
+    """
+    process_export_csv for the CSV inside an export zip, decompressed as it is parsed
+
+    Returns:
+        dict: version code -> ad x distance table
+    """
+    with open_export_csv(zip_path) as stream:
+        return process_export_csv(stream, chunksize)
@@ -1,5 +1,26 @@
+import functools
+import logging
+import os
+import sys
+from typing import Dict, Optional, Tuple
+
+import numpy as np
 import pandas as pd
 
+# Shared instrumentation lives at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import timer
+
+logger = logging.getLogger(__name__)
+
+# Rows per chunk when streaming an export; memory per chunk is rows x HgAd columns
+EXPORT_CHUNK_ROWS = int(os.environ.get('EXPORT_CHUNK_ROWS', '5000'))
+
+AD_NAMES = ['Ad1', 'Ad2', 'Ad3', 'Ad4', 'Ad5', 'Ad6', 'Ad7', 'Ad8']
+DISTANCE_ORDER = ['Close05', 'Close1', 'Close2', 'Med05', 'Med1', 'Med2', 'Far05', 'Far1', 'Far2']
+ACCUMULATIVE_COLUMNS = ['Close Accumulative', 'Medium Accumulative', 'Far Accumulative', 'Overall Accumulative']
+POWERS_OF_TEN = 10 ** np.arange(18, dtype=np.int64)
+
 def filter_hgad_and_playerjoined(df):
     # Filter columns that contain 'HgAd' but exclude team-related columns
     filtered_cols = [col for col in df.columns if 'HgAd' in col and not any(x in col for x in ['GreenTeamJoined', 'PurpleTeamJoined'])]
@@ -104,7 +125,7 @@ def decompress_tuples(df_dict):
     
     return decompressed_dfs
 
-def process_df(df):
+def process_df(df, ads=AD_NAMES):
     players_joined_col = 'HgAd-PlayerJoined'
 
     # Get the total players (assuming your decompressed df has exactly one row)
@@ -117,7 +138,6 @@ def process_df(df):
     # Identify your "data" columns (excluding the players_joined_col, etc.)
     data_cols = [col for col in df.columns if col != players_joined_col]
     ad_to_column = {}
-    ads = ['Ad1', 'Ad2', 'Ad3', 'Ad4', 'Ad5', 'Ad6', 'Ad7', 'Ad8']
     
     for col in data_cols:
         parts = col.split('-')
@@ -167,15 +187,382 @@ def process_df(df):
     
     return processed_df
 
-def compress_algos(df):
-    filtered_df = filter_hgad_and_playerjoined(df)
-    transformed_df = transform_to_tuples(filtered_df)
-    separated_dfs = separate_by_code(transformed_df)
-    print(separated_dfs)
-    updated_dfs = update_tuples(separated_dfs)
-    compressed_dfs = compress_to_single_row(updated_dfs)
-    decompressed_dfs = decompress_tuples(compressed_dfs)
+def compress_algos_tuples(df):
+    """The original cell-by-cell pipeline, kept as the reference compress_algos is checked against"""
+    with timer('compress.filter'):
+        filtered_df = filter_hgad_and_playerjoined(df)
+    with timer('compress.transform_to_tuples'):
+        transformed_df = transform_to_tuples(filtered_df)
+    with timer('compress.separate_by_code'):
+        separated_dfs = separate_by_code(transformed_df)
+    # Printing every version's DataFrame is costly, so only do it when debugging
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Separated DataFrames: %s", separated_dfs)
+    with timer('compress.update_tuples'):
+        updated_dfs = update_tuples(separated_dfs)
+    with timer('compress.compress_to_single_row'):
+        compressed_dfs = compress_to_single_row(updated_dfs)
+    with timer('compress.decompress_tuples'):
+        decompressed_dfs = decompress_tuples(compressed_dfs)
     return decompressed_dfs
+
+def parse_counts(values) -> np.ndarray:
+    """
+    int64 matrix of counts such as 737 or "61,122"
+
+    Every cell is parsed once, the way transform_to_tuples parses it
+    (int(str(value).replace(",", ""))), so NaN or "1.5" raise ValueError there too.
+    Plain digit strings, as the exports hold, are read as bytes with array
+    operations; a matrix with any other cell (a sign, a blank, a float, ...)
+    goes through int() cell by cell.
+    """
+    values = np.asarray(values, dtype=object)
+    cells = values.ravel().tolist()
+    counts = parse_digits(cells)
+    if counts is None:
+        counts = np.array([int(str(value).replace(',', '')) for value in cells], dtype=np.int64)
+    return counts.reshape(values.shape)
+
+def parse_digits(cells) -> Optional[np.ndarray]:
+    """
+    int64 values of cells that are all 1-18 ASCII digits once the commas are
+    dropped (where int() is exactly the decimal value), None for anything else
+    """
+    if not cells:
+        return np.zeros(0, dtype=np.int64)
+    try:
+        text = '\n'.join(cells)
+    except TypeError:
+        # Numbers among the strings, e.g. a column pandas already read as ints
+        text = '\n'.join(map(str, cells))
+    text = text.replace(',', '')
+    if not text.isascii():
+        return None
+    data = np.frombuffer(text.encode('ascii'), dtype=np.uint8)
+    breaks = np.flatnonzero(data == ord('\n'))
+    if len(breaks) != len(cells) - 1:
+        # A cell holding a newline itself
+        return None
+    starts = np.concatenate(([0], breaks + 1))
+    lengths = np.diff(np.append(starts, len(data) + 1)) - 1
+    if lengths.min() < 1 or lengths.max() > 18:
+        return None
+    # Newlines wrap past 9 here, so everything else must be a digit
+    digits = data - np.uint8(ord('0'))
+    if np.count_nonzero(digits <= 9) != len(data) - len(breaks):
+        return None
+    digits[breaks] = 0
+    # Each digit times 10 to the number of digits after it in its cell
+    ends = np.repeat(starts + lengths, lengths + 1)[:len(data)]
+    place = ends - np.arange(len(data)) - 1
+    place[breaks] = 0
+    return np.add.reduceat(POWERS_OF_TEN[place] * digits, starts)
+
+def is_count_column(col) -> bool:
+    """The columns compress_algos reads: HgAd impression and PlayerJoined counts, not the team ones"""
+    return 'HgAd' in col and 'GreenTeamJoined' not in col and 'PurpleTeamJoined' not in col
+
+class ExportLayout:
+    """
+    Column layout of an analytics export, worked out once from its header.
+
+    Holds what compress_algos_tuples derives from the column names: the HgAd
+    impression columns and the PlayerJoined column each one takes its player
+    count from, the version codes and each version's columns, and the per-ad
+    column groups whose player counts are dropped on rows where the ad had no
+    impressions. row_sums turns any number of rows into per-version impression
+    and player sums with array operations; sums of separate row chunks add up
+    to the sums of the whole export.
+    """
+
+    def __init__(self, columns):
+        # Positions rather than names throughout, so repeated names behave as in the DataFrame code
+        names = list(columns)
+        self.positions = [i for i, col in enumerate(names) if is_count_column(col)]
+        self.columns = [names[i] for i in self.positions]
+        cols = np.array(self.columns, dtype=str)
+        is_player = np.strings.find(cols, 'PlayerJoined') >= 0
+        player_cols = np.flatnonzero(is_player)
+        self.value_cols = np.flatnonzero(~is_player)
+
+        # The first PlayerJoined column whose name contains the version, -1 if there is none
+        versions = [self.columns[j].split('-')[-1] for j in self.value_cols]
+        source = {version: next((int(pj) for pj in player_cols if version in self.columns[pj]), -1)
+                  for version in dict.fromkeys(versions)}
+        self.player_source = np.array([source[version] for version in versions], dtype=np.int64)
+
+        # Index into the value columns, -1 for PlayerJoined columns (which sum to zero)
+        value_index = np.full(len(cols), -1, dtype=np.int64)
+        value_index[self.value_cols] = np.arange(len(self.value_cols))
+        legacy_player = np.strings.find(cols, 'Player_Joined') >= 0
+        self.codes: Dict[str, Dict[str, object]] = {}
+        for code in dict.fromkeys(col.split('-')[-1] for col in self.columns):
+            code_cols = np.flatnonzero(np.strings.endswith(cols, code) | legacy_player)
+            values = value_index[code_cols]
+            groups = []
+            for ad_num in range(1, 10):
+                members = np.flatnonzero(np.strings.startswith(cols[code_cols], f'HgAd{ad_num}-'))
+                # A group holding a PlayerJoined column is never all zero impressions
+                if len(members) and np.all(values[members] >= 0):
+                    groups.append(members)
+            self.codes[code] = {"columns": [self.columns[j] for j in code_cols], "values": values, "groups": groups}
+
+    def row_sums(self, df: pd.DataFrame, filtered: bool = False) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """
+        Impression and player sums per column of every version over the rows of df
+
+        Args:
+            df (pd.DataFrame): Rows of an export with this layout's header, or
+                only its HgAd columns (in header order) when filtered is True
+        Returns:
+            dict: code -> (impression sums, player sums), int64 arrays aligned with the version's columns
+        """
+        if len(df) and np.any(self.player_source < 0):
+            missing = self.columns[self.value_cols[int(np.argmax(self.player_source < 0))]]
+            raise IndexError(f"No PlayerJoined column for the version of {missing}")
+        dtypes = df.dtypes if filtered else df.dtypes.iloc[self.positions]
+        if all(dtype.kind in 'iu' for dtype in dtypes):
+            # Already numbers (e.g. read with thousands=','): one int64 block, nothing to parse
+            counts = (df if filtered else df.iloc[:, self.positions]).to_numpy(dtype=np.int64)
+        else:
+            # Column by column: a whole-frame to_numpy converts every column, team and date ones too
+            columns = [column for _, column in df.items()]
+            wanted = range(len(columns)) if filtered else self.positions
+            values = np.empty((len(wanted), len(df)), dtype=object)
+            for row, position in enumerate(wanted):
+                values[row] = np.asarray(columns[position].array, dtype=object)
+            counts = parse_counts(values).T
+        # A trailing zero column stands in for the PlayerJoined columns (value index -1)
+        zero = np.zeros((len(counts), 1), dtype=np.int64)
+        impressions = np.hstack([counts[:, self.value_cols], zero])
+        players = np.hstack([counts[:, self.player_source], zero])
+        sums = {}
+        for code, layout in self.codes.items():
+            code_impressions = impressions[:, layout["values"]]
+            code_players = players[:, layout["values"]]
+            for members in layout["groups"]:
+                # Rows where the ad shows no impressions count no players for it either
+                code_players[np.ix_(~code_impressions[:, members].any(axis=1), members)] = 0
+            sums[code] = (code_impressions.sum(axis=0), code_players.sum(axis=0))
+        return sums
+
+    def version_row(self, code: str, impressions: np.ndarray, players: np.ndarray) -> Tuple[list, np.ndarray]:
+        """Column names and int64 values of the one row compress_algos returns for a version with these sums"""
+        layout = self.codes[code]
+        # decompress_tuples keeps the player total of the version's last column; PlayerJoined columns count zero
+        last_players = players[-1] if layout["values"][-1] >= 0 else 0
+        return layout["columns"] + ["HgAd-PlayerJoined"], np.append(impressions, last_players)
+
+    def decompressed(self, sums: Dict[str, Tuple[np.ndarray, np.ndarray]]) -> Dict[str, pd.DataFrame]:
+        """compress_algos output for the given sums: one row of impression totals per version plus HgAd-PlayerJoined"""
+        frames = {}
+        for code, (impressions, players) in sums.items():
+            columns, row = self.version_row(code, impressions, players)
+            frames[code] = pd.DataFrame(row[np.newaxis, :], columns=columns)
+        return frames
+
+@functools.lru_cache(maxsize=64)
+def export_layout(columns: Tuple[str, ...]) -> ExportLayout:
+    """ExportLayout shared by every export with the same header"""
+    return ExportLayout(columns)
+
+def compress_algos(df):
+    """
+    Per-version totals of an analytics export, exactly as compress_algos_tuples
+    computes them, with the counts kept in int64 arrays instead of per-cell tuples
+    """
+    with timer('compress.layout'):
+        layout = export_layout(tuple(df.columns))
+    with timer('compress.sum'):
+        sums = layout.row_sums(df)
+    with timer('compress.decompress'):
+        return layout.decompressed(sums)
+
+def stream_sums(source, chunksize: int = EXPORT_CHUNK_ROWS):
+    """
+    Layout and per-version row sums of an export CSV read in chunks of chunksize rows
+
+    Only the HgAd columns are parsed (usecols), with the thousands separators
+    handled by the CSV reader, and the sums are accumulated chunk by chunk, so
+    memory stays at one chunk plus the ads x bands totals however long the export is.
+
+    Args:
+        source: Path or open file of the export
+        chunksize (int): Rows read at a time
+    Returns:
+        tuple: (ExportLayout, code -> (impression sums, player sums))
+    """
+    layout, totals = None, None
+    with timer('compress.stream'):
+        with pd.read_csv(source, usecols=is_count_column, thousands=',', chunksize=chunksize) as reader:
+            for chunk in reader:
+                if layout is None:
+                    layout = export_layout(tuple(chunk.columns))
+                    totals = layout.row_sums(chunk, filtered=True)
+                    continue
+                for code, (impressions, players) in layout.row_sums(chunk, filtered=True).items():
+                    totals[code][0][:] += impressions
+                    totals[code][1][:] += players
+    return layout, totals
+
+def compress_csv(source, chunksize: int = EXPORT_CHUNK_ROWS) -> Dict[str, pd.DataFrame]:
+    """
+    compress_algos over an export CSV streamed in chunks (see stream_sums);
+    the result is the same as compress_algos(pd.read_csv(source))
+    """
+    layout, totals = stream_sums(source, chunksize)
+    with timer('compress.decompress'):
+        return layout.decompressed(totals)
+
+class AdTableLayout:
+    """
+    (ad, distance) index of a frame's HgAd<n>-<distance> columns, worked out once from its header.
+
+    Follows process_df's reading of the names: the ad is characters 2-5 of the
+    part before the first '-' and the distance tag the part after it, a later
+    column with the same (ad, tag) replaces an earlier one, and the players
+    column is left out. complete says whether every ad has every tag; only
+    then is take (ads x tags indices into the parsed cells) set and the table
+    computed as an array.
+    """
+
+    def __init__(self, columns, players_col: str = 'HgAd-PlayerJoined', ads=AD_NAMES):
+        names = list(columns)
+        cells: Dict[str, Dict[str, int]] = {}
+        for position, col in enumerate(names):
+            parts = str(col).split('-')
+            if col == players_col or len(parts) < 2 or parts[0][2:5] not in ads:
+                continue
+            cells.setdefault(parts[0][2:5], {})[parts[1]] = position
+        self.cells = cells
+        # Players first, then every ad cell in the order process_df meets them
+        self.positions = [names.index(players_col)] + [p for ad_cells in cells.values() for p in ad_cells.values()]
+        cell_index = {cell: i for i, cell in enumerate((ad, tag) for ad, ad_cells in cells.items() for tag in ad_cells)}
+        self.ads = sorted(cells)
+        self.tags = list(dict.fromkeys(tag for ad_cells in cells.values() for tag in ad_cells))
+        self.complete = bool(cells) and all(len(ad_cells) == len(self.tags) for ad_cells in cells.values())
+        self.take = None
+        if self.complete:
+            self.take = np.array([[cell_index[ad, tag] for tag in self.tags] for ad in self.ads], dtype=np.int64)
+        self.bands = [np.array([band in tag for tag in self.tags]) for band in ['Close', 'Med', 'Far']]
+        existing_cols = []
+        for dist in DISTANCE_ORDER:
+            existing_cols.extend(sorted(tag for tag in self.tags if dist in tag))
+        self.final_col_order = existing_cols + ACCUMULATIVE_COLUMNS + ['player_count']
+
+    def first_row(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Numbers in the first row of the columns at positions, parsed as a
+        whole: ints such as 737 or "61,122" stay int64, anything unparseable
+        becomes NaN (and the array float64)
+        """
+        # One row across all columns is far cheaper than slicing out a frame of the wanted columns
+        row = df.iloc[0].to_numpy(dtype=object)[self.positions]
+        if all(dtype.kind in 'iu' for dtype in df.dtypes.iloc[self.positions]):
+            return row.astype(np.int64)
+        return pd.to_numeric(np.strings.replace(row.astype(str), ',', ''), errors='coerce')
+
+    def table(self, values: np.ndarray, ads=AD_NAMES) -> pd.DataFrame:
+        """
+        process_df's table for parsed first-row values (as first_row returns
+        them) whose players count is not zero
+        """
+        players_joined = int(values[0])
+        if not self.complete or values.dtype.kind != 'i':
+            # Rebuilt as the one-row frame process_df expects, with the cells already parsed
+            names = [f"Hg{ad}-{tag}" for ad, ad_cells in self.cells.items() for tag in ad_cells]
+            frame = pd.DataFrame([values[1:].tolist() + [players_joined]], columns=names + ['HgAd-PlayerJoined'])
+            return process_df(frame, ads)
+
+        table = values[1:][self.take]
+        columns = {tag: table[:, i] for i, tag in enumerate(self.tags)}
+        for name, band in zip(ACCUMULATIVE_COLUMNS, self.bands):
+            columns[name] = table[:, band].sum(axis=1) / players_joined
+        columns['Overall Accumulative'] = (table.sum(axis=1).astype(np.float64) + columns['Close Accumulative']
+                                           + columns['Medium Accumulative'] + columns['Far Accumulative']) / players_joined
+        columns['player_count'] = np.full(len(self.ads), players_joined, dtype=np.int64)
+
+        final_col_order = self.final_col_order
+        if len(set(final_col_order)) == len(final_col_order):
+            # Built in final order directly; selecting columns afterwards costs as much as building the frame
+            return pd.DataFrame({col: columns[col] for col in final_col_order}, index=pd.Index(self.ads))
+        return pd.DataFrame(columns, index=pd.Index(self.ads))[final_col_order]
+
+@functools.lru_cache(maxsize=64)
+def ad_table_layout(columns: Tuple[str, ...], players_col: str, ads: Tuple[str, ...]) -> AdTableLayout:
+    """AdTableLayout shared by every frame with the same header"""
+    return AdTableLayout(columns, players_col, ads)
+
+def process_ad_table(df: pd.DataFrame, players_col: str = 'HgAd-PlayerJoined', ads=AD_NAMES) -> pd.DataFrame:
+    """
+    process_df for the first row of df, with the ad x distance table and its
+    accumulative ratios computed as int64 array operations
+
+    The ratios come out bit for bit as process_df's: band sums are exact
+    integers, and with no missing cells pandas adds a row left to right, so
+    Overall is ((bands + Close) + Medium) + Far. A table with missing or
+    unparseable cells (pandas sums those pairwise) goes through process_df
+    itself.
+
+    Args:
+        df (pd.DataFrame): A decompressed version, or an export row with
+            counts as numbers or strings such as "61,122"
+        players_col (str): Column holding the number of players
+        ads (list): Ad names (Ad1, Ad2, ...) to keep
+    Returns:
+        pd.DataFrame: Ads x distance columns, accumulative ratios and
+            player_count; df itself when no players joined
+    """
+    layout = ad_table_layout(tuple(df.columns), players_col, tuple(ads))
+    values = layout.first_row(df)
+    if np.isnan(values[0]):
+        raise ValueError(f"Cannot parse {players_col}: {df[players_col].iloc[0]!r}")
+    if int(values[0]) == 0:
+        print("Warning: Players Joined is zero, cannot calculate accumulative values.")
+        return df
+    return layout.table(values, ads)
+
+def process_versions(decompressed_dfs: Dict[str, pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+    """process_ad_table for every version of compress_algos' output"""
+    return {code: process_ad_table(df) for code, df in decompressed_dfs.items()}
+
+def process_sums(layout: ExportLayout, sums: Dict[str, Tuple[np.ndarray, np.ndarray]]) -> Dict[str, pd.DataFrame]:
+    """
+    process_versions(layout.decompressed(sums)), reading each version's row
+    straight from its sums; only a version with no players, for which the
+    decompressed frame itself is the result, has that frame built
+    """
+    tables = {}
+    for code, (impressions, players) in sums.items():
+        columns, row = layout.version_row(code, impressions, players)
+        table_layout = ad_table_layout(tuple(columns), 'HgAd-PlayerJoined', tuple(AD_NAMES))
+        values = row[table_layout.positions]
+        if values[0] == 0:
+            tables[code] = process_ad_table(pd.DataFrame(row[np.newaxis, :], columns=columns))
+        else:
+            tables[code] = table_layout.table(values)
+    return tables
+
+def process_export(df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """
+    The per-version ad x distance tables of an analytics export: compress_algos
+    followed by process_df for each version, in one go
+
+    Returns:
+        dict: version code -> table, as written to the <code>_test.csv day files
+    """
+    with timer('compress.layout'):
+        layout = export_layout(tuple(df.columns))
+    with timer('compress.sum'):
+        sums = layout.row_sums(df)
+    with timer('compress.process'):
+        return process_sums(layout, sums)
+
+def process_export_csv(source, chunksize: int = EXPORT_CHUNK_ROWS) -> Dict[str, pd.DataFrame]:
+    """process_export for an export CSV streamed in chunks (see stream_sums)"""
+    layout, totals = stream_sums(source, chunksize)
+    with timer('compress.process'):
+        return process_sums(layout, totals)
 # # Example usage
 # #df = pd.read_csv('apr2.csv')
 # decompressed_dfs=compress_algos(df)
@@ -185,4 +572,4 @@ def compress_algos(df):
 #     new_df = process_df(df)
 #     new_df.to_csv(code+"_test.csv")
 #     print(f"Decompressed DataFrame for {code}:")
-#     print(new_df) 
\ No newline at end of file
+#     print(new_df) 
@@ -0,0 +1,144 @@
+#Streaming analysis of animated ads (.gif/.mp4/.webm): frame-sampled contrast statistics
+import random
+from typing import Dict, Any, Iterator, List, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image, ImageSequence
+
+DEFAULT_SAMPLE_SIZE = 32
+
+
+class AnimatedAdAnalyzer:
+    """
+    Decode an animated ad one frame at a time and keep a fixed-size sample.
+
+    Frames are streamed from the file and only the reservoir-sampled ones are
+    converted to grayscale and measured. The reservoir holds per-frame
+    statistics (index, mean, variance, pixel count), never pixels, so memory
+    stays flat however long the clip is.
+    """
+
+    def __init__(self, sample_size: int = DEFAULT_SAMPLE_SIZE, seed: int = 0, max_pixels: int = None):
+        self.sample_size = sample_size
+        self.seed = seed
+        # Frames larger than this are refused before any are decoded
+        self.max_pixels = max_pixels
+
+    def _frames_from_capture(self, capture: cv2.VideoCapture, wanted) -> Iterator[Tuple[int, Any]]:
+        """Yield (index, BGR frame or None); frames are only decoded to pixels when wanted(index)"""
+        index = 0
+        while capture.grab():
+            frame = None
+            if wanted(index):
+                ok, frame = capture.retrieve()
+                if not ok:
+                    frame = None
+            yield index, frame
+            index += 1
+
+    def _frames_from_pil(self, image: Image.Image, wanted) -> Iterator[Tuple[int, Any]]:
+        """GIF fallback when OpenCV can't open the file"""
+        for index, frame in enumerate(ImageSequence.Iterator(image)):
+            yield index, np.asarray(frame.convert('L')) if wanted(index) else None
+
+    def analyze(self, path: str) -> Dict[str, Any]:
+        """
+        Analyze an animated ad
+
+        Args:
+            path (str): Path to a .gif, .mp4 or .webm file
+
+        Returns:
+            dict: width, height, frame_count, duration (seconds), fps and
+                contrast statistics over the sampled frames (mean, min and max
+                per-frame contrast, and the pooled contrast of all sampled pixels)
+        """
+        rng = random.Random(self.seed)
+        reservoir: List[Tuple[int, float, float, int]] = []
+        # Index of the reservoir slot the current frame will fill, decided before it is decoded
+        pending = {'slot': None}
+
+        def wanted(index: int) -> bool:
+            if index < self.sample_size:
+                pending['slot'] = index
+                return True
+            slot = rng.randint(0, index)
+            pending['slot'] = slot if slot < self.sample_size else None
+            return pending['slot'] is not None
+
+        width = height = 0
+        fps = 0.0
+        duration_ms = 0.0
+        capture = cv2.VideoCapture(path)
+        pil_image = None
+        try:
+            if capture.isOpened():
+                fps = capture.get(cv2.CAP_PROP_FPS) or 0.0
+                width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+                height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+                frames = self._frames_from_capture(capture, wanted)
+            else:
+                pil_image = Image.open(path)
+                width, height = pil_image.size
+                frames = self._frames_from_pil(pil_image, wanted)
+
+            if self.max_pixels and width * height > self.max_pixels:
+                raise ValueError(f"Frames of {width}x{height} exceed the pixel budget of {self.max_pixels}")
+
+            frame_count = 0
+            for index, frame in frames:
+                frame_count = index + 1
+                if pil_image is not None:
+                    duration_ms += pil_image.info.get('duration', 0) or 0
+                if frame is None:
+                    continue
+                gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                mean, std = cv2.meanStdDev(gray)
+                stats = (index, float(mean[0][0]), float(std[0][0]) ** 2, gray.size)
+                if len(reservoir) < self.sample_size:
+                    reservoir.append(stats)
+                else:
+                    reservoir[pending['slot']] = stats
+        finally:
+            capture.release()
+            if pil_image is not None:
+                pil_image.close()
+
+        if not reservoir:
+            raise ValueError("Failed to load any frames")
+
+        if pil_image is None and fps > 0:
+            duration_ms = frame_count / fps * 1000.0
+        elif pil_image is not None and duration_ms > 0:
+            fps = frame_count / (duration_ms / 1000.0)
+
+        return {
+            "width": width,
+            "height": height,
+            "frame_count": frame_count,
+            "duration": duration_ms / 1000.0,
+            "fps": fps,
+            "sampled_frames": sorted(s[0] for s in reservoir),
+            **self._contrast_statistics(reservoir)
+        }
+
+    @staticmethod
+    def _contrast_statistics(reservoir: List[Tuple[int, float, float, int]]) -> Dict[str, float]:
+        """Per-frame and pooled contrast (std / 128 * 2, capped at 2.0) over the sampled frames"""
+        means = np.array([s[1] for s in reservoir])
+        variances = np.array([s[2] for s in reservoir])
+        counts = np.array([s[3] for s in reservoir], dtype=float)
+        frame_contrast = np.minimum(2.0, np.sqrt(variances) / 128.0 * 2)
+
+        # Law of total variance: within-frame variance plus variance of the frame means
+        weights = counts / counts.sum()
+        pooled_mean = float(np.dot(weights, means))
+        pooled_variance = float(np.dot(weights, variances + (means - pooled_mean) ** 2))
+
+        return {
+            "contrast_mean": float(frame_contrast.mean()),
+            "contrast_min": float(frame_contrast.min()),
+            "contrast_max": float(frame_contrast.max()),
+            "contrast_pooled": float(min(2.0, np.sqrt(pooled_variance) / 128.0 * 2))
+        }
@@ -0,0 +1,132 @@
+#Content-addressed cache of image analysis results, keyed by a hash of the image bytes
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+CACHE_ENABLED = os.environ.get('AD_IMAGE_CACHE', '1') != '0'
+DEFAULT_CACHE_DIR = os.environ.get('AD_IMAGE_CACHE_DIR', '.image_cache')
+DEFAULT_MAX_ENTRIES = int(os.environ.get('AD_IMAGE_CACHE_MAX_ENTRIES', '10000'))
+# Part of every key: bump it whenever the analysis changes what it measures, so older entries are never served
+ANALYSIS_VERSION = 2
+
+
+class ImageAnalysisCache:
+    """
+    On-disk cache of derived image features (contrast, size, dimensions, ad_type).
+
+    Each entry is a small JSON file named after the SHA-256 of the image bytes, so
+    the same creative uploaded under a different name or for a different game hits
+    the same entry. Files are written atomically, which makes the cache safe to
+    share between worker processes. Reads bump the file's mtime and the oldest
+    entries are evicted once there are more than max_entries, giving LRU order.
+    The entry count is kept in memory (puts since the last directory scan), so
+    the directory is only scanned again once it may have passed max_entries.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # None until the first put scans the directory; overwrites count too, which only brings the next scan forward
+        self._entries: Optional[int] = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Picklable so a preprocessor can be handed to pool workers; each copy gets its own lock
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(data: bytes, ad_type: str) -> str:
+        """Cache key for image bytes; ad_type comes from the extension, so it is part of the key, as is ANALYSIS_VERSION"""
+        digest = hashlib.sha256(data)
+        digest.update(f"{ad_type}:{ANALYSIS_VERSION}".encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def key_for_file(path: str, ad_type: str, chunk_size: int = 1 << 20) -> str:
+        """Same key as key_for, hashing the file in chunks so large videos aren't read into memory"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        digest.update(f"{ad_type}:{ANALYSIS_VERSION}".encode())
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                features = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return features
+
+    def put(self, key: str, features: Dict[str, Any]) -> None:
+        path = self._path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(features, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write image cache entry {key}: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._evict()
+
+    def _evict(self) -> None:
+        with self._lock:
+            if self._entries is not None:
+                self._entries += 1
+                if self._entries <= self.max_entries:
+                    return
+        # Other processes sharing the directory add entries too, so the scan is the real count
+        entries = [e for e in os.scandir(self.cache_dir) if e.name.endswith('.json')]
+        remaining = len(entries)
+        if remaining > self.max_entries:
+            # Drop to 90% of the cap so eviction doesn't run on every insert
+            entries.sort(key=lambda e: e.stat().st_mtime)
+            for entry in entries[:len(entries) - int(self.max_entries * 0.9)]:
+                try:
+                    os.remove(entry.path)
+                    remaining -= 1
+                except OSError:
+                    pass
+        with self._lock:
+            self._entries = remaining
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters for this process and the current number of entries"""
+        entries = sum(1 for e in os.scandir(self.cache_dir) if e.name.endswith('.json'))
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+    def clear(self) -> None:
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.json'):
+                os.remove(entry.path)
+        self.hits = 0
+        self.misses = 0
+        self._entries = 0
@@ -3,21 +3,249 @@ import numpy as np
 import pandas as pd
 from PIL import Image
 import cv2
+import io
 import json
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, List, Optional, Tuple
 import pickle
 import logging
 import uuid
 import os
+import struct
+import threading
+import warnings
+import zlib
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from image_cache import ImageAnalysisCache, CACHE_ENABLED
+from animated_analysis import AnimatedAdAnalyzer
+from vector_metadata import svg_metadata, cad_metadata
+from instrumentation import timer, increment
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
+# Set up logging (LOG_LEVEL=WARNING silences the per-ad messages in the hot path)
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper())
 logger = logging.getLogger(__name__)
 
+# Embedding codes used by the experiment table (see Selenium_Agent/experiment_history.py)
+CONTRAST_EMBEDDING = {'low': 1, 'medium': 2, 'high': 3}
+PRODUCT_OR_BRAND_EMBEDDING = {'product': 1, 'brand': 2}
+TYPE_EMBEDDING = {'static': 1, 'animated': 2, '3d': 3}
+
+EMBEDDING_IMPRESSIONS_PATH = 'embedding_impressions.pkl'
+
+# Reduced-resolution contrast (see AdImagePreprocessor._calculate_contrast_reduced)
+REDUCTION_FACTORS = (8, 4, 2)
+REDUCED_GRAYSCALE_FLAGS = {
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8
+}
+CONTRAST_MIN_SIDE = 200
+CONTRAST_RECHECK_MARGIN = 0.1
+
+# EXIF orientations that turn the stored image a quarter turn, swapping its width and height
+EXIF_ORIENTATION_TAG = 0x0112
+ROTATED_ORIENTATIONS = {5, 6, 7, 8}
+
+# Pixel budget per decoded image: bounds the memory one job can take in a worker pool
+MAX_PIXELS = int(os.environ.get('AD_IMAGE_MAX_PIXELS', str(40_000_000)))
+# Most pixels decoded at once when an image over the budget is measured in row strips
+STRIP_PIXELS = 4_000_000
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# Bytes per pixel of an 8-bit PNG by color type: gray, RGB, palette, gray + alpha, RGBA
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+
+def _png_chunk(kind: bytes, payload: bytes) -> bytes:
+    return struct.pack('>I', len(payload)) + kind + payload + struct.pack('>I', zlib.crc32(kind + payload))
+
+
+def _is_strip_png(data: bytes) -> bool:
+    """Whether _png_gray_strips can read this PNG: 8 bits per sample and not interlaced"""
+    return data[:8] == PNG_SIGNATURE and data[12:16] == b'IHDR' and data[24] == 8 and data[25] in PNG_CHANNELS and data[28] == 0
+
+
+def _png_gray_strips(data: bytes, strip_pixels: int = STRIP_PIXELS):
+    """
+    Yield a PNG (see _is_strip_png) as grayscale row strips of at most strip_pixels pixels
+
+    The image data is inflated incrementally and each strip's filtered rows are
+    re-wrapped as a small PNG for PIL to unfilter. That PNG starts with the
+    previous strip's last row, unfiltered, so the Up, Average and Paeth filters
+    of the strip's first row see the right row above. Only one strip is ever
+    held decoded.
+
+    Raises:
+        ValueError: If the image data ends before the last row
+    """
+    width, height, _, color_type = struct.unpack('>IIBB', data[16:26])
+    stride = 1 + width * PNG_CHANNELS[color_type]
+    rows_per_strip = max(1, strip_pixels // width)
+    # Palette and transparency chunks go into every strip; IDAT payloads are one zlib stream
+    extra, idat = [], []
+    view = memoryview(data)
+    offset = 8
+    while offset + 8 <= len(data):
+        length, kind = struct.unpack('>I4s', data[offset:offset + 8])
+        if kind in (b'PLTE', b'tRNS'):
+            extra.append(_png_chunk(kind, data[offset + 8:offset + 8 + length]))
+        elif kind == b'IDAT':
+            idat.append(view[offset + 8:offset + 8 + length])
+        elif kind == b'IEND':
+            break
+        offset += 12 + length
+
+    inflate = zlib.decompressobj()
+    chunks = iter(idat)
+    source = b''
+    previous = None
+    for row in range(0, height, rows_per_strip):
+        rows = min(rows_per_strip, height - row)
+        filtered = bytearray()
+        while len(filtered) < rows * stride:
+            if not source:
+                source = next(chunks, None)
+                if source is None:
+                    raise ValueError("PNG image data ends early")
+            filtered += inflate.decompress(source, rows * stride - len(filtered))
+            source = inflate.unconsumed_tail
+        head = b'' if previous is None else b'\x00' + previous
+        header = struct.pack('>IIBBBBB', width, rows + (previous is not None), 8, color_type, 0, 0, 0)
+        strip_png = (PNG_SIGNATURE + _png_chunk(b'IHDR', header) + b''.join(extra)
+                     + _png_chunk(b'IDAT', zlib.compress(head + filtered, 0)) + _png_chunk(b'IEND', b''))
+        with warnings.catch_warnings():
+            # Converting a palette with transparency to grayscale warns; the alpha is ignored anyway
+            warnings.simplefilter('ignore')
+            with Image.open(io.BytesIO(strip_png)) as strip:
+                strip.load()
+                # For 8-bit PNGs PIL's pixels are the raw row bytes, which the next strip starts from
+                previous = np.asarray(strip)[-1].tobytes()
+                gray = np.asarray(strip.convert('L'))
+        yield gray[1:] if head else gray
+
+
+def _extract_multiplier(df: pd.DataFrame) -> float:
+    """
+    Pull the multiplier out of one experiment DataFrame, or NaN if it has none
+    """
+    if len(df) == 0:
+        return np.nan
+    if 'Overall Accumulative' in df.columns:
+        return float(df['Overall Accumulative'].iloc[0])
+    # Try other column names that might contain the multiplier
+    for col in df.columns:
+        if 'accumulative' in col.lower() or 'overall' in col.lower() or 'impression' in col.lower():
+            return float(df[col].iloc[0])
+    # Use the first numeric column as fallback
+    for col in df.columns:
+        if pd.api.types.is_numeric_dtype(df[col]):
+            return float(df[col].iloc[0])
+    return np.nan
+
+
+class _CompiledMultipliers:
+    """Immutable snapshot of the experiment table compiled into a dense array"""
+
+    def __init__(self, embedding_impressions: Dict[Tuple[int, ...], pd.DataFrame], mtime: float):
+        self.mtime = mtime
+        self.keys = list(embedding_impressions.keys())
+        shape = tuple(max(key[dim] for key in self.keys) + 1 for dim in range(4)) if self.keys else (1, 1, 1, 1)
+        # Indexed by (contrast, product_or_brand, type, ad_space); NaN means no usable entry
+        self.values = np.full(shape, np.nan)
+        for key, df in embedding_impressions.items():
+            self.values[key] = _extract_multiplier(df)
+        # Keys as one row-normalized matrix for cosine-similarity search
+        key_matrix = np.array(self.keys, dtype=float).reshape(len(self.keys), 4)
+        norms = np.linalg.norm(key_matrix, axis=1, keepdims=True)
+        self.unit_keys = np.divide(key_matrix, norms, out=np.zeros_like(key_matrix), where=norms != 0)
+
+    def lookup(self, embeddings: np.ndarray) -> np.ndarray:
+        """Exact multipliers for an (n, 4) int array of embeddings; NaN where there is no entry"""
+        in_range = np.all((embeddings >= 0) & (embeddings < np.array(self.values.shape)), axis=1)
+        result = np.full(len(embeddings), np.nan)
+        if in_range.any():
+            result[in_range] = self.values[tuple(embeddings[in_range].T)]
+        return result
+
+    def nearest(self, embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Index of the most cosine-similar key for each row of an (n, 4) array, and that similarity
+        """
+        if not self.keys:
+            return np.zeros(len(embeddings), dtype=int), np.full(len(embeddings), -1.0)
+        queries = np.asarray(embeddings, dtype=float)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        unit_queries = np.divide(queries, norms, out=np.zeros_like(queries), where=norms != 0)
+        similarities = unit_queries @ self.unit_keys.T
+        best = similarities.argmax(axis=1)
+        return best, similarities[np.arange(len(queries)), best]
+
+
+class ImpressionMultiplierTable:
+    """
+    Experiment multipliers from embedding_impressions.pkl, loaded once per process.
+
+    The pickle is compiled into a dense array so lookups are O(1). When the file's
+    mtime changes the array is rebuilt and swapped in as a whole, so readers always
+    see either the old or the new table.
+    """
+
+    def __init__(self, path: str = EMBEDDING_IMPRESSIONS_PATH):
+        self.path = path
+        self._compiled = None
+        self._lock = threading.Lock()
+
+    def _current(self) -> _CompiledMultipliers:
+        mtime = os.stat(self.path).st_mtime
+        compiled = self._compiled
+        if compiled is not None and compiled.mtime == mtime:
+            return compiled
+        with self._lock:
+            compiled = self._compiled
+            if compiled is None or compiled.mtime != mtime:
+                with open(self.path, 'rb') as f:
+                    embedding_impressions = pickle.load(f)
+                compiled = _CompiledMultipliers(embedding_impressions, mtime)
+                self._compiled = compiled
+                logger.info("Loaded %d embedding impressions from %s", len(compiled.keys), self.path)
+        return compiled
+
+    def snapshot(self) -> _CompiledMultipliers:
+        """Current compiled table, reloaded first if the pickle has changed on disk"""
+        return self._current()
+
+    def lookup(self, embedding: Tuple[int, ...]):
+        """Return the multiplier for an exact embedding, or None if there is no usable entry"""
+        value = self._current().lookup(np.array([embedding]))[0]
+        return None if np.isnan(value) else float(value)
+
+
+_multiplier_tables: Dict[str, ImpressionMultiplierTable] = {}
+
+
+def get_multiplier_table(path: str = EMBEDDING_IMPRESSIONS_PATH) -> ImpressionMultiplierTable:
+    """Return the process-wide multiplier table for path"""
+    table = _multiplier_tables.get(path)
+    if table is None:
+        table = _multiplier_tables.setdefault(path, ImpressionMultiplierTable(path))
+    return table
+
+
 class AdImagePreprocessor:
-    def __init__(self):
-        """Initialize the image preprocessor with default parameters"""
+    def __init__(self, cache: ImageAnalysisCache = None, max_pixels: int = None):
+        """
+        Initialize the image preprocessor with default parameters
+        
+        Args:
+            cache (ImageAnalysisCache, optional): Cache for image analysis results;
+                defaults to the shared on-disk cache unless AD_IMAGE_CACHE=0
+            max_pixels (int, optional): Most pixels ever decoded for one image;
+                defaults to AD_IMAGE_MAX_PIXELS (40 million)
+        """
+        if cache is None and CACHE_ENABLED:
+            cache = ImageAnalysisCache()
+        self.cache = cache
+        self.max_pixels = max_pixels or MAX_PIXELS
         self.standard_sizes = {
             'small': {'width': 300, 'height': 250},
             'medium': {'width': 728, 'height': 90},
@@ -44,10 +272,7 @@ class AdImagePreprocessor:
         }
         self.accepted_formats = list(self.format_types.keys())
         
-    def _calculate_contrast(self, image: np.ndarray) -> float:
-
-        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-        contrast = min(2.0, (gray.std() / 128.0) * 2)
+    def _classify_contrast(self, contrast: float) -> str:
         #return either 'low', 'medium', or 'high'
         if contrast < 0.5:
             return 'low'
@@ -56,6 +281,143 @@ class AdImagePreprocessor:
         else:
             return 'high'
 
+    def _calculate_contrast(self, image: np.ndarray) -> float:
+
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        contrast = min(2.0, (gray.std() / 128.0) * 2)
+        return self._classify_contrast(contrast)
+
+    def _probe_dimensions(self, data: bytes) -> Optional[Tuple[int, int]]:
+        """
+        Read (width, height) from the image header without decoding any pixels
+
+        The EXIF orientation is applied, as it is by the decode and by viewers:
+        a photo stored sideways with orientation 5-8 reports its sides swapped.
+        """
+        try:
+            # Our own pixel budget decides what gets decoded, so PIL's warning is just noise
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+                with Image.open(io.BytesIO(data)) as header:
+                    width, height = header.size
+                    if header.getexif().get(EXIF_ORIENTATION_TAG) in ROTATED_ORIENTATIONS:
+                        width, height = height, width
+                    return width, height
+        except Image.DecompressionBombError as e:
+            # Never fall back to a full decode for something PIL already flags as a bomb
+            raise ValueError(f"Image exceeds the pixel budget: {str(e)}")
+        except Exception:
+            return None
+
+    def _calculate_contrast_reduced(self, data: bytes, width: int, height: int) -> str:
+        """
+        Contrast class from a single grayscale decode, reduced in resolution for JPEGs
+        
+        Only one uint8 grayscale plane is ever held, instead of the BGR, RGB,
+        gray and float64 copies of the full-resolution path. JPEGs are decoded
+        straight to a smaller image by libjpeg's DCT scaling, using the largest
+        factor in REDUCTION_FACTORS that keeps the shorter side at least
+        CONTRAST_MIN_SIDE pixels; other formats are measured on the full-size
+        grayscale plane, which gives the same value as the RGB path.
+        
+        Pixel budget: a JPEG larger than max_pixels is reduced further, by
+        the smallest factor that brings it under budget. Other formats can't be
+        downscaled while decoding, so an 8-bit non-interlaced PNG over budget is
+        measured exactly in row strips of STRIP_PIXELS (see _png_gray_strips);
+        either way no more than max_pixels bytes of pixels are held per image.
+        Anything else over budget (WebP, interlaced or 16-bit PNGs) can't be
+        decoded in parts by PIL or OpenCV and is decoded whole to grayscale,
+        with a warning, rather than rejected.
+        
+        Accuracy bound: DCT scaling keeps each block's mean, so by the law of
+        total variance the reduced standard deviation is never larger than the
+        full-resolution one; the gap is the detail finer than the reduction
+        factor. Whenever the reduced contrast lands within
+        CONTRAST_RECHECK_MARGIN below a class boundary the image is re-measured
+        at full resolution, so the class can only differ from the
+        full-resolution class when that fine detail removes more than the margin
+        (0.1 contrast, i.e. 6.4 gray levels of standard deviation).
+        """
+        buffer = np.frombuffer(data, dtype=np.uint8)
+        within_budget = width * height <= self.max_pixels
+        factor = 1
+        if data[:2] == b'\xff\xd8':
+            factor = next((f for f in REDUCTION_FACTORS if min(width, height) // f >= CONTRAST_MIN_SIDE), 1)
+            if not within_budget:
+                budget_factor = next((f for f in sorted(REDUCTION_FACTORS) if width * height <= self.max_pixels * f * f), None)
+                if budget_factor is None:
+                    raise ValueError(f"Image of {width}x{height} exceeds the pixel budget of {self.max_pixels} even at 1/{max(REDUCTION_FACTORS)} scale")
+                factor = max(factor, budget_factor)
+        elif not within_budget:
+            if _is_strip_png(data):
+                increment('image.strip_decode')
+                return self._classify_contrast(self._calculate_contrast_strips(data))
+            increment('image.over_budget_decode')
+            logger.warning("Image of %dx%d is over the pixel budget of %d but can't be decoded in strips; "
+                           "decoding it whole as grayscale", width, height, self.max_pixels)
+        with timer('image.decode'):
+            gray = cv2.imdecode(buffer, REDUCED_GRAYSCALE_FLAGS.get(factor, cv2.IMREAD_GRAYSCALE))
+        if gray is None:
+            raise ValueError("Failed to load image")
+
+        with timer('image.contrast'):
+            contrast = min(2.0, (cv2.meanStdDev(gray)[1][0][0] / 128.0) * 2)
+        if factor > 1 and within_budget and any(0 <= threshold - contrast < CONTRAST_RECHECK_MARGIN for threshold in (0.5, 1.0)):
+            increment('image.contrast_recheck')
+            with timer('image.decode'):
+                gray = cv2.imdecode(buffer, cv2.IMREAD_GRAYSCALE)
+            with timer('image.contrast'):
+                contrast = min(2.0, (cv2.meanStdDev(gray)[1][0][0] / 128.0) * 2)
+        return self._classify_contrast(contrast)
+
+    def _calculate_contrast_strips(self, data: bytes) -> float:
+        """
+        Full-resolution contrast of a PNG from running sums over its row strips
+
+        Gives the same value as measuring the whole grayscale plane at once.
+        """
+        count, total, squares = 0, 0, 0
+        with timer('image.decode'):
+            for gray in _png_gray_strips(data, min(STRIP_PIXELS, self.max_pixels)):
+                values = gray.astype(np.int64)
+                count += values.size
+                total += int(values.sum())
+                squares += int((values * values).sum())
+        if not count:
+            raise ValueError("Failed to load image")
+        variance = max(0.0, squares / count - (total / count) ** 2)
+        return min(2.0, (np.sqrt(variance) / 128.0) * 2)
+
+    def _measure_unprobed(self, data: bytes) -> Tuple[str, int, int]:
+        """
+        (contrast class, width, height) of an image whose header PIL can't parse
+
+        The size is only known after decoding, so a 1/8 grayscale plane is
+        decoded first (libjpeg does this without holding the full image). The
+        full-resolution grayscale plane is decoded only if the image fits in
+        max_pixels; otherwise the contrast comes from the 1/8 plane and the
+        size is scaled up from it, to within 8 pixels.
+        """
+        buffer = np.frombuffer(data, dtype=np.uint8)
+        factor = max(REDUCTION_FACTORS)
+        with timer('image.decode'):
+            gray = cv2.imdecode(buffer, REDUCED_GRAYSCALE_FLAGS[factor])
+        if gray is None:
+            raise ValueError("Failed to load image")
+        if gray.size * factor * factor <= self.max_pixels:
+            with timer('image.decode'):
+                gray = cv2.imdecode(buffer, cv2.IMREAD_GRAYSCALE)
+            if gray is None:
+                raise ValueError("Failed to load image")
+            factor = 1
+        else:
+            logger.warning("Unparsed image of about %dx%d is over the pixel budget; measuring it at 1/%d scale",
+                           gray.shape[1] * factor, gray.shape[0] * factor, factor)
+        with timer('image.contrast'):
+            contrast = min(2.0, (cv2.meanStdDev(gray)[1][0][0] / 128.0) * 2)
+        height, width = gray.shape[:2]
+        return self._classify_contrast(contrast), width * factor, height * factor
+
     def _determine_size(self, width: int, height: int) -> str:
         aspect_ratio = width / height
         if width <= 400 and height <= 300:
@@ -94,20 +456,24 @@ class AdImagePreprocessor:
         # Otherwise, return the first available space
         return available_spaces[0]
 
-    def _calculate_impression_multiplier(self, contrast: str, size: str, ad_type: str, product_or_brand: str) -> float:
+    def _embed_ad(self, contrast: str, size: str, ad_type: str, product_or_brand: str) -> Tuple[int, int, int, int]:
         """
-        Calculate the impression multiplier based on ad characteristics
-        
-        Args:
-            contrast (str): Image contrast value ('low', 'medium', 'high')
-            size (str): Ad size category
-            ad_type (str): Type of ad
-            product_or_brand (str): Whether it's a product or brand ad
-            
-        Returns:
-            float: Impression multiplier value
+        Build the (contrast, product_or_brand, type, ad_space) embedding used by the experiment table
+        """
+        ad_space_num = 1  # Default value if not provided
+        if size in self.ad_spaces:
+            ad_space_num = self.ad_spaces[size].index(self._determine_ad_space(size, ad_type)) + 1
+        return (
+            CONTRAST_EMBEDDING[contrast],
+            PRODUCT_OR_BRAND_EMBEDDING[product_or_brand],
+            TYPE_EMBEDDING[ad_type],
+            ad_space_num
+        )
+
+    def _fallback_multiplier(self, contrast: str, size: str, ad_type: str, product_or_brand: str) -> float:
+        """
+        Multiplier calculated from the ad characteristics when the experiment table has no answer
         """
-        # Base multiplier on contrast and size - Fallback calculation
         size_multipliers = {'small': 1.0, 'medium': 1.2, 'large': 1.5}
         type_multipliers = {
             'static': 1.0,
@@ -123,152 +489,7 @@ class AdImagePreprocessor:
             'product': 1.0,
             'brand': 1.1
         }
-        
-        # Try to use embeddings file
-        try:
-            with open('embedding_impressions.pkl', 'rb') as f:
-                embedding_impressions = pickle.load(f)
-                logger.info("Successfully loaded embedding impressions file")
-                
-                type_embedding = {
-                    'static': 1,
-                    'animated': 2,
-                    '3d': 3
-                }
-                product_or_brand_embedding = {
-                    'product': 1,
-                    'brand': 2
-                }
-                contrast_embedding = {
-                    'low': 1,
-                    'medium': 2,
-                    'high': 3
-                }
-                
-                # Create the embedding tuple
-                ad_space_num = 1  # Default value if not provided
-                if hasattr(self, 'ad_spaces') and size in self.ad_spaces:
-                    ad_spaces = self.ad_spaces[size]
-                    ad_space_num = ad_spaces.index(self._determine_ad_space(size, ad_type)) + 1
-                
-                embedding_of_ad = [
-                    contrast_embedding[contrast],
-                    product_or_brand_embedding[product_or_brand], 
-                    type_embedding[ad_type], 
-                    ad_space_num
-                ]
-                
-                # Convert to tuple for direct lookup
-                embedding_tuple = tuple(embedding_of_ad)
-                # Try direct lookup first
-                if embedding_tuple in embedding_impressions:
-                    logger.info(f"Found exact match for embedding tuple {embedding_tuple}")
-                    # Extract multiplier from the DataFrame
-                    df = embedding_impressions[embedding_tuple]
-                    logger.info(f"DataFrame columns: {df.columns.tolist()}")
-                    logger.info(f"DataFrame shape: {df.shape}")
-                    logger.info(f"DataFrame first row: {df.iloc[0].to_dict()}")
-                    
-                    # Try to access "Overall Accumulative" column
-                    if 'Overall Accumulative' in df.columns:
-                        multiplier = df['Overall Accumulative'].iloc[0]
-                        logger.info(f"Raw multiplier value: {multiplier}")
-                        # No need to divide by 100, use the value directly
-                        return float(multiplier)
-                    else:
-                        # Try other column names that might contain the multiplier
-                        for col in df.columns:
-                            if 'accumulative' in col.lower() or 'overall' in col.lower() or 'impression' in col.lower():
-                                logger.info(f"Using column {col} as multiplier")
-                                multiplier = df[col].iloc[0]
-                                logger.info(f"Raw multiplier value: {multiplier}")
-                                return float(multiplier)
-                        
-                        logger.info(f"Could not find appropriate multiplier column. Using first numeric column")
-                        # Use the first numeric column as fallback
-                        for col in df.columns:
-                            if pd.api.types.is_numeric_dtype(df[col]):
-                                logger.info(f"Using numeric column {col} as multiplier")
-                                multiplier = df[col].iloc[0]
-                                logger.info(f"Raw multiplier value: {multiplier}")
-                                return float(multiplier)
-                        
-                        logger.info(f"Could not find any numeric column. DataFrame: {df}")
-                
-                # If not found, try cosine similarity
-                try:
-                    all_embeeddings = list(embedding_impressions.keys())
-                    # Convert our embedding to numpy array for calculations
-                    embedding_of_ad_np = np.array(embedding_of_ad, dtype=float)
-                    
-                    # Find the closest embedding using cosine similarity
-                    max_similarity = -1  # Start with negative since cosine ranges from -1 to 1
-                    max_similarity_embedding = None
-                    
-                    for embedding in all_embeeddings:
-                        # Convert embedding tuple to numpy array
-                        embedding_np = np.array(embedding, dtype=float)
-                        # Calculate cosine similarity
-                        dot_product = np.dot(embedding_of_ad_np, embedding_np)
-                        norm_product = np.linalg.norm(embedding_of_ad_np) * np.linalg.norm(embedding_np)
-                        # Avoid division by zero
-                        if norm_product == 0:
-                            similarity = 0
-                        else:
-                            similarity = dot_product / norm_product
-                        
-                        if similarity > max_similarity:
-                            max_similarity = similarity
-                            max_similarity_embedding = embedding
-                    
-                    # Only use the closest embedding if the similarity is high enough
-                    if max_similarity_embedding is not None and max_similarity > 0.8:
-                        logger.info(f"Using similar embedding {max_similarity_embedding} with similarity {max_similarity:.2f}")
-                        # Access the embedding DataFrame safely
-                        df = embedding_impressions.get(max_similarity_embedding)
-                        if df is not None:
-                            logger.info(f"DataFrame columns: {df.columns.tolist()}")
-                            logger.info(f"DataFrame shape: {df.shape}")
-                            logger.info(f"DataFrame first row: {df.iloc[0].to_dict()}")
-                            
-                            # Try to access "Overall Accumulative" column
-                            if 'Overall Accumulative' in df.columns:
-                                multiplier = df['Overall Accumulative'].iloc[0]
-                                logger.info(f"Raw multiplier value: {multiplier}")
-                                # No need to divide by 100, use the value directly
-                                return float(multiplier)
-                            else:
-                                # Try other column names that might contain the multiplier
-                                for col in df.columns:
-                                    if 'accumulative' in col.lower() or 'overall' in col.lower() or 'impression' in col.lower():
-                                        logger.info(f"Using column {col} as multiplier")
-                                        multiplier = df[col].iloc[0]
-                                        logger.info(f"Raw multiplier value: {multiplier}")
-                                        return float(multiplier)
-                                
-                                logger.info(f"Could not find appropriate multiplier column. Using first numeric column")
-                                # Use the first numeric column as fallback
-                                for col in df.columns:
-                                    if pd.api.types.is_numeric_dtype(df[col]):
-                                        logger.info(f"Using numeric column {col} as multiplier")
-                                        multiplier = df[col].iloc[0]
-                                        logger.info(f"Raw multiplier value: {multiplier}")
-                                        return float(multiplier)
-                                
-                                logger.info(f"Could not find any numeric column. DataFrame: {df}")
-                        else:
-                            logger.info(f"DataFrame is None for embedding {max_similarity_embedding}")
-                    else:
-                        logger.info(f"No similar embedding found (max similarity: {max_similarity:.2f})")
-                except Exception as e:
-                    logger.warning(f"Error in cosine similarity calculation: {str(e)}")
-                
-                # Fallback to calculated value if no match or similarity fails
-            
-        except Exception as e:
-            # If there's any error with the embeddings, log it and use fallback calculation
-            logger.warning(f"Could not load embedding impressions: {str(e)}. Using fallback calculation.")
-        
+
         # Calculate multiplier based on all factors
         base_multiplier = size_multipliers.get(size, 1.0)
         type_multiplier = type_multipliers.get(ad_type, 1.0)
@@ -277,62 +498,305 @@ class AdImagePreprocessor:
         
         return round(base_multiplier * type_multiplier * contrast_multiplier * pb_multiplier, 2)
 
+    def calculate_impression_multipliers(self, ads: List[Tuple[str, str, str, str]]) -> List[float]:
+        """
+        Calculate impression multipliers for many ads in one pass
+        
+        Exact embedding matches are read from the compiled experiment table; the
+        rest are resolved together with one matrix product against the
+        normalized embedding keys, and anything still unmatched falls back to the
+        calculated multiplier.
+        
+        Args:
+            ads (list): (contrast, size, ad_type, product_or_brand) tuples
+            
+        Returns:
+            list: Impression multiplier for each ad, in input order
+        """
+        with timer('image.multiplier'):
+            return self._calculate_impression_multipliers(ads)
+
+    def _calculate_impression_multipliers(self, ads: List[Tuple[str, str, str, str]]) -> List[float]:
+        multipliers = [None] * len(ads)
+        try:
+            table = get_multiplier_table().snapshot()
+
+            # Ads whose characteristics can't be embedded go straight to the fallback
+            embedded = []
+            for i, (contrast, size, ad_type, product_or_brand) in enumerate(ads):
+                try:
+                    embedded.append((i, self._embed_ad(contrast, size, ad_type, product_or_brand)))
+                except (KeyError, ValueError, TypeError) as e:
+                    logger.warning(f"Could not embed ad characteristics: {str(e)}. Using fallback calculation.")
+
+            if embedded:
+                indices = [i for i, _ in embedded]
+                embeddings = np.array([e for _, e in embedded], dtype=int)
+
+                # Try direct lookup first
+                exact = table.lookup(embeddings)
+
+                # If not found, use the most cosine-similar embedding above the threshold
+                missing = np.isnan(exact)
+                if missing.any():
+                    best, similarity = table.nearest(embeddings[missing])
+                    similar = np.full(len(best), np.nan)
+                    close_enough = similarity > 0.8
+                    if close_enough.any():
+                        similar_keys = np.array([table.keys[k] for k in best[close_enough]], dtype=int)
+                        similar[close_enough] = table.lookup(similar_keys)
+                    exact[missing] = similar
+
+                for i, value in zip(indices, exact):
+                    if not np.isnan(value):
+                        multipliers[i] = float(value)
+
+        except Exception as e:
+            # If there's any error with the embeddings, log it and use fallback calculation
+            logger.warning(f"Could not load embedding impressions: {str(e)}. Using fallback calculation.")
+
+        return [
+            multiplier if multiplier is not None else self._fallback_multiplier(*ad)
+            for multiplier, ad in zip(multipliers, ads)
+        ]
+
+    def _calculate_impression_multiplier(self, contrast: str, size: str, ad_type: str, product_or_brand: str) -> float:
+        """
+        Calculate the impression multiplier based on ad characteristics
+        
+        Args:
+            contrast (str): Image contrast value ('low', 'medium', 'high')
+            size (str): Ad size category
+            ad_type (str): Type of ad
+            product_or_brand (str): Whether it's a product or brand ad
+            
+        Returns:
+            float: Impression multiplier value
+        """
+        return self.calculate_impression_multipliers([(contrast, size, ad_type, product_or_brand)])[0]
+
     def _predict_product_or_brand(self, name: str, image: np.ndarray = None) -> str:
         return 'product'
 
-    def process_ad_image(self, image_path: str, name: str, game_id: str = None) -> Dict[str, Any]:
-        try:
-            if not os.path.exists(image_path):
-                raise FileNotFoundError(f"Image file not found: {image_path}")
-            if not any(image_path.lower().endswith(fmt) for fmt in self.accepted_formats):
-                raise ValueError(f"Invalid format. Accepted formats: {self.accepted_formats}")
-            ad_type = self._determine_ad_type(image_path) #only.png is working right now
-            if ad_type in ['static', 'animated', '3d']:
-                image = cv2.imread(image_path)
-                if image is None:
-                    raise ValueError("Failed to load image")
-                    
-                image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-                height, width = image.shape[:2]
-                
-                # Calculate image characteristics
-                contrast = self._calculate_contrast(image)
-                size = self._determine_size(width, height)
-                
-                # Determine if this is a product or brand ad
-                product_or_brand = self._predict_product_or_brand(name, image)
+    def _measure_static(self, data: bytes) -> Dict[str, Any]:
+        """
+        Contrast, size and dimensions of a still image from its bytes
+        """
+        dimensions = self._probe_dimensions(data)
+        if dimensions is not None:
+            # Fast path: size from the header, contrast from a reduced decode
+            width, height = dimensions
+            contrast = self._calculate_contrast_reduced(data, width, height)
+        else:
+            # Only formats PIL can't parse get here, so there is no header to check against the budget
+            contrast, width, height = self._measure_unprobed(data)
+
+        return {
+            "contrast": contrast,
+            "size": self._determine_size(width, height),
+            "width": width,
+            "height": height
+        }
+
+    def _measure_animated(self, image_path: str) -> Dict[str, Any]:
+        """
+        Contrast, size, dimensions, frame count and duration of an animated ad,
+        streamed frame by frame so memory does not grow with clip length
+        """
+        with timer('image.animated'):
+            clip = AnimatedAdAnalyzer(max_pixels=self.max_pixels).analyze(image_path)
+        # Classify on the typical per-frame contrast, i.e. what a player sees at any moment
+        return {
+            "contrast": self._classify_contrast(clip["contrast_mean"]),
+            "size": self._determine_size(clip["width"], clip["height"]),
+            "width": clip["width"],
+            "height": clip["height"],
+            "frame_count": clip["frame_count"],
+            "duration": clip["duration"],
+            "contrast_stats": {
+                key: clip[key] for key in ("contrast_mean", "contrast_min", "contrast_max", "contrast_pooled")
+            }
+        }
+
+    def _measure_3d(self, image_path: str) -> Dict[str, Any]:
+        """
+        Contrast, size and dimensions of an SVG or CAD creative from its metadata,
+        without rasterizing it
+        """
+        with timer('image.vector'):
+            if image_path.lower().endswith('.svg'):
+                metadata = svg_metadata(image_path)
             else:
-                contrast = 1.0
-                size = 'medium'
-                product_or_brand = self._predict_product_or_brand(name)
-            
-            # Determine the ad space and impression multiplier
-            ad_space = self._determine_ad_space(size, ad_type)
-            impression_multiplier = self._calculate_impression_multiplier(contrast, size, ad_type, product_or_brand)
-            
-            # Generate ad parameters
-            ad_params = {
-                "ad_id": str(uuid.uuid4()),
+                metadata = cad_metadata(image_path)
+        # Without any colors to go on, assume a medium-contrast creative
+        contrast = 'medium' if metadata["contrast"] is None else self._classify_contrast(metadata["contrast"])
+        return {
+            "contrast": contrast,
+            "size": self._determine_size(metadata["width"], metadata["height"]),
+            "width": metadata["width"],
+            "height": metadata["height"]
+        }
+
+    def _analyze_ad_image(self, image_path: str, name: str) -> Dict[str, Any]:
+        """
+        Validate and decode an image and derive its characteristics
+        
+        Returns:
+            dict: ad_type, size, contrast, product_or_brand, width and height
+                (plus frame_count, duration and contrast_stats for animated ads)
+        """
+        if not os.path.exists(image_path):
+            raise FileNotFoundError(f"Image file not found: {image_path}")
+        if not any(image_path.lower().endswith(fmt) for fmt in self.accepted_formats):
+            raise ValueError(f"Invalid format. Accepted formats: {self.accepted_formats}")
+        ad_type = self._determine_ad_type(image_path) #only.png is working right now
+        if ad_type not in ['static', 'animated', '3d']:
+            return {
                 "ad_type": ad_type,
-                "size": size,
-                "name": name,
-                "product_or_brand": product_or_brand,
-                "contrast": contrast,
-                "billboard_id": None,
-                "game_id": game_id,
-                "ad_space": ad_space,
-                "campaigns": [],
-                "total_impressions": 0,
-                "impression_multiplier": impression_multiplier,
-                "createdAt": datetime.now().isoformat()
+                "size": 'medium',
+                "contrast": 1.0,
+                "product_or_brand": self._predict_product_or_brand(name),
+                "width": None,
+                "height": None
             }
-            logger.info(f"Successfully processed ad: {name} (Type: {ad_type}, Space: {ad_space}, Classification: {product_or_brand})")
-            return ad_params
+
+        # Videos and vector/CAD files are hashed in chunks rather than read into memory
+        data = None
+        if ad_type in ('animated', '3d'):
+            cache_key = self.cache.key_for_file(image_path, ad_type) if self.cache is not None else None
+        else:
+            with open(image_path, 'rb') as f:
+                data = f.read()
+            cache_key = self.cache.key_for(data, ad_type) if self.cache is not None else None
+
+        # A repeat upload of the same bytes skips decoding entirely
+        measured = self.cache.get(cache_key) if cache_key is not None else None
+        if cache_key is not None:
+            increment('image.cache_hit' if measured is not None else 'image.cache_miss')
+        if measured is None:
+            if ad_type == 'animated':
+                measured = self._measure_animated(image_path)
+            elif ad_type == '3d':
+                measured = self._measure_3d(image_path)
+            else:
+                measured = self._measure_static(data)
+            if cache_key is not None:
+                self.cache.put(cache_key, {"ad_type": ad_type, **measured})
+
+        features = {key: value for key, value in measured.items() if key != "ad_type"}
+        features["ad_type"] = ad_type
+        with timer('image.classify'):
+            features["product_or_brand"] = self._predict_product_or_brand(name)
+        return features
+
+    def _build_ad_params(self, name: str, game_id: str, features: Dict[str, Any], impression_multiplier: float) -> Dict[str, Any]:
+        """
+        Assemble the ad document from the image characteristics and multiplier
+        """
+        ad_type = features["ad_type"]
+        size = features["size"]
+        product_or_brand = features["product_or_brand"]
+        with timer('image.classify'):
+            ad_space = self._determine_ad_space(size, ad_type)
+        
+        # Generate ad parameters
+        ad_params = {
+            "ad_id": str(uuid.uuid4()),
+            "ad_type": ad_type,
+            "size": size,
+            "name": name,
+            "product_or_brand": product_or_brand,
+            "contrast": features["contrast"],
+            "billboard_id": None,
+            "game_id": game_id,
+            "ad_space": ad_space,
+            "campaigns": [],
+            "total_impressions": 0,
+            "impression_multiplier": impression_multiplier,
+            "createdAt": datetime.now().isoformat()
+        }
+        # Per-clip aggregates, only measured for animated ads
+        for key in ("frame_count", "duration", "contrast_stats"):
+            if features.get(key) is not None:
+                ad_params[key] = features[key]
+        logger.info("Successfully processed ad: %s (Type: %s, Space: %s, Classification: %s)", name, ad_type, ad_space, product_or_brand)
+        return ad_params
+
+    def process_ad_image(self, image_path: str, name: str, game_id: str = None) -> Dict[str, Any]:
+        try:
+            with timer('image.analyze'):
+                features = self._analyze_ad_image(image_path, name)
+            
+            # Determine the impression multiplier
+            impression_multiplier = self._calculate_impression_multiplier(
+                features["contrast"], features["size"], features["ad_type"], features["product_or_brand"]
+            )
+            return self._build_ad_params(name, game_id, features, impression_multiplier)
             
         except Exception as e:
             logger.error(f"Error processing ad: {str(e)}")
             raise
 
+    def _analyze_job(self, job: Tuple[str, str]) -> Tuple[bool, Any]:
+        """(True, features) for an (image_path, name) job, or (False, error message)"""
+        image_path, name = job
+        try:
+            return True, self._analyze_ad_image(image_path, name)
+        except Exception as e:
+            return False, str(e)
+
+    def process_ad_images(self, jobs: List[Tuple[str, str, str]], max_workers: int = None) -> List[Dict[str, Any]]:
+        """
+        Process many ad images, decoding and analyzing them across a process pool
+        
+        Args:
+            jobs (list): (image_path, name, game_id) tuples
+            max_workers (int, optional): Pool size, defaults to the number of CPU cores
+            
+        Returns:
+            list: Ad parameters for each job in input order; a job that failed
+                is reported as {"error": message} instead of raising
+        """
+        jobs = [(job[0], job[1], job[2] if len(job) > 2 else None) for job in jobs]
+        if not jobs:
+            return []
+
+        # Decode and contrast work is CPU bound, so fan it out to worker processes,
+        # each with a copy of this preprocessor (its cache, pixel budget and formats)
+        workers = min(max_workers or os.cpu_count() or 1, len(jobs))
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(self,)) as pool:
+                analyses = list(pool.map(_analyze_in_worker, [(path, name) for path, name, _ in jobs]))
+        else:
+            analyses = [self._analyze_job((path, name)) for path, name, _ in jobs]
+
+        # Resolve all multipliers in one batch in this process
+        analyzed = [features for ok, features in analyses if ok]
+        multipliers = iter(self.calculate_impression_multipliers([
+            (f["contrast"], f["size"], f["ad_type"], f["product_or_brand"]) for f in analyzed
+        ]))
+
+        results = []
+        for (path, name, game_id), (ok, outcome) in zip(jobs, analyses):
+            if ok:
+                results.append(self._build_ad_params(name, game_id, outcome, next(multipliers)))
+            else:
+                logger.error(f"Error processing ad {name}: {outcome}")
+                results.append({"error": outcome})
+        return results
+
+# One preprocessor per pool process, a copy of the one that started the pool
+_worker_preprocessor = None
+
+def _init_worker(preprocessor: AdImagePreprocessor) -> None:
+    """Pool initializer: keep the pickled copy of the caller's preprocessor for this process's jobs"""
+    global _worker_preprocessor
+    _worker_preprocessor = preprocessor
+
+def _analyze_in_worker(job: Tuple[str, str]) -> Tuple[bool, Any]:
+    """Process-pool entry point: (True, features) or (False, error message)"""
+    return _worker_preprocessor._analyze_job(job)
+
 def create_ad_from_image(image_path: str, name: str, game_id: str = None) -> Dict[str, Any]:
     """
     Convenience function to create an ad from an image
@@ -348,6 +812,20 @@ def create_ad_from_image(image_path: str, name: str, game_id: str = None) -> Dic
     processor = AdImagePreprocessor()
     return processor.process_ad_image(image_path, name, game_id)
 
+def create_ads_from_images(jobs: List[Tuple[str, str, str]], max_workers: int = None) -> List[Dict[str, Any]]:
+    """
+    Convenience function to create many ads from images in parallel
+    
+    Args:
+        jobs (list): (image_path, name, game_id) tuples
+        max_workers (int, optional): Process pool size, defaults to the number of CPU cores
+        
+    Returns:
+        list: Ad parameters (or {"error": message}) for each job, in input order
+    """
+    processor = AdImagePreprocessor()
+    return processor.process_ad_images(jobs, max_workers)
+
 if __name__ == "__main__":
     # Example usage
     try:
@@ -14,7 +14,7 @@ const path = require('path');
 const mongoose = require('mongoose');
 const { v4: uuidv4 } = require('uuid');
 const dotenv = require('dotenv');
-const { processAdImage } = require('./process-unified-request');
+const { processAdImage, shutdownImageWorkers } = require('./process-unified-request');
 
 // Load environment variables
 dotenv.config();
@@ -117,6 +117,9 @@ async function importPipeline(filePath) {
             billboard_id: adData.billboardId || null,
             ad_space: processedAdData.ad_space,
             impression_multiplier: processedAdData.impression_multiplier,
+            frame_count: processedAdData.frame_count,
+            duration: processedAdData.duration,
+            contrast_stats: processedAdData.contrast_stats,
             ad_loc: adData.adLoc || null,
             campaigns: [{
               campaign_id: campaign.campaign_id,
@@ -223,6 +226,7 @@ async function main() {
     process.exit(1);
   } finally {
     clearTimeout(timeoutId);
+    shutdownImageWorkers();
   }
 }
 
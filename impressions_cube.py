@@ -0,0 +1,255 @@
+#Columnar day x ad-slot x distance-band store of the latest_data day files, read through memory maps
+import glob
+import hashlib
+import json
+import os
+import re
+import uuid
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+import pandas as pd
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATA_DIR = os.path.join(REPO_ROOT, 'latest_data')
+# Lives next to the day files unless IMPRESSIONS_CUBE_DIR says otherwise
+CUBE_DIR_NAME = 'cube'
+
+# Impression columns of a day file, one per distance band
+DISTANCE_BANDS = ["Close05", "Close1", "Close2", "Med05", "Med1", "Med2", "Far05", "Far1", "Far2"]
+# Per-player ratios computed by game_id_processing.process_df; kept as stored since they are not re-derivable bit for bit
+RATIO_COLUMNS = ['Close Accumulative', 'Medium Accumulative', 'Far Accumulative', 'Overall Accumulative']
+
+MANIFEST = 'manifest.json'
+# (file name, dtype, trailing shape as a function of the slot count)
+ARRAYS = {
+    'impressions': ('impressions.bin', np.int64, lambda slots: (slots, len(DISTANCE_BANDS))),
+    'players': ('players.bin', np.int64, lambda slots: (slots,)),
+    'ratios': ('ratios.bin', np.float64, lambda slots: (slots, len(RATIO_COLUMNS))),
+}
+
+
+def day_file_order(path: str) -> List[int]:
+    """Sort key for day files: the numbers in the name, so Hg3.10 comes after Hg3.9"""
+    return [int(part) for part in re.findall(r'\d+', os.path.basename(path))]
+
+
+def day_file_version(path: str) -> List[int]:
+    """[size, mtime_ns] of a day file; a rewritten file gets a new version"""
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def day_versions(data_dir: str = DEFAULT_DATA_DIR, pattern: str = '*_test.csv') -> Dict[str, List[int]]:
+    """day file name -> day_file_version for every day file in data_dir"""
+    return {os.path.basename(path): day_file_version(path) for path in glob.glob(os.path.join(data_dir, pattern))}
+
+
+def cube_dir_for(data_dir: str) -> str:
+    """
+    Where the cube of data_dir lives: next to the day files, or under
+    IMPRESSIONS_CUBE_DIR in a subdirectory of its own per data_dir, so games
+    whose day files share names don't end up in one cube
+    """
+    root = os.environ.get('IMPRESSIONS_CUBE_DIR')
+    if not root:
+        return os.path.join(data_dir, CUBE_DIR_NAME)
+    data_dir = os.path.abspath(data_dir)
+    digest = hashlib.sha256(data_dir.encode()).hexdigest()[:16]
+    return os.path.join(root, f"{os.path.basename(data_dir) or 'root'}-{digest}")
+
+
+class ImpressionsCube:
+    """
+    Append-only columnar store of daily impressions per ad slot and distance band.
+
+    Each array is a raw little-endian file of one fixed-size block per day
+    (impressions: slots x bands int64, players: slots int64, ratios: slots x 4
+    float64), so readers np.memmap them with no parsing and appending a day is
+    one write at the end of each file. manifest.json lists the slots, bands and
+    day names and is replaced atomically after the data is written; readers only
+    look at as many days as it lists, so a half-written append is never seen.
+    A day that brings a new slot rewrites the files once, widened with zeros.
+    The manifest also records each day file's size and mtime_ns; a day file
+    that has since been rewritten has its block overwritten in place.
+    """
+
+    def __init__(self, cube_dir: str):
+        self.cube_dir = cube_dir
+        self.slots: List[str] = []
+        self.days: List[str] = []
+        # day_file_version of each day when it was stored, None if not known
+        self.versions: List[Optional[List[int]]] = []
+        manifest_path = os.path.join(cube_dir, MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            if manifest['bands'] != DISTANCE_BANDS:
+                raise ValueError(f"Cube in {cube_dir} has bands {manifest['bands']}, expected {DISTANCE_BANDS}.")
+            self.slots = manifest['slots']
+            self.days = manifest['days']
+            # Cubes written before versions were recorded get every day re-read once
+            self.versions = manifest.get('versions', [None] * len(self.days))
+
+    @classmethod
+    def from_directory(cls, data_dir: str = DEFAULT_DATA_DIR, pattern: str = '*_test.csv') -> 'ImpressionsCube':
+        """Open the cube for data_dir and bring it up to date with the day files"""
+        cube = cls(cube_dir_for(data_dir))
+        cube.ingest_directory(data_dir, pattern)
+        return cube
+
+    @property
+    def num_days(self) -> int:
+        return len(self.days)
+
+    def _array(self, name: str, num_days: int = None) -> np.ndarray:
+        file_name, dtype, trailing = ARRAYS[name]
+        shape = (self.num_days if num_days is None else num_days,) + trailing(len(self.slots))
+        if shape[0] == 0 or not self.slots:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(os.path.join(self.cube_dir, file_name), dtype=dtype, mode='r', shape=shape)
+
+    @property
+    def impressions(self) -> np.ndarray:
+        """days x slots x bands, read-only memory map"""
+        return self._array('impressions')
+
+    @property
+    def players(self) -> np.ndarray:
+        """days x slots player counts, read-only memory map"""
+        return self._array('players')
+
+    @property
+    def ratios(self) -> np.ndarray:
+        """days x slots x RATIO_COLUMNS, read-only memory map"""
+        return self._array('ratios')
+
+    def overall(self) -> np.ndarray:
+        """days x slots impressions summed over every distance band"""
+        return self.impressions.sum(axis=2)
+
+    def day_frame(self, day: int) -> pd.DataFrame:
+        """One day in the layout of its original CSV, as pd.read_csv would return it"""
+        frame = pd.DataFrame(np.asarray(self.impressions[day]), columns=DISTANCE_BANDS)
+        frame.insert(0, 'Unnamed: 0', self.slots)
+        frame[RATIO_COLUMNS] = np.asarray(self.ratios[day])
+        frame['player_count'] = np.asarray(self.players[day])
+        return frame
+
+    def day_frame_by_name(self, day: str) -> pd.DataFrame:
+        """
+        day_frame for the day stored from the file named day (e.g. Hg3.1_test.csv)
+
+        Positions follow the order days were appended in, so look days up by name
+        whenever the position isn't already known.
+
+        Raises:
+            KeyError: If the cube holds no day of that name
+        """
+        if day not in self.days:
+            raise KeyError(f"No day {day} in the cube at {self.cube_dir}")
+        return self.day_frame(self.days.index(day))
+
+    def _write_manifest(self) -> None:
+        manifest = {"bands": DISTANCE_BANDS, "ratios": RATIO_COLUMNS, "slots": self.slots, "days": self.days,
+                    "versions": self.versions}
+        tmp_path = os.path.join(self.cube_dir, f".{uuid.uuid4().hex}.json")
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.cube_dir, MANIFEST))
+
+    def _widen(self, new_slots: List[str]) -> None:
+        """Rewrite every array with columns for new_slots (zeros on earlier days)"""
+        old = {name: np.array(self._array(name)) for name in ARRAYS}
+        self.slots = self.slots + new_slots
+        for name, (file_name, dtype, trailing) in ARRAYS.items():
+            widened = np.zeros((self.num_days,) + trailing(len(self.slots)), dtype=dtype)
+            widened[:, :old[name].shape[1]] = old[name]
+            tmp_path = os.path.join(self.cube_dir, f".{uuid.uuid4().hex}.bin")
+            widened.tofile(tmp_path)
+            os.replace(tmp_path, os.path.join(self.cube_dir, file_name))
+        self._write_manifest()
+
+    def _blocks(self, frame: pd.DataFrame) -> Dict[str, np.ndarray]:
+        """One day's block of every array, widening the cube first if the day brings new slots"""
+        os.makedirs(self.cube_dir, exist_ok=True)
+        frame = frame.set_index(frame.columns[0])
+        frame.index = frame.index.astype(str)
+        new_slots = [slot for slot in frame.index if slot not in self.slots]
+        if new_slots:
+            self._widen(new_slots)
+        # Slots missing from this day are stored as zeros
+        frame = frame.reindex(self.slots)
+        return {
+            'impressions': frame[DISTANCE_BANDS].fillna(0).to_numpy(dtype=np.int64),
+            'players': frame['player_count'].fillna(0).to_numpy(dtype=np.int64),
+            'ratios': frame[RATIO_COLUMNS].fillna(0).to_numpy(dtype=np.float64),
+        }
+
+    def _block_bytes(self, name: str) -> int:
+        _, dtype, trailing = ARRAYS[name]
+        return int(np.prod(trailing(len(self.slots)))) * np.dtype(dtype).itemsize
+
+    def append_day(self, day: str, frame: pd.DataFrame, version: Optional[List[int]] = None) -> None:
+        """
+        Append one day
+
+        Args:
+            day (str): Name of the day (the day file's name)
+            frame (pd.DataFrame): Day file contents, one row per slot with the slot name in the first column
+            version (list): day_file_version of the day file, to notice when it is rewritten
+        """
+        blocks = self._blocks(frame)
+        for name, (file_name, dtype, _) in ARRAYS.items():
+            path = os.path.join(self.cube_dir, file_name)
+            with open(path, 'ab') as f:
+                # Drop anything past the last complete day, e.g. from an interrupted append
+                f.truncate(self.num_days * self._block_bytes(name))
+                f.write(np.ascontiguousarray(blocks[name], dtype=dtype).tobytes())
+        self.days.append(day)
+        self.versions.append(version)
+        self._write_manifest()
+
+    def replace_day(self, day: str, frame: pd.DataFrame, version: Optional[List[int]] = None) -> None:
+        """Overwrite the block of a day already in the cube, e.g. after its day file was rewritten"""
+        index = self.days.index(day)
+        blocks = self._blocks(frame)
+        for name, (file_name, dtype, _) in ARRAYS.items():
+            with open(os.path.join(self.cube_dir, file_name), 'r+b') as f:
+                f.seek(index * self._block_bytes(name))
+                f.write(np.ascontiguousarray(blocks[name], dtype=dtype).tobytes())
+        self.versions[index] = version
+        self._write_manifest()
+
+    def day_versions(self) -> Dict[str, Optional[List[int]]]:
+        """day name -> day_file_version it was stored from, comparable with day_versions(data_dir)"""
+        return dict(zip(self.days, self.versions))
+
+    def ingest_directory(self, data_dir: str = DEFAULT_DATA_DIR, pattern: str = '*_test.csv') -> int:
+        """
+        Append every day file in data_dir that is not in the cube yet, oldest
+        first, and re-read those rewritten since they were stored. Returns how
+        many days were added or replaced
+        """
+        changed = 0
+        stored = self.day_versions()
+        for path in sorted(glob.glob(os.path.join(data_dir, pattern)), key=day_file_order):
+            day = os.path.basename(path)
+            version = day_file_version(path)
+            if day not in stored:
+                self.append_day(day, pd.read_csv(path), version)
+            elif stored[day] != version:
+                self.replace_day(day, pd.read_csv(path), version)
+            else:
+                continue
+            changed += 1
+        return changed
+
+    def summary(self) -> Dict[str, Any]:
+        return {"cube_dir": self.cube_dir, "days": self.num_days, "slots": len(self.slots), "bands": len(DISTANCE_BANDS)}
+
+
+if __name__ == "__main__":
+    import sys
+    cube = ImpressionsCube.from_directory(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_DATA_DIR)
+    print(json.dumps(cube.summary(), indent=2))
@@ -0,0 +1,168 @@
+#Lightweight instrumentation for the Python pipeline: per-stage timers, counters and an opt-in profiler
+import atexit
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, Any
+
+
+# PIPELINE_PROFILE=1 wraps profiled runs in cProfile and tracemalloc; output goes to PIPELINE_PROFILE_DIR
+PROFILE_ENABLED = os.environ.get('PIPELINE_PROFILE', '0') not in ('', '0')
+PROFILE_DIR = os.environ.get('PIPELINE_PROFILE_DIR', 'profiles')
+# PIPELINE_METRICS=<path> writes the stage timers at exit (.prom for Prometheus text, otherwise JSON)
+METRICS_PATH = os.environ.get('PIPELINE_METRICS')
+
+
+class _Stage:
+    __slots__ = ('count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+
+class Metrics:
+    """
+    Process-wide registry of stage timings and counters.
+
+    Recording a timing is one perf_counter pair and a few additions under a
+    lock, so stages can stay instrumented in production.
+    """
+
+    def __init__(self):
+        self._stages: Dict[str, _Stage] = {}
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            entry = self._stages.get(stage)
+            if entry is None:
+                entry = self._stages[stage] = _Stage()
+            entry.count += 1
+            entry.total += seconds
+            entry.min = min(entry.min, seconds)
+            entry.max = max(entry.max, seconds)
+
+    def increment(self, counter: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + amount
+
+    @contextmanager
+    def timer(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def timed(self, stage: str):
+        """Decorator form of timer()"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "stages": {
+                    name: {
+                        "count": s.count,
+                        "total_seconds": s.total,
+                        "mean_seconds": s.total / s.count if s.count else 0.0,
+                        "min_seconds": s.min if s.count else 0.0,
+                        "max_seconds": s.max
+                    }
+                    for name, s in sorted(self._stages.items())
+                },
+                "counters": dict(sorted(self._counters.items()))
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, prefix: str = 'pipeline') -> str:
+        """Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = [
+            f"# TYPE {prefix}_stage_seconds summary",
+        ]
+        for name, s in snapshot["stages"].items():
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {s["count"]}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {s["total_seconds"]:.9f}')
+        lines.append(f"# TYPE {prefix}_stage_seconds_max gauge")
+        for name, s in snapshot["stages"].items():
+            lines.append(f'{prefix}_stage_seconds_max{{stage="{name}"}} {s["max_seconds"]:.9f}')
+        lines.append(f"# TYPE {prefix}_events_total counter")
+        for name, value in snapshot["counters"].items():
+            lines.append(f'{prefix}_events_total{{event="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str) -> None:
+        with open(path, 'w') as f:
+            f.write(self.to_prometheus() if path.endswith('.prom') else self.to_json())
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+
+
+metrics = Metrics()
+timer = metrics.timer
+timed = metrics.timed
+increment = metrics.increment
+
+
+@contextmanager
+def profile_run(name: str):
+    """
+    Profile a whole run with cProfile and tracemalloc when PIPELINE_PROFILE is set
+
+    Writes <PIPELINE_PROFILE_DIR>/<name>.prof (open with pstats or snakeviz) and
+    prints the top functions by cumulative time and the top allocation sites to
+    stderr. Does nothing when profiling is off.
+    """
+    if not PROFILE_ENABLED:
+        yield
+        return
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        profile_path = os.path.join(PROFILE_DIR, f"{name}.prof")
+        profiler.dump_stats(profile_path)
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(25)
+        print(report.getvalue(), file=sys.stderr)
+        print(f"tracemalloc: current={current / 2**20:.1f} MiB peak={peak / 2**20:.1f} MiB", file=sys.stderr)
+        for stat in snapshot.statistics('lineno')[:10]:
+            print(f"  {stat}", file=sys.stderr)
+        print(f"Profile written to {profile_path}", file=sys.stderr)
+
+
+if METRICS_PATH:
+    atexit.register(metrics.dump, METRICS_PATH)
@@ -64,6 +64,19 @@ const AdSchema = new mongoose.Schema({
     type: String,
     default: 'sidebar'
   },
+  // Per-clip aggregates from the image analysis, only set for animated ads
+  frame_count: {
+    type: Number
+  },
+  duration: {
+    type: Number
+  },
+  contrast_stats: {
+    contrast_mean: Number,
+    contrast_min: Number,
+    contrast_max: Number,
+    contrast_pooled: Number
+  },
   createdAt: {
     type: Date,
     default: Date.now
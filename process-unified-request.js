@@ -1,7 +1,28 @@
 const fs = require('fs');
 const path = require('path');
-const { spawn } = require('child_process');
 const uuid = require('uuid');
+const { PythonWorkerPool } = require('./python-worker-pool');
+
+// Shared pool of `process_image.py --worker` processes, created on first use
+let imageWorkerPool = null;
+
+function getImageWorkerPool() {
+  if (!imageWorkerPool) {
+    const size = parseInt(process.env.IMAGE_WORKERS, 10) || undefined;
+    imageWorkerPool = new PythonWorkerPool({ size });
+  }
+  return imageWorkerPool;
+}
+
+/**
+ * Stop the Python image workers so the Node process can exit
+ */
+function shutdownImageWorkers() {
+  if (imageWorkerPool) {
+    imageWorkerPool.close();
+    imageWorkerPool = null;
+  }
+}
 
 async function processUnifiedRequest(requestData, outputDir = './processed_data') {
   try {
@@ -26,10 +47,13 @@ async function processUnifiedRequest(requestData, outputDir = './processed_data'
         ads: []
       };
       
-      // Process each ad image for this game
-      for (const ad of gameSelection.ads) {
-        // Process the image and get ad data
-        const adData = await processAdImage(ad.filePath, gameSelection.gameId);
+      // Process each ad image for this game (fanned out across the worker pool)
+      const processedAds = await Promise.all(
+        gameSelection.ads.map(ad => processAdImage(ad.filePath, gameSelection.gameId))
+      );
+      
+      for (const [index, ad] of gameSelection.ads.entries()) {
+        const adData = processedAds[index];
         
         // Add to game's ads with target impressions
         gameData.ads.push({
@@ -93,58 +117,21 @@ function processAdImage(imagePath, gameId) {
     try {
       console.log(`Processing image: ${imagePath}`);
       
-      // Use the dedicated Python script for image processing
-      const pythonProcess = spawn('python', [
-        'process_image.py',  // Use our standalone script
-        imagePath,
-        adName,
-        gameId || ""
-      ]);
-      
-      let outputData = '';
-      let errorData = '';
-      pythonProcess.stdout.on('data', (data) => {
-        outputData += data.toString();
-      });
-      
-      pythonProcess.stderr.on('data', (data) => {
-        errorData += data.toString();
-        console.error(`Python stderr: ${data.toString()}`);
-      });
-      
-      pythonProcess.on('close', (code) => {
-        console.log(`Python process exited with code ${code}`);
-        
-        try {
-          if (outputData.trim()) {
-            console.log(`Python output: ${outputData.trim()}`);
-            const adData = JSON.parse(outputData);
-            if (adData.error) {
-              console.log(`Python error: ${adData.error}. Using mock data instead.`);
-              resolve(mockImageProcessor());
-            } else {
-              console.log("Successfully processed image with Python!");
-              resolve(adData);
-            }
-          } else {
-            console.log(`No output from Python. Using mock data instead.`);
-            if (errorData) {
-              console.log(`Python stderr: ${errorData}`);
-            }
+      // Use the shared pool of warm Python workers for image processing
+      getImageWorkerPool().processImage(imagePath, adName, gameId)
+        .then(adData => {
+          if (adData && adData.error) {
+            console.log(`Python error: ${adData.error}. Using mock data instead.`);
             resolve(mockImageProcessor());
+          } else {
+            console.log("Successfully processed image with Python!");
+            resolve(adData);
           }
-        } catch (error) {
-          console.log(`Error parsing Python output: ${error.message}. Using mock data instead.`);
-          console.log(`Raw Python output: ${outputData}`);
+        })
+        .catch(error => {
+          console.log(`Python worker failed: ${error.message}. Using mock data instead.`);
           resolve(mockImageProcessor());
-        }
-      });
-      
-      // Handle Python startup errors
-      pythonProcess.on('error', (err) => {
-        console.log(`Failed to start Python process: ${err.message}. Using mock data instead.`);
-        resolve(mockImageProcessor());
-      });
+        });
     } catch (error) {
       // Fallback to mock data
       console.log(`Failed to use Python processor: ${error.message}. Using mock data instead.`);
@@ -185,11 +172,13 @@ if (require.main === module) {
     .catch(error => {
       console.error('Processing failed:', error);
       process.exit(1);
-    });
+    })
+    .finally(shutdownImageWorkers);
 }
 
 module.exports = {
   processUnifiedRequest,
   processUnifiedRequestFile,
-  processAdImage
+  processAdImage,
+  shutdownImageWorkers
 }; 
\ No newline at end of file
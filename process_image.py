@@ -9,38 +9,80 @@ import traceback
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 try:
-    from image_preprocessing import create_ad_from_image
-    
-    def process_image(image_path, name, game_id=None):
+    from image_preprocessing import AdImagePreprocessor, create_ad_from_image
+    from instrumentation import profile_run
+
+    def process_image(image_path, name, game_id=None, processor=None):
         """Process an image and return ad parameters"""
         try:
             # Verify the image path exists
             if not os.path.exists(image_path):
                 return {"error": f"Image not found: {image_path}"}
-                
-            # Process the image
+
+            # Process the image (reuse the warm processor in worker mode)
+            if processor is not None:
+                return processor.process_ad_image(image_path, name, game_id)
             ad_params = create_ad_from_image(image_path, name, game_id)
             return ad_params
         except Exception as e:
             traceback.print_exc()
             return {"error": str(e)}
-    
-    # Main execution - expects args: image_path, name, [game_id]
+
+    def run_worker(input_stream=sys.stdin, output_stream=None):
+        """
+        Long-running worker mode: read newline-delimited JSON jobs from
+        input_stream and write one JSON result line per job to output_stream.
+
+        Each job looks like {"id": ..., "image_path": ..., "name": ..., "game_id": ...}
+        and is answered with {"id": ..., "result": {...}}. The preprocessor is
+        built once and reused, so only the first job pays the startup cost.
+
+        By default the results go to a copy of stdout and stdout itself is
+        pointed at stderr, so a stray print (from Python or native code) can
+        never be mistaken for a result line.
+        """
+        if output_stream is None:
+            sys.stdout.flush()
+            output_stream = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+            os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+        processor = AdImagePreprocessor()
+        for line in input_stream:
+            line = line.strip()
+            if not line:
+                continue
+            job_id = None
+            try:
+                job = json.loads(line)
+                job_id = job.get("id")
+                result = process_image(job["image_path"], job["name"], job.get("game_id") or None, processor)
+            except Exception as e:
+                traceback.print_exc()
+                result = {"error": f"Invalid job: {str(e)}"}
+            output_stream.write(json.dumps({"id": job_id, "result": result}) + "\n")
+            output_stream.flush()
+
+    # Main execution - expects args: image_path, name, [game_id] or --worker
     if __name__ == "__main__":
+        if len(sys.argv) > 1 and sys.argv[1] == "--worker":
+            with profile_run("process_image_worker"):
+                run_worker()
+            sys.exit(0)
+
         if len(sys.argv) < 3:
-            print(json.dumps({"error": "Missing required arguments: image_path, name [, game_id]"}))
+            print(json.dumps({"error": "Missing required arguments: image_path, name [, game_id] (or --worker)"}))
             sys.exit(1)
-            
+
         image_path = sys.argv[1]
         name = sys.argv[2]
         game_id = sys.argv[3] if len(sys.argv) > 3 else None
-        
-        result = process_image(image_path, name, game_id)
+
+        with profile_run("process_image"):
+            result = process_image(image_path, name, game_id)
         print(json.dumps(result))
-        
+
 except ImportError as e:
     print(json.dumps({"error": f"ImportError: {str(e)}"}))
     traceback.print_exc()
 except Exception as e:
     print(json.dumps({"error": f"Error: {str(e)}"}))
-    traceback.print_exc() 
\ No newline at end of file
+    traceback.print_exc()
@@ -0,0 +1,138 @@
+const path = require('path');
+const os = require('os');
+const { spawn } = require('child_process');
+
+/**
+ * Pool of long-running `process_image.py --worker` processes.
+ *
+ * Each worker keeps its Python interpreter and AdImagePreprocessor warm and
+ * answers newline-delimited JSON jobs, so a large campaign import pays the
+ * interpreter startup once per worker instead of once per ad.
+ */
+class PythonWorkerPool {
+  /**
+   * @param {Object} options
+   * @param {number} [options.size] - Number of workers (defaults to min(4, cpu count))
+   * @param {string} [options.pythonPath] - Python executable
+   * @param {string} [options.scriptPath] - Path to process_image.py
+   */
+  constructor(options = {}) {
+    this.size = options.size || Math.max(1, Math.min(4, os.cpus().length));
+    this.pythonPath = options.pythonPath || 'python';
+    this.scriptPath = options.scriptPath || path.join(__dirname, 'process_image.py');
+    this.workers = [];
+    this.queue = [];
+    this.nextJobId = 1;
+  }
+
+  _spawnWorker() {
+    const child = spawn(this.pythonPath, [this.scriptPath, '--worker']);
+    const worker = { child, buffer: '', current: null, alive: true };
+
+    child.stdout.on('data', (data) => {
+      worker.buffer += data.toString();
+      let newline;
+      while ((newline = worker.buffer.indexOf('\n')) >= 0) {
+        const line = worker.buffer.slice(0, newline).trim();
+        worker.buffer = worker.buffer.slice(newline + 1);
+        if (line) {
+          this._handleLine(worker, line);
+        }
+      }
+    });
+
+    child.stderr.on('data', (data) => {
+      console.error(`Python worker stderr: ${data.toString()}`);
+    });
+
+    const onExit = (err) => {
+      if (!worker.alive) return;
+      worker.alive = false;
+      this.workers = this.workers.filter(w => w !== worker);
+      if (worker.current) {
+        worker.current.reject(err || new Error('Python worker exited unexpectedly'));
+        worker.current = null;
+      }
+      this._dispatch();
+    };
+    child.on('error', onExit);
+    // Writing a job to a worker that just died fails with EPIPE here rather than on the child
+    child.stdin.on('error', onExit);
+    child.on('close', () => onExit());
+
+    this.workers.push(worker);
+    return worker;
+  }
+
+  _handleLine(worker, line) {
+    let message = null;
+    try {
+      message = JSON.parse(line);
+    } catch (error) {
+      // Not JSON, so not a reply
+    }
+    if (!message || typeof message !== 'object' || !('id' in message)) {
+      // Something in the worker printed to stdout; it must not be taken for the current job's reply
+      console.error(`Python worker stdout: ${line}`);
+      return;
+    }
+    const job = worker.current;
+    worker.current = null;
+    if (job) {
+      if (message.id !== job.id) {
+        job.reject(new Error(`Python worker answered job ${message.id}, expected ${job.id}`));
+      } else {
+        job.resolve(message.result);
+      }
+    }
+    this._dispatch();
+  }
+
+  _dispatch() {
+    while (this.queue.length > 0) {
+      let worker = this.workers.find(w => w.alive && !w.current);
+      if (!worker && this.workers.length < this.size) {
+        worker = this._spawnWorker();
+      }
+      if (!worker) return;
+
+      const job = this.queue.shift();
+      worker.current = job;
+      worker.child.stdin.write(JSON.stringify(job.payload) + '\n');
+    }
+  }
+
+  /**
+   * Process one image on the next free worker
+   * @param {string} imagePath - Path to the image file
+   * @param {string} name - Name of the ad
+   * @param {string} gameId - ID of the game this ad belongs to
+   * @returns {Promise<Object>} Ad parameters (or an object with an `error` field)
+   */
+  processImage(imagePath, name, gameId) {
+    return new Promise((resolve, reject) => {
+      const id = this.nextJobId++;
+      this.queue.push({
+        id,
+        payload: { id, image_path: imagePath, name, game_id: gameId || null },
+        resolve,
+        reject
+      });
+      this._dispatch();
+    });
+  }
+
+  /**
+   * Stop all workers; queued jobs are rejected
+   */
+  close() {
+    for (const job of this.queue.splice(0)) {
+      job.reject(new Error('Python worker pool closed'));
+    }
+    for (const worker of this.workers) {
+      worker.child.stdin.end();
+    }
+  }
+}
+
+module.exports = { PythonWorkerPool };
@@ -0,0 +1,179 @@
+#Nightly batch: forecast and schedule many games in parallel and write one consolidated result file
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, List, Tuple
+
+from control_predictor import forecast_directory
+from scheduling_optimizer import plan_slot
+from campaign_allocator import allocate_campaigns
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import timed
+
+logger = logging.getLogger(__name__)
+
+# Times a game left unfinished by a dead worker is rerun, each time in a worker process of its own
+CRASH_RETRIES = int(os.environ.get('BATCH_CRASH_RETRIES', '1'))
+
+
+def run_game(game: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Forecast one game and answer its schedule requests; never raises
+
+    The game dict has a `game_id`, the `data_dir` holding its day files and
+    optionally `forecast_steps` (default 30), `lags` (default 1), `slots` (a
+    list of {slot, start, end, target} single-slot plans) and `campaigns` (a
+    list for campaign_allocator.allocate_campaigns, with an optional
+    `capacity`). Any failure is reported in the result instead of raised so
+    one bad game can't take the batch down.
+    """
+    result = {"game_id": game.get("game_id"), "status": "ok"}
+    started = time.perf_counter()
+    try:
+        forecast, _ = forecast_directory(game["data_dir"], forecast_steps=game.get("forecast_steps", 30),
+                                         lags=game.get("lags", 1))
+        result["forecast_seconds"] = time.perf_counter() - started
+        result["forecast"] = forecast.tolist()
+
+        schedule_started = time.perf_counter()
+        if game.get("slots"):
+            result["slot_plans"] = [
+                dict(request, **plan_slot(forecast, request["slot"], request["start"], request["end"], request["target"]))
+                for request in game["slots"]
+            ]
+        if game.get("campaigns"):
+            result["allocation"] = allocate_campaigns(forecast, game["campaigns"], capacity=game.get("capacity", 1))
+        result["schedule_seconds"] = time.perf_counter() - schedule_started
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = f"{type(e).__name__}: {str(e)}"
+        result["traceback"] = traceback.format_exc()
+    result["seconds"] = time.perf_counter() - started
+    return result
+
+
+def _run_isolated(games: List[Dict[str, Any]], indices: List[int],
+                 workers: int) -> Tuple[Dict[int, Dict[str, Any]], Dict[int, str]]:
+    """
+    Run the given games each in a one-off worker process, `workers` at a time
+
+    A worker dying then only takes down the game it was running.
+
+    Returns:
+        tuple: (index -> result for the games that finished, index -> error
+            for the games whose worker died)
+    """
+    results, crashed = {}, {}
+    pending = list(indices)
+    running = {}
+    while pending or running:
+        while pending and len(running) < workers:
+            i = pending.pop(0)
+            pool = ProcessPoolExecutor(max_workers=1)
+            running[pool.submit(run_game, games[i])] = (i, pool)
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            i, pool = running.pop(future)
+            pool.shutdown()
+            try:
+                results[i] = future.result()
+            except BrokenProcessPool as e:
+                crashed[i] = str(e)
+    return results, crashed
+
+
+@timed('batch.run')
+def run_batch(games: List[Dict[str, Any]], max_workers: int = None,
+              crash_retries: int = CRASH_RETRIES) -> Dict[str, Any]:
+    """
+    Run every game across a process pool
+
+    A worker dying outright (e.g. killed for memory) breaks the pool and fails
+    every game it had not finished. Those games are rerun up to crash_retries
+    times, each in a worker of its own, so only a game that kills its own
+    worker is reported as failed.
+
+    Returns:
+        dict: summary (games, succeeded, failed, rerun, wall_seconds, workers)
+            and the per-game results in manifest order
+    """
+    started = time.perf_counter()
+    workers = min(max_workers or os.cpu_count() or 1, max(len(games), 1))
+    results: List[Dict[str, Any]] = [None] * len(games)
+    rerun = 0
+    if workers > 1:
+        crashed = {}
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(run_game, game): i for i, game in enumerate(games)}
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except BrokenProcessPool as e:
+                    crashed[i] = str(e)
+        for _ in range(crash_retries):
+            if not crashed:
+                break
+            logger.warning("A worker process died; rerunning %d unfinished games one per process", len(crashed))
+            rerun += len(crashed)
+            finished, crashed = _run_isolated(games, sorted(crashed), workers)
+            for i, result in finished.items():
+                results[i] = result
+        for i, error in crashed.items():
+            results[i] = {"game_id": games[i].get("game_id"), "status": "error",
+                          "error": f"Worker process died: {error}"}
+    else:
+        results = [run_game(game) for game in games]
+
+    failed = [r for r in results if r["status"] != "ok"]
+    for r in failed:
+        logger.error("Game %s failed: %s", r["game_id"], r["error"])
+    return {
+        "summary": {
+            "games": len(games),
+            "succeeded": len(games) - len(failed),
+            "failed": len(failed),
+            "rerun": rerun,
+            "workers": workers,
+            "wall_seconds": time.perf_counter() - started
+        },
+        "games": results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Forecast and schedule every game in a manifest")
+    parser.add_argument("manifest", help='JSON file: {"games": [{"game_id", "data_dir", ...}]}')
+    parser.add_argument("-o", "--output", default="batch_results.json", help="Consolidated result file")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="Process pool size (default: CPU count)")
+    args = parser.parse_args()
+
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+    # Relative data_dirs are relative to the manifest
+    base_dir = os.path.dirname(os.path.abspath(args.manifest))
+    games = manifest["games"] if isinstance(manifest, dict) else manifest
+    for game in games:
+        game["data_dir"] = os.path.join(base_dir, game["data_dir"])
+
+    batch = run_batch(games, args.workers)
+    tmp_path = args.output + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(batch, f, indent=2)
+    os.replace(tmp_path, args.output)
+    summary = batch["summary"]
+    print(f"{summary['succeeded']}/{summary['games']} games planned in {summary['wall_seconds']:.1f}s "
+          f"with {summary['workers']} workers; results in {args.output}")
+    sys.exit(1 if summary["failed"] else 0)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper())
+    main()
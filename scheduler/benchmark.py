@@ -0,0 +1,206 @@
+#Benchmarks for the forecasting and scheduling paths on synthetic data, with JSON results that can be diffed between versions
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, Any, Callable, List
+
+import numpy as np
+
+from control_predictor import fit_ar_batch, forecast_impressions, forecast_ar_slot, simulate_ar_paths
+from scheduling_optimizer import min_days_close_to_target, min_days_exhaustive
+from campaign_allocator import allocate_campaigns
+from schedule_service import ScheduleIndex
+from online_forecaster import OnlineARForecaster
+
+# days: history length, slots: per game, games: stacked as extra series, target: impressions to reach
+SIZES = {
+    'small': {'days': 30, 'slots': 8, 'games': 1, 'target': 10 ** 6, 'paths': 1000, 'campaigns': 10},
+    'medium': {'days': 90, 'slots': 50, 'games': 10, 'target': 10 ** 7, 'paths': 5000, 'campaigns': 100},
+    'large': {'days': 365, 'slots': 50, 'games': 100, 'target': 10 ** 8, 'paths': 10000, 'campaigns': 300},
+}
+# A case counts as regressed when it is this much slower (or uses this much more memory) than the baseline
+REGRESSION_RATIO = 1.25
+# Timing differences below this many seconds are treated as noise
+NOISE_SECONDS = 0.005
+
+
+def synthetic_impressions(days: int, slots: int, games: int = 1, level: float = 200000.0, seed: int = 0) -> np.ndarray:
+    """
+    days x (slots * games) daily impressions from independent AR(1) processes
+
+    Each series gets its own mean (log-uniform around level), persistence and
+    noise, roughly like the Hg3 day files, and is floored at zero.
+    """
+    rng = np.random.default_rng(seed)
+    num_series = slots * games
+    means = level * np.exp(rng.uniform(-1.0, 1.0, num_series))
+    persistence = rng.uniform(0.3, 0.9, num_series)
+    noise = means * rng.uniform(0.05, 0.3, num_series)
+    series = np.empty((days, num_series))
+    series[0] = means
+    for day in range(1, days):
+        series[day] = means + persistence * (series[day - 1] - means) + noise * rng.standard_normal(num_series)
+    return np.maximum(series, 0).round()
+
+
+def measure(func: Callable[[], Any], repeats: int, budget: float) -> Dict[str, Any]:
+    """Time func (min and median over up to `repeats` runs within `budget` seconds), then its peak traced memory"""
+    timings: List[float] = []
+    deadline = time.perf_counter() + budget
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+        if time.perf_counter() > deadline:
+            break
+    # Separate run: tracemalloc slows allocation-heavy code down
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "seconds_min": min(timings),
+        "seconds_median": statistics.median(timings),
+        "runs": len(timings),
+        "peak_bytes": peak
+    }
+
+
+def cases(size: Dict[str, Any], seed: int) -> List[Dict[str, Any]]:
+    """(name, params, callable) for every benchmarked path at one size"""
+    history = synthetic_impressions(size['days'], size['slots'], size['games'], seed=seed)
+    forecast = forecast_impressions(history, forecast_steps=size['days'])
+    slot_forecast = np.maximum(forecast[:, 0], 0)
+    # Target scaled so it takes a sizeable share of the slot's days
+    target = min(size['target'], int(slot_forecast.sum() * 0.6))
+    paths = simulate_ar_paths(history[:, :size['slots']], forecast_steps=size['days'], num_paths=size['paths'], seed=seed)
+    rng = np.random.default_rng(seed)
+    campaigns = []
+    for c in range(size['campaigns']):
+        start = int(rng.integers(0, max(size['days'] - 10, 1)))
+        campaigns.append({"name": f"c{c}", "start": start, "end": start + int(rng.integers(7, 40)),
+                          "slots": sorted(rng.choice(size['slots'], size=max(2, size['slots'] // 4), replace=False).tolist()),
+                          "target": float(np.maximum(forecast[:, :size['slots']], 0).mean() * rng.integers(1, 8))})
+    index = ScheduleIndex(forecast)
+    num_queries = 10000
+    queries = (rng.integers(0, forecast.shape[1], num_queries), rng.integers(0, size['days'] // 2, num_queries),
+               rng.integers(size['days'] // 2, size['days'], num_queries), rng.integers(0, target, num_queries))
+
+    # Million-scale days with a multi-million target: the swap bitsets get millions of bits wide
+    large_values = synthetic_impressions(size['days'], 1, level=10 ** 6, seed=seed)[:, 0]
+    large_target = int(large_values.sum() * 0.1)
+
+    def online_updates():
+        with tempfile.TemporaryDirectory() as state_dir:
+            online = OnlineARForecaster(os.path.join(state_dir, 'state.npz'))
+            names = [f"s{i}" for i in range(history.shape[1])]
+            for day in range(history.shape[0]):
+                online.update(dict(zip(names, history[day])), f"d{day}")
+            online.forecast(30)
+
+    series = history.shape[1]
+    found = [
+        ("fit_ar_batch", {"days": size['days'], "series": series}, lambda: fit_ar_batch(history)),
+        ("forecast_impressions", {"days": size['days'], "series": series, "steps": 30},
+         lambda: forecast_impressions(history, forecast_steps=30)),
+        ("forecast_ar_slot", {"days": size['days'], "steps": 30}, lambda: forecast_ar_slot(history[:, 0], forecast_steps=30)),
+        ("simulate_ar_paths", {"days": size['days'], "series": size['slots'], "paths": size['paths']},
+         lambda: simulate_ar_paths(history[:, :size['slots']], forecast_steps=size['days'], num_paths=size['paths'])),
+        ("online_forecaster", {"days": size['days'], "series": series}, online_updates),
+        ("min_days_close_to_target", {"days": len(slot_forecast), "target": target},
+         lambda: min_days_close_to_target(slot_forecast, target)),
+        ("min_days_large_values", {"days": size['days'], "max_value": int(large_values.max()), "target": large_target},
+         lambda: min_days_close_to_target(large_values, large_target)),
+        ("min_days_with_confidence", {"days": size['days'], "paths": size['paths'], "confidence": 0.9},
+         lambda: min_days_close_to_target(slot_forecast, target, confidence=0.9, paths=paths[:, :, 0])),
+        ("allocate_campaigns", {"days": size['days'], "slots": size['slots'], "campaigns": size['campaigns']},
+         lambda: allocate_campaigns(forecast[:, :size['slots']], campaigns, time_limit=5.0)),
+        ("schedule_index_build", {"days": size['days'], "series": forecast.shape[1]}, lambda: ScheduleIndex(forecast)),
+        ("schedule_index_min_days", {"days": size['days'], "series": forecast.shape[1], "queries": num_queries},
+         lambda: index.min_days(*queries)),
+    ]
+    # The old exhaustive search is exponential; keep it to a size where it still finishes as a reference point
+    if size['days'] <= 30:
+        small = slot_forecast[:16]
+        found.append(("min_days_exhaustive", {"days": 16, "target": int(small.sum() * 0.6)},
+                      lambda: min_days_exhaustive(small, int(small.sum() * 0.6))))
+    return [{"name": name, "params": params, "func": func} for name, params, func in found]
+
+
+def run(sizes: List[str], repeats: int = 5, budget: float = 10.0, seed: int = 0, only: List[str] = None) -> Dict[str, Any]:
+    results = []
+    for size_name in sizes:
+        for case in cases(SIZES[size_name], seed):
+            if only and case["name"] not in only:
+                continue
+            print(f"{size_name:>6} {case['name']:<26}", end=" ", file=sys.stderr, flush=True)
+            stats = measure(case["func"], repeats, budget)
+            print(f"{stats['seconds_median'] * 1000:10.2f} ms {stats['peak_bytes'] / 2 ** 20:8.1f} MiB", file=sys.stderr)
+            results.append({"size": size_name, "name": case["name"], "params": case["params"], **stats})
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpus": os.cpu_count(),
+            "seed": seed
+        },
+        "results": results
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], ratio: float = REGRESSION_RATIO) -> List[str]:
+    """Lines describing each case's change against baseline; regressions are prefixed with REGRESSION"""
+    previous = {(r["size"], r["name"]): r for r in baseline["results"]}
+    lines = []
+    for r in current["results"]:
+        before = previous.get((r["size"], r["name"]))
+        if before is None:
+            lines.append(f"new        {r['size']}/{r['name']}")
+            continue
+        # Best-of-runs is the least noisy timing to compare
+        time_ratio = r["seconds_min"] / max(before["seconds_min"], 1e-9)
+        slower = time_ratio > ratio and r["seconds_min"] - before["seconds_min"] > NOISE_SECONDS
+        memory_ratio = r["peak_bytes"] / max(before["peak_bytes"], 1)
+        flag = "REGRESSION" if slower or memory_ratio > ratio else "ok        "
+        lines.append(f"{flag} {r['size']}/{r['name']}: time x{time_ratio:.2f}, peak memory x{memory_ratio:.2f}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the forecasting and scheduling paths")
+    parser.add_argument("--sizes", default="small,medium", help=f"Comma-separated subset of {','.join(SIZES)}")
+    parser.add_argument("--only", default=None, help="Comma-separated case names to run")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=10.0, help="Seconds of timing runs per case at most")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default="benchmark_results.json")
+    parser.add_argument("--compare", default=None, help="Earlier results file to diff against")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_RATIO,
+                        help="Slowdown or memory growth ratio that counts as a regression")
+    args = parser.parse_args()
+
+    results = run(args.sizes.split(","), args.repeats, args.budget, args.seed,
+                  args.only.split(",") if args.only else None)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            lines = compare(results, json.load(f), args.threshold)
+        print("\n".join(lines))
+        sys.exit(1 if any(line.startswith("REGRESSION") for line in lines) else 0)
+
+
+if __name__ == "__main__":
+    main()
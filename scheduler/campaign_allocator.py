@@ -0,0 +1,291 @@
+#Joint allocation of many campaigns over the forecasted (day, slot) grid
+import json
+import os
+import sys
+import time
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+from scipy.optimize import milp, LinearConstraint, Bounds
+from scipy.sparse import csr_matrix
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import timed, timer
+
+# A re-solved campaign only considers its CANDIDATE_FACTOR * min_count + CANDIDATE_EXTRA best free cells
+CANDIDATE_FACTOR = 2
+CANDIDATE_EXTRA = 8
+
+
+def _campaign_cells(campaign: Dict[str, Any], num_days: int, num_slots: int):
+    """(day, slot) index arrays a campaign may use: its slots within its inclusive [start, end] day window"""
+    start = max(0, int(campaign.get('start', 0)))
+    end = min(num_days - 1, int(campaign.get('end', num_days - 1)))
+    slots = campaign.get('slots')
+    slots = np.arange(num_slots) if slots is None else np.asarray(sorted(set(slots)), dtype=int)
+    if end < start or len(slots) == 0:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int)
+    days = np.arange(start, end + 1)
+    return np.repeat(days, len(slots)), np.tile(slots, len(days))
+
+
+def _greedy(values: List[np.ndarray], cells: List[np.ndarray], targets: np.ndarray,
+            capacity: np.ndarray, order: np.ndarray) -> List[np.ndarray]:
+    """
+    Campaigns in the given order each take their largest still-free cells until
+    they reach their target. Returns, per campaign, the positions chosen within
+    its own cell list (empty if it could not be met).
+    """
+    remaining = capacity.copy()
+    chosen = [np.empty(0, dtype=int) for _ in targets]
+    for c in order:
+        by_value = np.argsort(-values[c], kind='stable')
+        free = by_value[remaining[cells[c][by_value]] > 0]
+        reached = np.cumsum(values[c][free]) >= targets[c]
+        if not reached.any():
+            continue
+        picked = free[:int(np.argmax(reached)) + 1]
+        remaining[cells[c][picked]] -= 1
+        chosen[c] = picked
+    return chosen
+
+
+def _min_count(values: np.ndarray, target: float) -> int:
+    """Fewest cells that can reach target using only this campaign's own values"""
+    return int(np.argmax(np.cumsum(np.sort(values)[::-1]) >= target)) + 1
+
+
+def _solve_subset(subset: np.ndarray, values: List[np.ndarray], cells: List[np.ndarray],
+                  targets: np.ndarray, min_counts: np.ndarray, free_capacity: np.ndarray,
+                  max_total: int, time_limit: float, prune: bool = True):
+    """
+    0/1 MILP for the campaigns in subset over the capacity left by everyone else
+
+    One variable per campaign and eligible cell; a coverage row and a cardinality
+    row (at least the campaign's min_count, which tightens the LP bound a lot) per
+    campaign; a capacity row per cell; at most max_total slot-days overall. The
+    objective is the number of slot-days. With prune, each campaign only gets its
+    most valuable free cells, which keeps neighbourhood solves fast but no longer
+    exact.
+
+    Returns:
+        tuple: (per-campaign positions, or None if no solution was found) and
+            whether the solver finished, i.e. proved the result optimal or
+            proved that nothing within max_total exists
+    """
+    candidates = []
+    for c in subset:
+        by_value = np.argsort(-values[c], kind='stable')
+        free = by_value[free_capacity[cells[c][by_value]] > 0]
+        candidates.append(free[:CANDIDATE_FACTOR * min_counts[c] + CANDIDATE_EXTRA] if prune else free)
+    offsets = np.cumsum([0] + [len(positions) for positions in candidates])
+    num_vars = int(offsets[-1])
+    columns = np.arange(num_vars)
+    rows = np.repeat(np.arange(len(subset)), np.diff(offsets))
+    flat_cells = np.concatenate([cells[c][positions] for c, positions in zip(subset, candidates)])
+    flat_values = np.concatenate([values[c][positions] for c, positions in zip(subset, candidates)])
+
+    used_cells, cell_rows = np.unique(flat_cells, return_inverse=True)
+    constraints = [
+        LinearConstraint(csr_matrix((flat_values, (rows, columns)), shape=(len(subset), num_vars)),
+                         lb=targets[subset], ub=np.inf),
+        LinearConstraint(csr_matrix((np.ones(num_vars), (rows, columns)), shape=(len(subset), num_vars)),
+                         lb=min_counts[subset], ub=np.inf),
+        LinearConstraint(csr_matrix((np.ones(num_vars), (cell_rows, columns)), shape=(len(used_cells), num_vars)),
+                         lb=0, ub=free_capacity[used_cells]),
+        LinearConstraint(np.ones((1, num_vars)), lb=0, ub=max_total),
+    ]
+    result = milp(np.ones(num_vars), constraints=constraints, integrality=np.ones(num_vars),
+                  bounds=Bounds(0, 1), options={'time_limit': max(time_limit, 0.05), 'disp': False})
+    finished = result.status in (0, 2)
+    if result.x is None:
+        return None, finished
+    solution = result.x > 0.5
+    picks = [positions[solution[offsets[k]:offsets[k + 1]]] for k, positions in enumerate(candidates)]
+    return picks, finished
+
+
+@timed('schedule.allocate_campaigns')
+def allocate_campaigns(forecast_matrix, campaigns: List[Dict[str, Any]], capacity=1,
+                       time_limit: float = 5.0, neighbourhood_size: int = 12) -> Dict[str, Any]:
+    """
+    Assign (campaign, slot, day) triples so every campaign reaches its target with
+    the fewest slot-days in total
+
+    Each campaign is a dict with a `target` and optionally a `name`, the `slots` it
+    may run in (default all) and an inclusive `start`/`end` day window (default
+    the whole forecast). A slot-day can be given to at most `capacity` campaigns
+    (an int, or one value per slot); when it is shared each campaign is credited
+    forecast / capacity impressions.
+
+    Every campaign needs at least as many slot-days as it would with the whole
+    grid to itself (its top cells by forecast), and the sum of those counts is a
+    lower bound on the joint optimum. A greedy pass (hardest campaigns first,
+    each taking its largest free cells) usually meets the bound, which proves it
+    optimal. Otherwise the solution is improved by large-neighbourhood search:
+    a campaign above its own minimum is re-solved together with the campaigns
+    holding its best cells as a small 0/1 MILP (HiGHS via scipy.optimize.milp),
+    with everyone else's cells fixed, until the bound is met, no neighbourhood
+    improves, or time_limit runs out. When there are no more campaigns than
+    neighbourhood_size the MILP covers all of them and is exact.
+
+    Campaigns that cannot reach their target even with every eligible cell to
+    themselves, or that lose out on capacity, are reported as unmet.
+
+    Args:
+        forecast_matrix: days x slots forecasted impressions, as from control_predictor.forecaster()
+        campaigns (list): Campaign dicts as described above
+        capacity: Campaigns allowed per slot-day (int or per-slot sequence)
+        time_limit (float): Time budget in seconds for the MILP improvement phase
+        neighbourhood_size (int): Most campaigns re-solved together in one MILP
+
+    Returns:
+        dict: status ('optimal' when proven, 'feasible', or 'partial' if some
+            campaign is unmet), total_slot_days, lower_bound, per-campaign
+            summaries (name, target, slot_days, impressions, met) and the
+            assignments as {campaign, slot, day, impressions} records
+    """
+    forecast = np.asarray(forecast_matrix, dtype=float)
+    num_days, num_slots = forecast.shape
+    capacity = np.broadcast_to(np.asarray(capacity, dtype=int), (num_slots,))
+    credited = forecast / np.maximum(capacity, 1)
+    cell_capacity = np.tile(capacity, num_days)
+    targets = np.array([float(c['target']) for c in campaigns])
+
+    cells, values = [], []
+    with timer('schedule.allocate.build'):
+        for campaign in campaigns:
+            days, slots = _campaign_cells(campaign, num_days, num_slots)
+            cell_values = credited[days, slots]
+            # Cells with nothing forecast can never help reach a target
+            useful = cell_values > 0
+            cells.append(days[useful] * num_slots + slots[useful])
+            values.append(cell_values[useful])
+    # Campaigns with no target are met without any slot-days
+    trivial = targets <= 0
+    reachable = np.array([v.sum() >= t for v, t in zip(values, targets)], dtype=bool)
+    active = np.flatnonzero(reachable & ~trivial)
+    min_counts = np.zeros(len(campaigns), dtype=int)
+    for c in active:
+        min_counts[c] = _min_count(values[c], targets[c])
+    lower_bound = int(min_counts.sum())
+
+    with timer('schedule.allocate.greedy'):
+        # Hardest campaigns first: largest target relative to what they can reach
+        difficulty = np.array([targets[c] / values[c].sum() for c in active])
+        chosen = _greedy(values, cells, targets, cell_capacity, active[np.argsort(-difficulty, kind='stable')])
+
+    def slot_days(subset) -> int:
+        return sum(len(chosen[c]) for c in subset)
+
+    def at_lower_bound() -> bool:
+        return all(len(chosen[c]) for c in active) and slot_days(active) == lower_bound
+
+    proven = at_lower_bound()
+    unmet = [c for c in active if len(chosen[c]) == 0]
+    # Greedy may have starved a campaign, or used more than the bound; let the MILP try to fix it
+    over = sorted((c for c in active if len(chosen[c]) > min_counts[c]),
+                  key=lambda c: len(chosen[c]) - min_counts[c], reverse=True)
+    queue = unmet + over
+
+    with timer('schedule.allocate.solve'):
+        deadline = time.perf_counter() + time_limit
+        tried = set()
+        while queue and not proven and time.perf_counter() < deadline:
+            focus = queue.pop(0)
+            if focus in tried or (len(chosen[focus]) and len(chosen[focus]) <= min_counts[focus]):
+                continue
+            tried.add(focus)
+
+            whole = len(active) <= neighbourhood_size
+            if whole:
+                subset = active
+            else:
+                # The focus campaign plus whoever holds its most valuable cells
+                holders = {}
+                for c in active:
+                    for cell in cells[c][chosen[c]]:
+                        holders.setdefault(int(cell), []).append(c)
+                subset = [focus]
+                for cell in cells[focus][np.argsort(-values[focus], kind='stable')]:
+                    for c in holders.get(int(cell), []):
+                        if c not in subset:
+                            subset.append(c)
+                    if len(subset) >= neighbourhood_size:
+                        break
+                subset = np.array(subset[:neighbourhood_size])
+
+            free_capacity = cell_capacity.copy()
+            inside = set(int(c) for c in subset)
+            for c in active:
+                if c not in inside:
+                    np.subtract.at(free_capacity, cells[c][chosen[c]], 1)
+            # Improvements only: meeting a starved campaign at any cost, otherwise fewer slot-days
+            starved = any(len(chosen[c]) == 0 for c in subset)
+            max_total = np.inf if starved else slot_days(subset) - 1
+            picks, finished = _solve_subset(subset, values, cells, targets, min_counts, free_capacity,
+                                            max_total, deadline - time.perf_counter(), prune=not whole)
+            # Solving the whole problem to the end settles it either way
+            proven = whole and finished
+            if picks is None:
+                continue
+            for c, positions in zip(subset, picks):
+                chosen[c] = positions
+            # The members' holdings changed, so their neighbourhoods are worth another look
+            tried.difference_update(int(c) for c in subset)
+            tried.add(focus)
+            queue.extend(int(c) for c in subset if len(chosen[c]) > min_counts[c])
+            proven = proven or at_lower_bound()
+
+    assignments = []
+    summaries = []
+    for c, campaign in enumerate(campaigns):
+        picked = chosen[c]
+        total = float(values[c][picked].sum())
+        for position in picked:
+            cell = int(cells[c][position])
+            assignments.append({
+                "campaign": campaign.get('name', c),
+                "slot": cell % num_slots,
+                "day": cell // num_slots,
+                "impressions": float(values[c][position])
+            })
+        summaries.append({
+            "name": campaign.get('name', c),
+            "target": float(targets[c]),
+            "slot_days": len(picked),
+            "impressions": total,
+            "met": bool(trivial[c] or (len(picked) and total >= targets[c]))
+        })
+    assignments.sort(key=lambda a: (a["day"], a["slot"]))
+
+    if not all(s["met"] for s in summaries):
+        status = 'partial'
+    else:
+        status = 'optimal' if proven else 'feasible'
+    return {
+        "status": status,
+        "total_slot_days": sum(s["slot_days"] for s in summaries),
+        "lower_bound": lower_bound,
+        "campaigns": summaries,
+        "assignments": assignments
+    }
+
+
+def main(campaigns_path: Optional[str] = None):
+    from control_predictor import forecaster
+
+    if campaigns_path is None:
+        print("Usage: python campaign_allocator.py <campaigns.json>")
+        sys.exit(1)
+    with open(campaigns_path) as f:
+        spec = json.load(f)
+    # Either a plain list of campaigns or {"campaigns": [...], "capacity": ...}
+    if isinstance(spec, list):
+        spec = {"campaigns": spec}
+    allocation = allocate_campaigns(forecaster(), spec["campaigns"], capacity=spec.get("capacity", 1))
+    print(json.dumps(allocation, indent=2))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
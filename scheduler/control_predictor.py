@@ -1,47 +1,214 @@
 
+import logging
+import os
+import sys
 import pandas as pd
 import numpy as np
 import pickle
 import numpy as np
-from statsmodels.tsa.ar_model import AutoReg
+
+# Shared instrumentation lives at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import timed, timer
+from impressions_cube import ImpressionsCube, DEFAULT_DATA_DIR, day_versions
+from forecast_cache import get_forecast_cache, versions_fingerprint
+
+logger = logging.getLogger(__name__)
+
+def _ar_regression(series_matrix, lags):
+    """Per-series AR design (series x rows x (lags + 1)) and targets (series x rows x 1)"""
+    num_days = series_matrix.shape[0]
+    if num_days <= lags + 1:
+        raise ValueError(f"Need more than {lags + 1} days of history to fit AR({lags}), got {num_days}.")
+    # windows[k, s] = y[k .. k + lags] for series s
+    windows = np.lib.stride_tricks.sliding_window_view(series_matrix, lags + 1, axis=0)
+    targets = windows[:, :, -1].T[:, :, None]
+    lagged = windows[:, :, -2::-1].transpose(1, 0, 2)
+    design = np.concatenate([np.ones(lagged.shape[:2] + (1,)), lagged], axis=2)
+    return design, targets
+
+def fit_ar_batch(series_matrix, lags=1):
+    """
+    Fit an AR(lags) model with a constant to every column at once
+
+    Same model and estimator as statsmodels AutoReg(trend='c'): ordinary least
+    squares of y[t] on [1, y[t-1], ..., y[t-lags]] over t = lags..n-1, solved
+    with the pseudo-inverse so constant or otherwise degenerate series still get
+    the minimum-norm solution. All columns are solved in one batched call;
+    slots from several games can be stacked as columns as long as they cover the
+    same days.
+
+    Args:
+        series_matrix: days x series array of observations
+        lags (int): AR order
+
+    Returns:
+        np.ndarray: series x (lags + 1) coefficients, [const, L1, ..., Llags] per row
+    """
+    design, targets = _ar_regression(np.asarray(series_matrix, dtype=float), lags)
+    return (np.linalg.pinv(design) @ targets)[:, :, 0]
+
+def forecast_ar_batch(series_matrix, lags=1, forecast_steps=3):
+    """
+    Fit AR(lags) to every column and roll all forecasts forward together
+
+    Args:
+        series_matrix: days x series array of observations
+        lags (int): AR order
+        forecast_steps (int): Number of days to forecast
+
+    Returns:
+        np.ndarray: forecast_steps x series float forecasts
+    """
+    series_matrix = np.asarray(series_matrix, dtype=float)
+    coefficients = fit_ar_batch(series_matrix, lags)
+    # Most recent observation first, matching the coefficient order
+    history = series_matrix[-lags:][::-1].T.copy()
+    forecasts = np.empty((forecast_steps, series_matrix.shape[1]))
+    for step in range(forecast_steps):
+        forecasts[step] = coefficients[:, 0] + np.einsum('sl,sl->s', coefficients[:, 1:], history)
+        history[:, 1:] = history[:, :-1]
+        history[:, 0] = forecasts[step]
+    return forecasts
+
+@timed('forecast.simulate_paths')
+def simulate_ar_paths(series_matrix, lags=1, forecast_steps=30, num_paths=1000, seed=0):
+    """
+    Sample future paths of every series by residual bootstrap
+
+    Each series is fitted as in fit_ar_batch. Every path draws its own
+    coefficients from the OLS sampling distribution and is then rolled forward
+    with a residual drawn with replacement from that series' own in-sample
+    residuals (rescaled for the degrees of freedom) at each step, so the spread
+    reflects how noisy the slot has been, how well its model is pinned down and
+    how both compound through the AR recursion. All paths and series advance
+    together, one array operation per step. Impressions can't be negative, so
+    paths are floored at zero. With only a week or so of history the intervals
+    still come out somewhat narrow (a nominal 90% interval covered about 75% of
+    simulated AR(1) outcomes with 8 days of history, 83% with 30).
+
+    Args:
+        series_matrix: days x series array of observations
+        lags (int): AR order
+        forecast_steps (int): Number of days to simulate
+        num_paths (int): Number of paths per series
+        seed (int): Random seed, so plans are reproducible
+
+    Returns:
+        np.ndarray: num_paths x forecast_steps x series float32 simulated impressions
+    """
+    series_matrix = np.asarray(series_matrix, dtype=float)
+    design, targets = _ar_regression(series_matrix, lags)
+    pseudo_inverse = np.linalg.pinv(design)
+    coefficients = pseudo_inverse @ targets
+    residuals = (targets - design @ coefficients)[:, :, 0]
+    num_series, num_residuals = residuals.shape
+    # In-sample residuals understate the noise; rescale by the degrees of freedom used in the fit
+    dof = max(num_residuals - (lags + 1), 1)
+    residuals *= np.sqrt(num_residuals / dof)
+
+    rng = np.random.default_rng(seed)
+    # Parameter uncertainty: each path gets its own coefficients from the OLS sampling distribution
+    sigma2 = (residuals ** 2).sum(axis=1) / num_residuals
+    covariance = sigma2[:, None, None] * (pseudo_inverse @ pseudo_inverse.transpose(0, 2, 1))
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+    root = eigenvectors * np.sqrt(np.clip(eigenvalues, 0, None))[:, None, :]
+    draws = rng.standard_normal((num_paths, num_series, lags + 1))
+    path_coefficients = (coefficients[:, :, 0] + np.einsum('sij,psj->psi', root, draws)).astype(np.float32)
+    residuals = residuals.T.astype(np.float32)
+
+    series_index = np.arange(num_series)
+    # Most recent observation first, matching the coefficient order
+    history = np.broadcast_to(series_matrix[-lags:][::-1].T.astype(np.float32), (num_paths, num_series, lags)).copy()
+    paths = np.empty((num_paths, forecast_steps, num_series), dtype=np.float32)
+    for step in range(forecast_steps):
+        shocks = residuals[rng.integers(0, num_residuals, size=(num_paths, num_series)), series_index]
+        value = path_coefficients[:, :, 0] + np.einsum('psl,psl->ps', history, path_coefficients[:, :, 1:]) + shocks
+        np.maximum(value, 0, out=value)
+        paths[:, step] = value
+        history[:, :, 1:] = history[:, :, :-1]
+        history[:, :, 0] = value
+    return paths
+
+def forecast_intervals(series_matrix, lags=1, forecast_steps=30, num_paths=1000, levels=(0.05, 0.5, 0.95), seed=0):
+    """
+    Prediction intervals from simulate_ar_paths
+
+    Returns:
+        dict: quantile level -> forecast_steps x series array, plus "paths" with the simulated paths
+    """
+    paths = simulate_ar_paths(series_matrix, lags=lags, forecast_steps=forecast_steps, num_paths=num_paths, seed=seed)
+    quantiles = np.quantile(paths, levels, axis=0)
+    intervals = {level: quantile for level, quantile in zip(levels, quantiles)}
+    intervals["paths"] = paths
+    return intervals
+
+@timed('forecast.ar_slot')
 def forecast_ar_slot(slot_series, lags=1, forecast_steps=3):
-    model = AutoReg(slot_series, lags=lags, old_names=False).fit()
-    forecast = model.predict(start=len(slot_series), end=len(slot_series) + forecast_steps - 1)
-    return [int(element) for element in forecast]
-
-def forecast_impressions(impressions_data, forecast_steps=3):
-    num_days, num_slots = impressions_data.shape
-    # Validate input shape (it must be 8 days) for now
-    if num_days != 8:
-        raise ValueError("Input data must have exactly 8 days (rows) of impressions.")
-    
-    forecasts = []
-    for slot in range(num_slots):
-        slot_series = impressions_data[:, slot]
-        slot_forecast = forecast_ar_slot(slot_series, lags=1, forecast_steps=30)
-        forecasts.append(slot_forecast)
-    
-    forecast_matrix = np.column_stack(forecasts)
+    forecast = forecast_ar_batch(np.asarray(slot_series, dtype=float)[:, None], lags=lags, forecast_steps=forecast_steps)
+    return [int(element) for element in forecast[:, 0]]
+
+@timed('forecast.impressions')
+def forecast_impressions(impressions_data, forecast_steps=3, lags=1):
+    # Any history longer than lags + 1 days can be fitted (fit_ar_batch checks it). All slots
+    # are fitted and forecast together; truncated to ints like forecast_ar_slot
+    forecast_matrix = forecast_ar_batch(impressions_data, lags=lags, forecast_steps=forecast_steps).astype(int)
     return forecast_matrix
 
-def forecaster():
+@timed('forecast.directory')
+def forecast_directory(data_dir=DEFAULT_DATA_DIR, forecast_steps=30, lags=1):
+    """
+    Forecast every slot from the day files in data_dir, through the forecast cache
+
+    Returns:
+        tuple: (forecast_steps x slots int forecast, days x slots history or None on a cache hit)
+    """
+    # Forecasts are memoized by the day files and parameters, so nothing is refitted until a new day arrives
+    cache = get_forecast_cache()
+    versions = day_versions(data_dir)
+    key = versions_fingerprint(versions, forecast_steps=forecast_steps, lags=lags) if cache is not None else None
+    if cache is not None:
+        with timer('forecast.cache_lookup'):
+            forecast_matrix = cache.get(key)
+        if forecast_matrix is not None:
+            return forecast_matrix, None
+
+    # Day files are appended to the columnar cube once; after that only new days are parsed
+    with timer('forecast.read_cube'):
+        cube = ImpressionsCube.from_directory(data_dir)
+        if cube.day_versions() != versions:
+            # A day file changed after it was stat'ed above; bring the cube level with the files as they are now
+            cube.ingest_directory(data_dir)
+            versions = day_versions(data_dir)
+    stored = cube.day_versions()
+    if stored != versions:
+        logger.warning("Cube for %s holds days without a current day file: %s", data_dir,
+                       sorted(day for day in stored if stored[day] != versions.get(day)))
+    if cube.num_days == 0:
+        raise FileNotFoundError(f"No day files found in {data_dir}")
+
+    with timer('forecast.sum_bands'):
+        impressions_data = cube.overall()
+
+    forecast_matrix = forecast_impressions(np.array(impressions_data), forecast_steps=forecast_steps, lags=lags)
+    if cache is not None:
+        # Keyed by the day versions actually fitted, so the entry can't describe data the cube didn't hold
+        cache.put(versions_fingerprint(stored, forecast_steps=forecast_steps, lags=lags), forecast_matrix)
+    return forecast_matrix, impressions_data
+
+@timed('forecast.forecaster')
+def forecaster(data_dir=DEFAULT_DATA_DIR, forecast_steps=30, lags=1):
     # For now, this is based on the static 8 days of data we have. Eventually, this will be real-time and generated each day to change control predictions in real-time
-    all_data=[]
-    for i in range(1, 9):
-        all_data.append(pd.read_csv("/Users/shauryaagrawal/Documents/GitHub/HiddenStudiosAgent/latest_data/Hg3."+str(i)+"_test.csv"))
-    #all_data.append(pd.read_csv("/Users/shauryaagrawal/Downloads/analytics_device.csv"))
-
-    for i in range(len(all_data)):
-        all_data[i]['overall_impressions']=all_data[i][["Close05","Close1", "Close2", "Med05", "Med1", "Med2", "Far05", "Far1", "Far2"]].sum(axis=1)
-    impressions_data=[]
-    for i in all_data:
-        impressions_data.append(list(i['overall_impressions']))
-
-    forecast_steps = 3
-    forecast_matrix = forecast_impressions(np.array(impressions_data), forecast_steps=forecast_steps)
-    
+    # The scheduler plans over the next 30 days by default
+    forecast_matrix, impressions_data = forecast_directory(data_dir, forecast_steps=forecast_steps, lags=lags)
+
+    if impressions_data is None:
+        print(f"Forecasted impressions for the next {forecast_steps} days (cached; rows: days, columns: game slots):")
+        print(forecast_matrix)
+        return forecast_matrix
+
     print("Historical impressions (each row = a day, each column = a game slot):")
-    print(impressions_data)
+    print(impressions_data.tolist())
     
     print(f"\nForecasted impressions for the next {forecast_steps} days (rows: days, columns: game slots):")
     print(forecast_matrix)
@@ -120,7 +287,7 @@ if __name__ == "__main__":
     future_predictions = predict_future(model, torch.Tensor(impressions_data), input_window=input_window, future_steps=future_steps)
     
     print("\nOriginal 8-day series (each row is a day, columns are slots):")
-    print(impressions_data)
+    print(impressions_data.tolist())
     print(f"\nPredicted impressions for the next {future_steps} days:")
     print(future_predictions)"""
 
@@ -0,0 +1,140 @@
+#Memoized forecasts, keyed by a fingerprint of the input day files and the model parameters
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import uuid
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from impressions_cube import day_versions
+
+logger = logging.getLogger(__name__)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_ENABLED = os.environ.get('FORECAST_CACHE', '1') != '0'
+DEFAULT_CACHE_DIR = os.environ.get('FORECAST_CACHE_DIR', os.path.join(REPO_ROOT, '.forecast_cache'))
+DEFAULT_MAX_ENTRIES = int(os.environ.get('FORECAST_CACHE_MAX_ENTRIES', '256'))
+# Bump when the forecasting model changes so old entries stop matching
+MODEL_VERSION = 'ar-ols-1'
+
+
+def versions_fingerprint(versions: Dict[str, Optional[List[int]]], **params) -> str:
+    """Key for a forecast of the days in versions (name -> impressions_cube.day_file_version) and the model parameters"""
+    digest = hashlib.sha256(MODEL_VERSION.encode())
+    for day in sorted(versions):
+        digest.update(f"{day}:{json.dumps(versions[day])};".encode())
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def fingerprint(data_dir: str, pattern: str = '*_test.csv', **params) -> str:
+    """
+    Key for a forecast: the name and version (size and modification time) of
+    every day file, as the impressions cube records them, plus the model
+    parameters. A new, removed or rewritten day file changes it, and nothing
+    is read beyond a stat per file.
+    """
+    return versions_fingerprint(day_versions(data_dir, pattern), **params)
+
+
+class ForecastCache:
+    """
+    Two-level cache of forecast matrices.
+
+    Entries are kept in a process-local dict and as .npy files named after the
+    fingerprint, so a planning session that asks for the same forecast again
+    gets it from memory and a new process gets it from disk without refitting.
+    Files are written atomically; reads bump their mtime and the oldest files
+    are evicted past max_entries, as in image_cache.ImageAnalysisCache.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + '.npy')
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Copy of the cached forecast, or None"""
+        with self._lock:
+            forecast = self._memory.get(key)
+        if forecast is None:
+            path = self._path(key)
+            try:
+                forecast = np.load(path, allow_pickle=False)
+                os.utime(path)
+            except (OSError, ValueError):
+                with self._lock:
+                    self.misses += 1
+                return None
+            with self._lock:
+                self._memory[key] = forecast
+        with self._lock:
+            self.hits += 1
+        return forecast.copy()
+
+    def put(self, key: str, forecast: np.ndarray) -> None:
+        forecast = np.array(forecast)
+        with self._lock:
+            self._memory[key] = forecast
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.save(f, forecast, allow_pickle=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Could not write forecast cache entry %s: %s", key, e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._evict()
+
+    def _evict(self) -> None:
+        entries = [e for e in os.scandir(self.cache_dir) if e.name.endswith('.npy')]
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for entry in entries[:len(entries) - int(self.max_entries * 0.9)]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        entries = sum(1 for e in os.scandir(self.cache_dir) if e.name.endswith('.npy')) if os.path.isdir(self.cache_dir) else 0
+        return {"hits": self.hits, "misses": self.misses, "in_memory": len(self._memory), "entries": entries}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+        if os.path.isdir(self.cache_dir):
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith('.npy'):
+                    os.remove(entry.path)
+        self.hits = 0
+        self.misses = 0
+
+
+_cache: Optional[ForecastCache] = None
+
+
+def get_forecast_cache() -> Optional[ForecastCache]:
+    """Process-wide cache, or None when FORECAST_CACHE=0"""
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = ForecastCache()
+    return _cache
@@ -0,0 +1,233 @@
+#Incremental AR forecaster: folds in one day file at a time and keeps its state on disk
+import glob
+import os
+import sys
+import tempfile
+import uuid
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import timed
+from impressions_cube import DISTANCE_BANDS, DEFAULT_DATA_DIR, day_file_order
+from control_predictor import fit_ar_batch, forecast_ar_batch
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_STATE_PATH = os.environ.get('FORECAST_STATE_PATH', os.path.join(REPO_ROOT, 'forecast_state.npz'))
+
+
+class OnlineARForecaster:
+    """
+    Per-slot AR(lags) forecaster that is updated one day at a time.
+
+    For each slot it keeps the least-squares sufficient statistics of its AR
+    regression of y[t] on [y[t-1], ..., y[t-lags]] in centered form (row count,
+    running means of the lags and of y, and the centered cross-products of the
+    lags with themselves and with y, updated Welford-style) plus its last
+    `lags` observations. Folding in a day is a rank-one update per slot,
+    O(slots * lags^2). Solving the centered system and recovering the constant
+    from the means avoids the raw X'X, whose condition number at impression
+    scale (~1e6) is so large that the intercept gets cut off; the fitted
+    coefficients are those a full refit on the whole history gives
+    (control_predictor.fit_ar_batch) up to floating-point rounding, except for
+    constant series, where both fit the data exactly with different
+    coefficients. check_against_batch compares the two.
+    State is saved to an .npz file together with the names of the day files
+    already folded in, so re-running the daily refresh only reads new files.
+
+    Slots are keyed by ad name and may appear later than others; a slot missing
+    from a day file just skips that day. Until a slot has lags + 1 regression
+    rows its forecast repeats its last observation.
+    """
+
+    def __init__(self, state_path: str = DEFAULT_STATE_PATH, lags: int = 1):
+        self.state_path = state_path
+        self.lags = lags
+        self.slots: List[str] = []
+        self.rows = np.zeros(0)
+        self.mean_x = np.zeros((0, lags))
+        self.mean_y = np.zeros(0)
+        self.cxx = np.zeros((0, lags, lags))
+        self.cxy = np.zeros((0, lags))
+        # Most recent observation first; observed counts how many of them are real
+        self.history = np.zeros((0, lags))
+        self.observed = np.zeros(0, dtype=int)
+        self.days: List[str] = []
+        if os.path.exists(state_path):
+            self.load()
+
+    def load(self) -> None:
+        with np.load(self.state_path, allow_pickle=False) as state:
+            if int(state['lags']) != self.lags:
+                raise ValueError(f"State in {self.state_path} is for AR({int(state['lags'])}), not AR({self.lags}).")
+            self.slots = [str(slot) for slot in state['slots']]
+            if 'xtx' in state:
+                self._from_raw_moments(state['xtx'], state['xty'])
+            else:
+                self.rows = state['rows']
+                self.mean_x = state['mean_x']
+                self.mean_y = state['mean_y']
+                self.cxx = state['cxx']
+                self.cxy = state['cxy']
+            self.history = state['history']
+            self.observed = state['observed']
+            self.days = [str(day) for day in state['days']]
+
+    def _from_raw_moments(self, xtx: np.ndarray, xty: np.ndarray) -> None:
+        """Centered statistics from the X'X and X'y kept by earlier state files"""
+        self.rows = xtx[:, 0, 0]
+        count = np.maximum(self.rows, 1)
+        self.mean_x = xtx[:, 0, 1:] / count[:, None]
+        self.mean_y = xty[:, 0] / count
+        self.cxx = xtx[:, 1:, 1:] - self.rows[:, None, None] * self.mean_x[:, :, None] * self.mean_x[:, None, :]
+        self.cxy = xty[:, 1:] - self.rows[:, None] * self.mean_x * self.mean_y[:, None]
+
+    def save(self) -> None:
+        directory = os.path.dirname(os.path.abspath(self.state_path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = os.path.join(directory, f".{uuid.uuid4().hex}.npz")
+        np.savez(tmp_path, lags=self.lags, slots=np.array(self.slots, dtype=str), rows=self.rows,
+                 mean_x=self.mean_x, mean_y=self.mean_y, cxx=self.cxx, cxy=self.cxy, history=self.history,
+                 observed=self.observed, days=np.array(self.days, dtype=str))
+        os.replace(tmp_path, self.state_path)
+
+    def _slot_indices(self, slots: List[str]) -> np.ndarray:
+        known = {slot: i for i, slot in enumerate(self.slots)}
+        new = [slot for slot in dict.fromkeys(slots) if slot not in known]
+        if new:
+            known.update((slot, len(self.slots) + k) for k, slot in enumerate(new))
+            self.slots.extend(new)
+            grow = len(new)
+            self.rows = np.concatenate([self.rows, np.zeros(grow)])
+            self.mean_x = np.concatenate([self.mean_x, np.zeros((grow, self.lags))])
+            self.mean_y = np.concatenate([self.mean_y, np.zeros(grow)])
+            self.cxx = np.concatenate([self.cxx, np.zeros((grow, self.lags, self.lags))])
+            self.cxy = np.concatenate([self.cxy, np.zeros((grow, self.lags))])
+            self.history = np.concatenate([self.history, np.zeros((grow, self.lags))])
+            self.observed = np.concatenate([self.observed, np.zeros(grow, dtype=int)])
+        return np.array([known[slot] for slot in slots], dtype=int)
+
+    @timed('forecast.online_update')
+    def update(self, impressions: Dict[str, float], day: Optional[str] = None) -> None:
+        """
+        Fold in one day of impressions
+
+        Args:
+            impressions (dict): Slot name -> that day's total impressions
+            day (str): Identifier of the day; a day that was already folded in is skipped
+        """
+        if day is not None and day in self.days:
+            return
+        index = self._slot_indices(list(impressions))
+        y = np.array(list(impressions.values()), dtype=float)
+
+        # Slots with a full window of previous days contribute a regression row
+        ready = self.observed[index] >= self.lags
+        rows, targets = index[ready], y[ready]
+        lagged = self.history[rows]
+        self.rows[rows] += 1
+        delta_x = lagged - self.mean_x[rows]
+        delta_y = targets - self.mean_y[rows]
+        self.mean_x[rows] += delta_x / self.rows[rows, None]
+        self.mean_y[rows] += delta_y / self.rows[rows]
+        # Welford: deviation from the old mean times deviation from the new one
+        self.cxx[rows] += delta_x[:, :, None] * (lagged - self.mean_x[rows])[:, None, :]
+        self.cxy[rows] += delta_x * (targets - self.mean_y[rows])[:, None]
+
+        self.history[index, 1:] = self.history[index, :-1]
+        self.history[index, 0] = y
+        self.observed[index] += 1
+        if day is not None:
+            self.days.append(day)
+
+    def ingest_csv(self, path: str) -> bool:
+        """Fold in one day file (summed over the distance bands); False if it was already seen"""
+        day = os.path.basename(path)
+        if day in self.days:
+            return False
+        data = pd.read_csv(path, index_col=0)
+        self.update(data[DISTANCE_BANDS].sum(axis=1).to_dict(), day)
+        return True
+
+    def ingest_directory(self, data_dir: str = DEFAULT_DATA_DIR, pattern: str = '*_test.csv') -> int:
+        """Fold in every day file in data_dir not seen yet, oldest first, and save. Returns how many were new"""
+        paths = sorted(glob.glob(os.path.join(data_dir, pattern)), key=day_file_order)
+        added = sum(self.ingest_csv(path) for path in paths)
+        if added:
+            self.save()
+        return added
+
+    def coefficients(self) -> np.ndarray:
+        """slots x (lags + 1) AR coefficients [const, L1, ..., Llags]"""
+        # Lag coefficients from the centered system; the constant makes the fit pass through the means
+        slopes = (np.linalg.pinv(self.cxx) @ self.cxy[:, :, None])[:, :, 0]
+        constant = self.mean_y - np.einsum('sl,sl->s', self.mean_x, slopes)
+        return np.concatenate([constant[:, None], slopes], axis=1)
+
+    @timed('forecast.online_forecast')
+    def forecast(self, forecast_steps: int = 30) -> pd.DataFrame:
+        """
+        Forecast every slot from its current state
+
+        Returns:
+            pd.DataFrame: forecast_steps x slots, truncated to ints like forecast_impressions
+        """
+        coefficients = self.coefficients()
+        fitted = self.observed - self.lags >= self.lags + 1
+        # Slots without enough history yet carry their last observation forward
+        coefficients[~fitted] = 0.0
+        coefficients[~fitted, 1] = 1.0
+        history = self.history.copy()
+        forecasts = np.empty((forecast_steps, len(self.slots)))
+        for step in range(forecast_steps):
+            forecasts[step] = coefficients[:, 0] + np.einsum('sl,sl->s', coefficients[:, 1:], history)
+            history[:, 1:] = history[:, :-1]
+            history[:, 0] = forecasts[step]
+        return pd.DataFrame(forecasts.astype(int), columns=self.slots)
+
+
+def check_against_batch(series_matrix, lags: int = 1, forecast_steps: int = 30) -> float:
+    """
+    Fold a days x series matrix into a fresh forecaster day by day and compare
+    it with fit_ar_batch and forecast_ar_batch on the same history
+
+    Returns:
+        float: Largest coefficient difference, relative to the largest batch coefficient
+    Raises:
+        ValueError: If the coefficients or forecasts differ by more than rounding
+    """
+    series_matrix = np.asarray(series_matrix, dtype=float)
+    with tempfile.TemporaryDirectory() as state_dir:
+        online = OnlineARForecaster(os.path.join(state_dir, 'state.npz'), lags=lags)
+        names = [f"s{i}" for i in range(series_matrix.shape[1])]
+        for day, values in enumerate(series_matrix):
+            online.update(dict(zip(names, values)), f"d{day}")
+    batch = fit_ar_batch(series_matrix, lags)
+    difference = float(np.abs(online.coefficients() - batch).max() / max(np.abs(batch).max(), 1.0))
+    if difference > 1e-8:
+        raise ValueError(f"Online AR({lags}) coefficients differ from fit_ar_batch by {difference:.3g} (relative)")
+    expected = forecast_ar_batch(series_matrix, lags, forecast_steps).astype(int)
+    # Truncation to ints can differ by one where the float forecasts agree to rounding
+    off = int(np.abs(online.forecast(forecast_steps).to_numpy() - expected).max())
+    if off > 1:
+        raise ValueError(f"Online AR({lags}) forecast differs from forecast_ar_batch by up to {off} impressions")
+    return difference
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ['--check']:
+        from benchmark import synthetic_impressions
+        # Impression scales from a small slot to a large one, with short and long histories
+        for level in (1e3, 1e5, 1e6, 1e7):
+            for days in (60, 365):
+                for lags in (1, 2, 3):
+                    difference = check_against_batch(synthetic_impressions(days, 8, level=level, seed=days), lags)
+                    print(f"level {level:g}, {days} days, AR({lags}): max relative coefficient difference {difference:.2g}")
+        sys.exit(0)
+    data_dir = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_DATA_DIR
+    online = OnlineARForecaster()
+    added = online.ingest_directory(data_dir)
+    print(f"Folded in {added} new day file(s); {len(online.days)} days of history")
+    print(online.forecast())
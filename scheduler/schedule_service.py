@@ -0,0 +1,228 @@
+#Low-latency schedule queries over an in-memory forecast: min days, feasibility and best-k-days per (slot, day range)
+import json
+import os
+import sys
+import traceback
+from typing import Dict, Any
+
+import numpy as np
+
+from control_predictor import forecast_directory
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import timed, increment
+from impressions_cube import DEFAULT_DATA_DIR
+
+
+class ScheduleIndex:
+    """
+    Range index over a days x slots forecast for answering schedule questions.
+
+    All slots are laid end to end (slot-major) and indexed by one wavelet
+    matrix over the forecast values, with per-level prefix sums of the values.
+    Descending it from the most significant value bit answers "fewest days in
+    [start, end] of a slot whose impressions reach N" (take every day in the
+    higher half while that is not enough, otherwise look only at the higher
+    half) and "most impressions from k days in the range" in O(log n) per
+    query, independent of the range length. Plain prefix sums answer
+    feasibility in O(1). The batch methods run the descent for many queries at
+    once as numpy array operations.
+
+    Negative forecasts (AR extrapolation can produce them) are treated as zero
+    impressions.
+    """
+
+    def __init__(self, forecast_matrix):
+        forecast = np.maximum(np.asarray(forecast_matrix, dtype=np.int64), 0)
+        self.forecast = forecast
+        self.num_days, self.num_slots = forecast.shape
+        flat = forecast.T.ravel()
+        self.prefix = np.concatenate([[0], np.cumsum(flat)])
+
+        # Values compressed to codes 0..distinct-1, one wavelet level per code bit
+        self.values, codes = np.unique(flat, return_inverse=True)
+        self.levels = max(1, int(len(self.values) - 1).bit_length())
+        self.rank1 = np.empty((self.levels, len(flat) + 1), dtype=np.int64)
+        self.sum1 = np.empty((self.levels, len(flat) + 1), dtype=np.int64)
+        self.zeros = np.empty(self.levels, dtype=np.int64)
+        order_codes, order_values = codes, flat
+        for level in range(self.levels):
+            bits = (order_codes >> (self.levels - 1 - level)) & 1
+            self.rank1[level] = np.concatenate([[0], np.cumsum(bits)])
+            self.sum1[level] = np.concatenate([[0], np.cumsum(order_values * bits)])
+            self.zeros[level] = len(flat) - self.rank1[level][-1]
+            # Stable partition: elements with a 0 bit first, as the next level sees them
+            reorder = np.argsort(bits, kind='stable')
+            order_codes, order_values = order_codes[reorder], order_values[reorder]
+
+    def _bounds(self, slots, starts, ends):
+        slots, starts, ends = (np.atleast_1d(np.asarray(a, dtype=np.int64)) for a in (slots, starts, ends))
+        if np.any((slots < 0) | (slots >= self.num_slots)):
+            raise ValueError(f"Slot out of range (0..{self.num_slots - 1})")
+        starts = np.clip(starts, 0, self.num_days)
+        ends = np.clip(ends + 1, 0, self.num_days)
+        ends = np.maximum(ends, starts)
+        return slots * self.num_days + starts, slots * self.num_days + ends
+
+    def range_total(self, slots, starts, ends) -> np.ndarray:
+        """Impressions over every day in each inclusive [start, end] range"""
+        lo, hi = self._bounds(slots, starts, ends)
+        return self.prefix[hi] - self.prefix[lo]
+
+    def feasible(self, slots, starts, ends, targets) -> np.ndarray:
+        """Whether each target can be reached at all within its range"""
+        return self.range_total(slots, starts, ends) >= np.asarray(targets)
+
+    @timed('schedule.query.min_days')
+    def min_days(self, slots, starts, ends, targets) -> np.ndarray:
+        """
+        Fewest days in each inclusive [start, end] range of a slot whose impressions reach the target
+
+        Returns:
+            np.ndarray: Day counts, -1 where the target can't be reached
+        """
+        if np.ndim(slots) == 0 and np.ndim(starts) == 0 and np.ndim(ends) == 0 and np.ndim(targets) == 0:
+            return np.array([self._min_days_one(slots, starts, ends, targets)])
+        lo, hi = self._bounds(slots, starts, ends)
+        remaining = np.atleast_1d(np.asarray(targets, dtype=np.float64)).copy()
+        reachable = (self.prefix[hi] - self.prefix[lo]) >= remaining
+        count = np.zeros(len(lo), dtype=np.int64)
+        code = np.zeros(len(lo), dtype=np.int64)
+        for level in range(self.levels):
+            ones_lo, ones_hi = self.rank1[level][lo], self.rank1[level][hi]
+            ones_sum = self.sum1[level][hi] - self.sum1[level][lo]
+            # Only look inside the larger values if they alone are enough; otherwise take them all
+            high = ones_sum >= remaining
+            count += np.where(high, 0, ones_hi - ones_lo)
+            remaining -= np.where(high, 0, ones_sum)
+            code = code * 2 + high
+            lo = np.where(high, self.zeros[level] + ones_lo, lo - ones_lo)
+            hi = np.where(high, self.zeros[level] + ones_hi, hi - ones_hi)
+        # What is left is a run of equal values; take just enough of them
+        leaf = self.values[np.minimum(code, len(self.values) - 1)].astype(np.float64)
+        short = reachable & (remaining > 0)
+        count[short] += np.ceil(remaining[short] / leaf[short]).astype(np.int64)
+        count[~reachable] = -1
+        return count
+
+    def _min_days_one(self, slot, start, end, target) -> int:
+        """Scalar min_days; a single query is dominated by per-call numpy overhead otherwise"""
+        slot = int(slot)
+        if not 0 <= slot < self.num_slots:
+            raise ValueError(f"Slot out of range (0..{self.num_slots - 1})")
+        start = min(max(int(start), 0), self.num_days)
+        end = max(min(max(int(end) + 1, 0), self.num_days), start)
+        lo, hi = slot * self.num_days + start, slot * self.num_days + end
+        if self.prefix[hi] - self.prefix[lo] < target:
+            return -1
+        count, code, remaining = 0, 0, float(target)
+        for level in range(self.levels):
+            rank1, sum1 = self.rank1[level], self.sum1[level]
+            ones_lo, ones_hi = int(rank1[lo]), int(rank1[hi])
+            ones_sum = int(sum1[hi] - sum1[lo])
+            if ones_sum >= remaining:
+                code = code * 2 + 1
+                lo, hi = int(self.zeros[level]) + ones_lo, int(self.zeros[level]) + ones_hi
+            else:
+                count += ones_hi - ones_lo
+                remaining -= ones_sum
+                code *= 2
+                lo, hi = lo - ones_lo, hi - ones_hi
+        if remaining > 0:
+            count += int(np.ceil(remaining / float(self.values[min(code, len(self.values) - 1)])))
+        return count
+
+    @timed('schedule.query.max_impressions')
+    def max_impressions(self, slots, starts, ends, num_days) -> np.ndarray:
+        """Most impressions obtainable from num_days days of each inclusive [start, end] range of a slot"""
+        lo, hi = self._bounds(slots, starts, ends)
+        remaining = np.minimum(np.atleast_1d(np.asarray(num_days, dtype=np.int64)), hi - lo).copy()
+        remaining = np.maximum(remaining, 0)
+        total = np.zeros(len(lo), dtype=np.int64)
+        code = np.zeros(len(lo), dtype=np.int64)
+        for level in range(self.levels):
+            ones_lo, ones_hi = self.rank1[level][lo], self.rank1[level][hi]
+            ones = ones_hi - ones_lo
+            high = ones >= remaining
+            total += np.where(high, 0, self.sum1[level][hi] - self.sum1[level][lo])
+            remaining -= np.where(high, 0, ones)
+            code = code * 2 + high
+            lo = np.where(high, self.zeros[level] + ones_lo, lo - ones_lo)
+            hi = np.where(high, self.zeros[level] + ones_hi, hi - ones_hi)
+        return total + remaining * self.values[np.minimum(code, len(self.values) - 1)]
+
+    def select_days(self, slot: int, start: int, end: int, target: float) -> Dict[str, Any]:
+        """
+        The days behind a min_days answer: the highest-forecast days of the range
+        (earliest first among equal forecasts). O(range length log range length).
+        """
+        needed = int(self.min_days(slot, start, end, target)[0])
+        if needed < 0:
+            return {"num_days": None, "days": None, "total": None}
+        start = max(0, start)
+        window = self.forecast[start:end + 1, slot]
+        days = np.sort(np.argsort(-window, kind='stable')[:needed]) + start
+        return {"num_days": needed, "days": days.tolist(), "total": int(self.forecast[days, slot].sum())}
+
+
+def answer(index: ScheduleIndex, query: Dict[str, Any]) -> Any:
+    """
+    Answer one query dict. op is one of min_days, feasible, max_impressions
+    (with num_days) or select_days; slot/start/end/target (or num_days) are
+    scalars, or equal-length lists for a batch.
+    """
+    op = query.get("op", "min_days")
+    slot, start, end = query["slot"], query.get("start", 0), query.get("end", index.num_days - 1)
+    batch = isinstance(slot, list)
+    if op == "select_days":
+        return index.select_days(int(slot), int(start), int(end), query["target"])
+    if op == "min_days":
+        result = [None if n < 0 else int(n) for n in index.min_days(slot, start, end, query["target"])]
+    elif op == "feasible":
+        result = [bool(f) for f in index.feasible(slot, start, end, query["target"])]
+    elif op == "max_impressions":
+        result = [int(t) for t in index.max_impressions(slot, start, end, query["num_days"])]
+    else:
+        raise ValueError(f"Unknown op: {op}")
+    return result if batch else result[0]
+
+
+def run_service(data_dir: str = DEFAULT_DATA_DIR, forecast_steps: int = 30, lags: int = 1,
+                input_stream=sys.stdin, output_stream=sys.stdout):
+    """
+    Long-running query service over newline-delimited JSON, like process_image.py --worker
+
+    The forecast is loaded (through the forecast cache) and indexed once. Each
+    input line is a query for answer() plus an "id", answered with
+    {"id": ..., "result": ...} or {"id": ..., "error": ...}. {"op": "reload"}
+    re-reads the forecast, picking up new day files.
+    """
+    def load() -> ScheduleIndex:
+        forecast, _ = forecast_directory(data_dir, forecast_steps=forecast_steps, lags=lags)
+        return ScheduleIndex(forecast)
+
+    index = load()
+    for line in input_stream:
+        line = line.strip()
+        if not line:
+            continue
+        query_id = None
+        try:
+            query = json.loads(line)
+            query_id = query.get("id")
+            if query.get("op") == "reload":
+                index = load()
+                response = {"id": query_id, "result": {"days": index.num_days, "slots": index.num_slots}}
+            else:
+                response = {"id": query_id, "result": answer(index, query)}
+            increment('schedule.query.ok')
+        except Exception as e:
+            traceback.print_exc()
+            increment('schedule.query.error')
+            response = {"id": query_id, "error": f"{type(e).__name__}: {str(e)}"}
+        output_stream.write(json.dumps(response) + "\n")
+        output_stream.flush()
+
+
+if __name__ == "__main__":
+    run_service(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_DATA_DIR)
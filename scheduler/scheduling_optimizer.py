@@ -1,9 +1,14 @@
+import bisect
+import math
+
 import numpy as np
 import pandas as pd
 from control_predictor import forecaster
+from instrumentation import timed, profile_run
 from itertools import combinations
 
-def min_days_close_to_target(impressions, target):
+def min_days_exhaustive(impressions, target):
+    """Reference search over every combination of days; exponential, only for tiny inputs"""
     n = len(impressions)
     for r in range(1, n + 1):
         valid_combinations = []
@@ -16,27 +21,291 @@ def min_days_close_to_target(impressions, target):
             return r, sorted(best_combo), best_sum
     return None, None, None
 
-if __name__ == "__main__":
+# Suffix states of min_days_close_to_target are kept up to this many bytes of bitsets, then checkpointed
+SUFFIX_CACHE_BYTES = 256 * 2 ** 20
+# Widest reduction bitset min_days_close_to_target builds; a larger slack is measured in coarser units
+MAX_SLACK_UNITS = 2 ** 18
+
+def _swap_step(state, kind, weight, masks, previous_masks):
+    """
+    One 0/1 knapsack step over {net swap count: bitset of reductions}
+
+    masks maps each net count worth keeping to the bitset of reductions still
+    worth keeping for it; other counts and reductions are dropped. state was
+    built under previous_masks, so a count whose mask is unchanged needs no
+    masking before it is carried over.
+    """
+    new_state = {}
+    for count, bits in state.items():
+        mask = masks.get(count)
+        if mask is None:
+            continue
+        if mask is not previous_masks.get(count):
+            bits &= mask
+        if bits:
+            new_state[count] = bits
+    for count, bits in state.items():
+        mask = masks.get(count + kind)
+        if mask is None:
+            continue
+        shifted = bits << weight
+        if shifted.bit_length() > mask.bit_length():
+            shifted &= mask
+        if shifted:
+            new_state[count + kind] = new_state.get(count + kind, 0) | shifted
+    return new_state
+
+def min_days_with_confidence(impressions, target, confidence, paths):
+    """
+    Fewest days that reach target in at least `confidence` of the simulated futures
+
+    Days are taken in order of their point forecast until the share of paths
+    whose total over the chosen days reaches the target is at least confidence.
+    The last day is then swapped for the lowest-forecast day that still keeps
+    that share, so, as in the point version, the plan overshoots as little as
+    possible. Every candidate is scored against all paths in one array operation.
+
+    Args:
+        impressions: Point forecast per day
+        target: Impressions to reach, a scalar or one value per path
+        confidence (float): Required probability of reaching the target, e.g. 0.9
+        paths: num_paths x days simulated impressions for the same days, e.g.
+            one slot of control_predictor.simulate_ar_paths
+
+    Returns:
+        tuple: (num_days, sorted day indices, point-forecast total) or (None, None, None)
+    """
+    impressions = np.asarray(impressions, dtype=float)
+    paths = np.asarray(paths, dtype=float)
+    target = np.broadcast_to(np.asarray(target, dtype=float), (paths.shape[0],))
+    if np.mean(target <= 0) >= confidence:
+        return 0, [], 0
+    order = np.argsort(-impressions, kind='stable')
+    reached = np.mean(np.cumsum(paths[:, order], axis=1) >= target[:, None], axis=0) >= confidence
+    if not reached.any():
+        return None, None, None
+    r = int(np.argmax(reached)) + 1
+
+    # Swap the marginal day for the smallest one that keeps the required probability
+    base = paths[:, order[:r - 1]].sum(axis=1)
+    candidates = order[r - 1:]
+    keeps = np.mean(base[:, None] + paths[:, candidates] >= target[:, None], axis=0) >= confidence
+    eligible = candidates[keeps]
+    last = eligible[np.lexsort((eligible, impressions[eligible]))[0]]
+    days = sorted(int(i) for i in np.append(order[:r - 1], last))
+    return r, days, float(sum(impressions[i] for i in days))
+
+@timed('schedule.min_days_close_to_target')
+def min_days_close_to_target(impressions, target, confidence=None, paths=None):
+    """
+    Fewest days whose impressions reach target, and among those the smallest total
+
+    With a confidence level and simulated paths (num_paths x days) the target
+    must be reached with that probability instead; see min_days_with_confidence.
+
+    Returns the same (num_days, sorted day indices, total) as min_days_exhaustive,
+    including which days win a tie, in pseudo-polynomial time:
+
+    1. Sorting days by impressions gives the minimum day count r directly: it is
+       the first r whose top-r prefix sum reaches the target.
+    2. Every other r-day set is the top-r set with some days swapped out and the
+       same number swapped in. Each swapped-out day is at least the r-th largest
+       value a_r and each swapped-in day at most a_r, so every swap lowers the
+       total by a non-negative amount, and the total reduction can be at most the
+       slack D = top-r sum - target (which is below a_r). A knapsack over
+       (net swap count, reduction in [0, D]) held as integer bitsets finds the
+       largest feasible reduction, i.e. the smallest total that still reaches
+       the target. Days further than D from a_r can never be swapped.
+    3. The days are rebuilt in index order, keeping each earlier day whenever a
+       completion still exists, which reproduces the lexicographically first
+       combination that the exhaustive search returns. Suffix states are kept
+       from step 2 up to SUFFIX_CACHE_BYTES; past that they are checkpointed
+       every sqrt(n) days and recomputed a block at a time.
+
+    A suffix state only keeps the net swap counts that the days before it can
+    still bring back to zero (never more than r either way), and for each only
+    the reductions that leave room for the cheapest such swaps within D. Cost is
+    O(c * k * D / 64) word operations for c swappable days and k <= 2r + 1
+    swap counts.
+
+    Reductions are counted in units of the weights' gcd, which is exact. If D
+    is still more than MAX_SLACK_UNITS units, the unit grows to
+    ceil(D / MAX_SLACK_UNITS) and weights are rounded up to it, which bounds the
+    bitsets: 365 days of up to 10M impressions take at most about 0.6 s. The
+    day count stays exact and the days still reach the target, but the total
+    may then exceed the smallest one by up to one unit per swapped day.
+
+    Impressions are rounded to whole impressions first, since forecasts are
+    floats; the total returned is the sum of the unrounded values.
+
+    Raises:
+        ValueError: If any impression value is NaN or infinite
+    """
+    if confidence is not None:
+        if paths is None:
+            raise ValueError("A confidence level needs simulated paths (control_predictor.simulate_ar_paths).")
+        return min_days_with_confidence(impressions, target, confidence, paths)
+    n = len(impressions)
+    values = [float(impressions[i]) for i in range(n)]
+    if not all(math.isfinite(v) for v in values):
+        raise ValueError("Impressions must be finite numbers")
+    int_values = [int(round(v)) for v in values]
+    # Integer totals reach target exactly when they reach its ceiling
+    int_target = int(np.ceil(target))
+
+    # 1. Minimum number of days from the sorted prefix sums
+    order = sorted(range(n), key=lambda i: (-int_values[i], i))
+    prefix = 0
+    r = None
+    for k, i in enumerate(order, start=1):
+        prefix += int_values[i]
+        if prefix >= int_target:
+            r = k
+            break
+    if r is None:
+        return None, None, None
+
+    # 2. Swappable days and their reduction weights
+    top = set(order[:r])
+    pivot = int_values[order[r - 1]]
+    slack = prefix - int_target
+    candidates = []
+    for i in range(n):
+        if i in top:
+            weight = int_values[i] - pivot  # dropping a top day
+            if weight <= slack:
+                candidates.append((i, 1, weight))
+        else:
+            weight = pivot - int_values[i]  # adding a day outside the top set
+            if weight <= slack:
+                candidates.append((i, -1, weight))
+
+    # Every reduction is a multiple of the weights' gcd; past MAX_SLACK_UNITS the unit is
+    # coarsened instead, rounding weights up so a reduction that fits still reaches the target
+    unit = math.gcd(*(weight for _, _, weight in candidates)) or 1
+    if slack // unit > MAX_SLACK_UNITS:
+        unit = -(-slack // MAX_SLACK_UNITS)
+    candidates = [(i, kind, -(-weight // unit)) for i, kind, weight in candidates]
+    slack //= unit
+
+    # A suffix with net count c needs the days before it to swap the other way: c adds (c > 0)
+    # or -c drops (c < 0), costing at least the c smallest such weights. masks[t][c] keeps
+    # the reductions that still fit in the slack after that, and only counts where any do
+    num_candidates = len(candidates)
+    mask_cache = {}
+    masks = []
+    smallest = {1: [], -1: []}
+    for t in range(num_candidates + 1):
+        room = {0: slack}
+        for kind, sign in ((-1, 1), (1, -1)):
+            spent = 0
+            for k, weight in enumerate(smallest[kind][:r], start=1):
+                spent += weight
+                if spent > slack:
+                    break
+                room[sign * k] = slack - spent
+        for left in room.values():
+            if left not in mask_cache:
+                mask_cache[left] = (1 << (left + 1)) - 1
+        masks.append({count: mask_cache[left] for count, left in room.items()})
+        if t < num_candidates:
+            _, kind, weight = candidates[t]
+            bisect.insort(smallest[kind], weight)
+
+    # Suffix states: suffix[t] covers candidates[t:]; every one is kept while they fit in
+    # SUFFIX_CACHE_BYTES, after that only every `block` candidates
+    block = max(1, int(np.sqrt(num_candidates)))
+    checkpoints = {num_candidates: {0: 1}}
+    state = checkpoints[num_candidates]
+    cached_bytes = 0
+    for t in range(num_candidates - 1, -1, -1):
+        _, kind, weight = candidates[t]
+        state = _swap_step(state, kind, weight, masks[t], masks[t + 1])
+        if cached_bytes <= SUFFIX_CACHE_BYTES:
+            cached_bytes += sum(bits.bit_length() for bits in state.values()) // 8
+        if t % block == 0 or cached_bytes <= SUFFIX_CACHE_BYTES:
+            checkpoints[t] = state
+    best_reduction = state[0].bit_length() - 1
+
+    # 3. Rebuild the days in index order, preferring to keep each earlier day
+    swappable = {i for i, _, _ in candidates}
+    chosen = [i for i in top if i not in swappable]
+    net_count, reduction = 0, 0
+    for start in range(0, num_candidates, block):
+        end = min(start + block, num_candidates)
+        suffix = {end: checkpoints[end]}
+        for t in range(end - 1, start, -1):
+            _, kind, weight = candidates[t]
+            suffix[t] = checkpoints.get(t) or _swap_step(suffix[t + 1], kind, weight, masks[t], masks[t + 1])
+        for t in range(start, end):
+            i, kind, weight = candidates[t]
+            # Keeping day i means not dropping a top day, or adding an outside day
+            keep = (net_count, reduction) if kind == 1 else (net_count + kind, reduction + weight)
+            skip = (net_count + kind, reduction + weight) if kind == 1 else (net_count, reduction)
+            remaining = suffix[t + 1]
+            need = best_reduction - keep[1]
+            if need >= 0 and (remaining.get(-keep[0], 0) >> need) & 1:
+                net_count, reduction = keep
+                chosen.append(i)
+            else:
+                net_count, reduction = skip
+
+    best_combo = sorted(chosen)
+    return r, best_combo, sum(impressions[i] for i in best_combo)
+
+def plan_slot(forecast_matrix, slot, start_date, end_date, target, confidence=None, paths=None):
+    """
+    Fewest days to reach target in one slot, always running on start_date and end_date
+
+    Args:
+        forecast_matrix: days x slots forecasted impressions
+        slot (int): Slot (column) to schedule
+        start_date (int): First day, always booked
+        end_date (int): Last day, always booked
+        target (float): Impressions to reach
+        confidence (float, optional): Reach the target with this probability instead
+        paths (optional): num_paths x days x slots simulated impressions, needed with confidence
+
+    Returns:
+        dict: num_days (None if unreachable), days (0-indexed, sorted) and total impressions
+    """
+    impressions = np.asarray(forecast_matrix)[:, slot]
+    booked = impressions[start_date] + impressions[end_date]
+    if confidence is not None:
+        slot_paths = np.asarray(paths)[:, :, slot]
+        # The booked days' share of the target differs from path to path
+        modified_target = target - (slot_paths[:, start_date] + slot_paths[:, end_date])
+        num_days, days_indices, total = min_days_close_to_target(
+            impressions[start_date + 1:end_date], modified_target,
+            confidence=confidence, paths=slot_paths[:, start_date + 1:end_date])
+    else:
+        modified_target = target - booked
+        if modified_target < 0:
+            return {"num_days": 2, "days": [start_date, end_date], "total": float(booked)}
+        num_days, days_indices, total = min_days_close_to_target(impressions[start_date + 1:end_date], modified_target)
+    if num_days is None:
+        return {"num_days": None, "days": None, "total": None}
+    # Indices from the search are relative to the day after start_date
+    days = sorted([start_date + 1 + i for i in days_indices] + [start_date, end_date])
+    return {"num_days": num_days + 2, "days": days, "total": float(total + booked)}
+
+def main():
     impressions = pd.DataFrame(forecaster())
     start_date=0
     end_date=20 
     ad_type=0
-    modified_impressions=np.array(impressions.iloc[start_date+1:end_date, ad_type])
     original_target = 2500000
-    modified_target = original_target - (impressions.iloc[start_date][0]+impressions.iloc[end_date][0])
-    print(modified_target)
-    num_days, days_indices, total = min_days_close_to_target(modified_impressions, modified_target)
-    if modified_target<0:
-        num_days=0
-        days_indices=[]
-        total=0
+    print(original_target - (impressions.iloc[start_date][ad_type]+impressions.iloc[end_date][ad_type]))
+    plan = plan_slot(impressions, ad_type, start_date, end_date, original_target)
     print("Forecasted impressions for the slot over days:")
     print(impressions)
-    if num_days is not None:
-        print(f"\nMinimum number of days needed: {num_days+2}")
-        all_indices=days_indices+[start_date, end_date]
-        all_indices.sort()
-        print(f"Days selected (0-indexed): {all_indices}")
-        print(f"Total impressions from selected days: {total+impressions.iloc[start_date][0]+impressions.iloc[end_date][0]:.2f}")
+    if plan["num_days"] is not None:
+        print(f"\nMinimum number of days needed: {plan['num_days']}")
+        print(f"Days selected (0-indexed): {plan['days']}")
+        print(f"Total impressions from selected days: {plan['total']:.2f}")
     else:
-        print(f"\nIt is not possible to reach {original_target} impressions with the given forecast days.")
\ No newline at end of file
+        print(f"\nIt is not possible to reach {original_target} impressions with the given forecast days.")
+
+if __name__ == "__main__":
+    with profile_run("scheduling_optimizer"):
+        main()
@@ -0,0 +1,202 @@
+#Metadata-only analysis of "3d" creatives (.svg/.cad): dimensions and a color contrast estimate without rendering
+import re
+import xml.etree.ElementTree as ET
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+# Bounded cost: stop after this many SVG elements / this many bytes of a CAD file
+SVG_MAX_ELEMENTS = 100000
+CAD_HEADER_BYTES = 64 * 1024
+
+# Size used when an SVG has no usable width/height/viewBox (the CSS default for replaced elements)
+SVG_DEFAULT_SIZE = (300, 150)
+# CAD extents are in drawing units, not pixels; the longer side is mapped to this many pixels
+CAD_NOMINAL_SIDE = 1024
+
+NAMED_COLORS = {
+    'black': (0, 0, 0), 'white': (255, 255, 255), 'red': (255, 0, 0), 'lime': (0, 255, 0),
+    'green': (0, 128, 0), 'blue': (0, 0, 255), 'yellow': (255, 255, 0), 'cyan': (0, 255, 255),
+    'aqua': (0, 255, 255), 'magenta': (255, 0, 255), 'fuchsia': (255, 0, 255), 'gray': (128, 128, 128),
+    'grey': (128, 128, 128), 'silver': (192, 192, 192), 'maroon': (128, 0, 0), 'olive': (128, 128, 0),
+    'purple': (128, 0, 128), 'teal': (0, 128, 128), 'navy': (0, 0, 128), 'orange': (255, 165, 0),
+}
+
+# AutoCAD color index (group code 62) for the standard colors
+ACI_COLORS = {
+    1: (255, 0, 0), 2: (255, 255, 0), 3: (0, 255, 0), 4: (0, 255, 255), 5: (0, 0, 255),
+    6: (255, 0, 255), 7: (255, 255, 255), 8: (128, 128, 128), 9: (192, 192, 192),
+}
+
+COLOR_ATTRIBUTES = ('fill', 'stroke', 'stop-color', 'color')
+_LENGTH = re.compile(r'^\s*([0-9.eE+-]+)\s*(px|pt|pc|mm|cm|in)?\s*$')
+_UNIT_TO_PX = {None: 1.0, 'px': 1.0, 'pt': 4 / 3, 'pc': 16.0, 'mm': 96 / 25.4, 'cm': 96 / 2.54, 'in': 96.0}
+_RGB = re.compile(r'rgba?\(\s*([0-9.]+%?)\s*,\s*([0-9.]+%?)\s*,\s*([0-9.]+%?)')
+
+
+def parse_color(value: str) -> Optional[Tuple[int, int, int]]:
+    """Parse an SVG/CSS color (#rgb, #rrggbb, rgb(), or a basic named color)"""
+    value = value.strip().lower()
+    if value.startswith('#'):
+        hex_digits = value[1:]
+        if len(hex_digits) in (3, 4):
+            hex_digits = ''.join(c * 2 for c in hex_digits[:3])
+        if len(hex_digits) in (6, 8):
+            try:
+                return tuple(int(hex_digits[i:i + 2], 16) for i in (0, 2, 4))
+            except ValueError:
+                return None
+        return None
+    match = _RGB.match(value)
+    if match:
+        channels = []
+        for part in match.groups():
+            number = float(part.rstrip('%'))
+            channels.append(int(min(255, number * 2.55 if part.endswith('%') else number)))
+        return tuple(channels)
+    return NAMED_COLORS.get(value)
+
+
+def _luminance(rgb: Tuple[int, int, int]) -> float:
+    # Same weights as cv2's RGB -> gray conversion
+    return 0.299 * rgb[0] + 0.587 * rgb[1] + 0.114 * rgb[2]
+
+
+def color_contrast(colors: List[Tuple[int, int, int]]) -> Optional[float]:
+    """
+    Contrast estimate (std / 128 * 2, capped at 2.0, the scale used for raster
+    images) from the luminance of each color use, or None if there are no colors
+    """
+    if not colors:
+        return None
+    luminance = np.array([_luminance(c) for c in colors])
+    return float(min(2.0, luminance.std() / 128.0 * 2))
+
+
+def _parse_length(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    match = _LENGTH.match(value)
+    if not match:
+        return None  # percentages, em, etc. depend on the page
+    return float(match.group(1)) * _UNIT_TO_PX[match.group(2)]
+
+
+def svg_metadata(path: str) -> Dict[str, Any]:
+    """
+    Dimensions and color contrast of an SVG from its attributes, without rasterizing
+
+    Width/height come from the root's width/height attributes, falling back to
+    the viewBox and then to 300x150. Colors are gathered from fill, stroke,
+    stop-color and color attributes and inline style declarations.
+
+    Returns:
+        dict: width, height, contrast (float or None when there are no colors), color_count
+    """
+    width = height = None
+    colors: List[Tuple[int, int, int]] = []
+    elements = 0
+    for event, element in ET.iterparse(path, events=('start', 'end')):
+        if event == 'end':
+            # Drop children as we go so memory stays bounded on large files
+            element.clear()
+            continue
+        elements += 1
+        if elements == 1:
+            width = _parse_length(element.get('width'))
+            height = _parse_length(element.get('height'))
+            view_box = element.get('viewBox')
+            if view_box and (width is None or height is None):
+                parts = re.split(r'[\s,]+', view_box.strip())
+                if len(parts) == 4:
+                    try:
+                        vb_width, vb_height = float(parts[2]), float(parts[3])
+                        # Keep the viewBox aspect ratio when only one side is given
+                        if width is not None and vb_width:
+                            height = width * vb_height / vb_width
+                        elif height is not None and vb_height:
+                            width = height * vb_width / vb_height
+                        else:
+                            width, height = vb_width, vb_height
+                    except ValueError:
+                        pass
+
+        declarations = dict(element.attrib)
+        for declaration in element.get('style', '').split(';'):
+            if ':' in declaration:
+                key, value = declaration.split(':', 1)
+                declarations[key.strip()] = value
+        for attribute in COLOR_ATTRIBUTES:
+            if attribute in declarations:
+                color = parse_color(declarations[attribute])
+                if color is not None:
+                    colors.append(color)
+
+        if elements >= SVG_MAX_ELEMENTS:
+            break
+
+    if not width or not height:
+        width, height = SVG_DEFAULT_SIZE
+    return {
+        "width": int(round(width)),
+        "height": int(round(height)),
+        "contrast": color_contrast(colors),
+        "color_count": len(colors)
+    }
+
+
+def cad_metadata(path: str) -> Dict[str, Any]:
+    """
+    Dimensions and color contrast of a CAD file from its header only
+
+    Only the first CAD_HEADER_BYTES are read. For ASCII DXF content the drawing
+    extents ($EXTMIN/$EXTMAX) give the aspect ratio, scaled so the longer side is
+    CAD_NOMINAL_SIDE pixels, and entity colors (group code 62) feed the contrast
+    estimate. Binary or unrecognized files get a square CAD_NOMINAL_SIDE size
+    and no contrast estimate.
+
+    Returns:
+        dict: width, height, contrast (float or None), color_count
+    """
+    with open(path, 'rb') as f:
+        header = f.read(CAD_HEADER_BYTES)
+    lines = header.decode('ascii', errors='ignore').splitlines()
+    # DXF is a sequence of (group code, value) line pairs
+    pairs = [(lines[i].strip(), lines[i + 1].strip()) for i in range(0, len(lines) - 1, 2)]
+
+    extents = {}
+    colors: List[Tuple[int, int, int]] = []
+    variable = None
+    for code, value in pairs:
+        if code == '9':
+            variable = value
+        elif variable in ('$EXTMIN', '$EXTMAX') and code in ('10', '20'):
+            try:
+                extents[(variable, code)] = float(value)
+            except ValueError:
+                pass
+        elif code == '62':
+            try:
+                color = ACI_COLORS.get(abs(int(value)))
+            except ValueError:
+                color = None
+            if color is not None:
+                colors.append(color)
+        if code == '0':
+            variable = None
+
+    width = height = CAD_NOMINAL_SIDE
+    if len(extents) == 4:
+        extent_x = extents[('$EXTMAX', '10')] - extents[('$EXTMIN', '10')]
+        extent_y = extents[('$EXTMAX', '20')] - extents[('$EXTMIN', '20')]
+        if extent_x > 0 and extent_y > 0:
+            scale = CAD_NOMINAL_SIDE / max(extent_x, extent_y)
+            width = max(1, int(round(extent_x * scale)))
+            height = max(1, int(round(extent_y * scale)))
+
+    return {
+        "width": width,
+        "height": height,
+        "contrast": color_contrast(colors),
+        "color_count": len(colors)
+    }